@@ -1,19 +1,23 @@
-import io
 import os
 import shutil
-import subprocess
-import sys
 import tempfile
-import time
 from contextlib import contextmanager
-from xml.etree import ElementTree as ET
 
-import requests
 import streamlit as st
-from src.oa_api_helper import get_pmc_ftp_url, search_pmc_by_title
 
-os.chmod('./kepubify-linux-64bit', 0o755)
-MAX_ARTICLE_NUM = 8
+from convert import ArticlePrefetcher
+from make_epub import bundle_volumes, epub_file_name
+from src import metrics
+from src.chapter_cache import get_chapter_cache
+from src.http_client import get_client
+from src.metadata_cache import cache_stats, named_cache
+from src.oa_api_helper import get_pmc_ftp_urls, search_open_access
+
+MAX_ARTICLE_NUM = 32
+# larger selections are split into volumes of this many articles
+VOLUME_ARTICLES = 8
+# a title search adds at most this many hits
+SEARCH_PAGE_SIZE = 8
 @contextmanager
 def temporary_directory():
     """
@@ -28,87 +32,70 @@ def temporary_directory():
     finally:
         shutil.rmtree(dirpath)
 
-def get_cache():
-    """
-    Retrieve or initialize the cache using st.session_state.
-
-    :return: A dictionary serving as the cache.
-    :rtype: dict
-    """
-    if 'cache_data' not in st.session_state:
-        st.session_state.cache_data = {}
-    return st.session_state.cache_data
-
-def cache_with_expiry(fn, maxsize=100, expiry=3600):
-    """
-    Decorator to cache function results with a specified expiry.
-
-    :param fn: The function to be decorated.
-    :type fn: function
-    :param maxsize: Maximum size of cache, defaults to 100.
-    :type maxsize: int, optional
-    :param expiry: Cache expiration time in seconds, defaults to 3600.
-    :type expiry: int, optional
-    :return: The decorated function.
-    :rtype: function
-    """
-    def wrapper(pmc_id):
-        cache = get_cache()
-
-        # Check if value is in cache and not expired
-        if pmc_id in cache and not time.time() - cache[pmc_id]['timestamp'] > expiry:
-            return cache[pmc_id]['value']
-
-        # Fetch the fresh value
-        result = fn(pmc_id)
-
-        # Cache eviction if needed
-        if len(cache) >= maxsize:
-            oldest_key = min(cache.keys(), key=lambda k: cache[k]['timestamp'])
-            del cache[oldest_key]
-
-        # Store the new value in cache
-        cache[pmc_id] = {'value': result, 'timestamp': time.time()}
-        return result
-
-    return wrapper
-
-#@cache_with_expiry
 def get_articles_summary(pmc_ids: list) -> dict:
     """
     Fetches article summary details using the provided list of PMC IDs.
 
+    Summaries are kept in a process-wide cache shared by all sessions; only the IDs missing
+    from it are requested from esummary, in one call.
+
     :param pmc_ids: A list of PMC IDs for the articles.
     :type pmc_ids: list[str]
     :return: A dictionary where the keys are PMC IDs and the values are dictionaries containing the article title and its open access status.
     :rtype: dict
     """
-    base_url = "https://eutils.ncbi.nlm.nih.gov/entrez/eutils/esummary.fcgi"
-    num2pmc_id = {i[3:]:i for i in pmc_ids}
-    params = {
-        "db": "pmc",
-        "id": ",".join(num2pmc_id.keys()),
-        "retmode": "json"
-    }
-
-    response = requests.get(base_url, params=params)
-    data = response.json()
-
+    cache = named_cache('article_summaries', maxsize=10000, ttl=24 * 3600)
     result = {}
-    for pmc_id in num2pmc_id:
-        article_details = data.get("result", {}).get(pmc_id, {})
-        title = article_details.get("title", "Title not found")
-        result[num2pmc_id[pmc_id]] = {
-            "title": title,
+    for pmc_id in pmc_ids:
+        summary = cache.get(pmc_id)
+        if summary is not None:
+            result[pmc_id] = summary
+
+    num2pmc_id = {i[3:]:i for i in pmc_ids if i not in result}
+    if num2pmc_id:
+        base_url = "https://eutils.ncbi.nlm.nih.gov/entrez/eutils/esummary.fcgi"
+        params = {
+            "db": "pmc",
+            "id": ",".join(num2pmc_id.keys()),
+            "retmode": "json"
         }
-    return result
+
+        response = get_client().get(base_url, params=params)
+        data = response.json()
+
+        for pmc_id in num2pmc_id:
+            article_details = data.get("result", {}).get(pmc_id, {})
+            title = article_details.get("title")
+            summary = {"title": title or "Title not found"}
+            if title:
+                cache.set(num2pmc_id[pmc_id], summary)
+            result[num2pmc_id[pmc_id]] = summary
+    return {pmc_id: result[pmc_id] for pmc_id in pmc_ids}
+
+def get_session_dir() -> str:
+    """Return the temporary directory of the current session, holding its built volumes."""
+    if 'session_dir' not in st.session_state:
+        # removed when the session state is dropped
+        st.session_state.session_dir = tempfile.TemporaryDirectory(prefix='pubmed2epub-')
+    return st.session_state.session_dir.name
+
+def get_prefetcher() -> ArticlePrefetcher:
+    """Return the prefetcher of the current session, which prepares selected articles in the background."""
+    if 'prefetcher' not in st.session_state:
+        # chapters prebuilt by any session are reused, so a rebuild only renders new articles
+        st.session_state.prefetcher = ArticlePrefetcher(chapter_cache=get_chapter_cache())
+    return st.session_state.prefetcher
 
 def delete_item(item_id):
     """Delete an item from stored_ids by index."""
     st.session_state.stored_ids.remove(item_id)
+    get_prefetcher().cancel(item_id)
 
-def is_valid_id(pmc_id: str):
-    return pmc_id.startswith('PMC') and get_pmc_ftp_url(pmc_id)[0]
+def filter_valid_ids(pmc_ids: list) -> list:
+    """Keep the open access PMC IDs, resolving them in one concurrent batch."""
+    pmc_ids = [pmc_id for pmc_id in pmc_ids if pmc_id.startswith('PMC')]
+    oa_status = get_pmc_ftp_urls(pmc_ids)
+    return [pmc_id for pmc_id in pmc_ids if oa_status[pmc_id][0]]
 
 def _update_states_by_input(ids: list):
     if type(MAX_ARTICLE_NUM) is int:
@@ -116,46 +103,41 @@ def _update_states_by_input(ids: list):
     summary_dict = get_articles_summary(ids)
     for pmc_id, details in summary_dict.items():
         st.session_state.stored_ids.add(pmc_id)
+        get_prefetcher().submit(pmc_id)
         st.session_state.cached_titles[pmc_id] = details['title']
     st.session_state.widget = ""
 
 def submit_ids():
     ids = [item.strip() for item in st.session_state.widget.split(",")]
-    ids = [pmc_id for pmc_id in ids if is_valid_id(pmc_id)]
+    ids = filter_valid_ids(ids)
     _update_states_by_input(ids)
 
+def _add_hits(hits: list):
+    """Select search hits, which already carry their summary."""
+    hits = [hit for hit in hits if hit.pmc_id not in st.session_state.stored_ids]
+    hits = hits[:max(MAX_ARTICLE_NUM - len(st.session_state.stored_ids), 0)]
+    for hit in hits:
+        st.session_state.stored_ids.add(hit.pmc_id)
+        get_prefetcher().submit(hit.pmc_id)
+        st.session_state.cached_titles[hit.pmc_id] = hit.title
+        st.session_state.cached_hits[hit.pmc_id] = hit
+    st.session_state.widget = ""
+
 def submit_title():
-    ids = ['PMC' + str(i) for i in search_pmc_by_title(st.session_state.widget)]
-    ids = [pmc_id for pmc_id in ids if is_valid_id(pmc_id)]
-    _update_states_by_input(ids)
+    # hits are open access already, no per-hit OA lookup or summary request is needed
+    results = search_open_access(st.session_state.widget, max_results=SEARCH_PAGE_SIZE)
+    _add_hits(results.hits)
 
-def execute_command(cmd: list[str]) -> None:
-    """
-    Execute a subprocess command and write the output or error to Streamlit.
+def _read_bytes(file_name: str) -> bytes:
+    # Read the EPUB file in binary mode
+    with open(file_name, "rb") as f:
+        return f.read()
 
-    :param cmd: The command to execute as a list.
-    """
-    result = subprocess.run(cmd, capture_output=True, text=True)
-    action = cmd[1] if len(cmd) > 1 else cmd[0]
-    #if result.returncode == 0:
-    #    st.write(f"{action} successfully!")
-    #    st.write(result.stdout)
-    #else:
-    #    st.write(f"Execution failed: {' '.join(cmd)}")
-    #    st.write(result.stderr)
-
-def run_command(html_dir: str, output_file: str = 'ebook.epub'):
-    """Runs an external Python script with arguments."""
-    for pmc_id in st.session_state.stored_ids:
-        execute_command([f"{sys.executable}", "make_pmc_html.py", pmc_id, '--output_dir', html_dir])
-    cmd = [f"{sys.executable}", "make_epub.py", '--pmc_ids'] + [','.join(st.session_state.stored_ids)]
-    cmd += ['--input_dir', html_dir]
-    cmd += ['--output_file', output_file]
-    execute_command(cmd)
-
-def kepubify(file_name: str):
-    execute_command(["./kepubify-linux-64bit", file_name, '-i'])
-    #os.system(f'''./kepubify-linux-64bit {file_name} -i''')
+def run_command(output_file: str = 'ebook.epub', kepub: bool = False) -> list:
+    """Packages the selected articles, prepared in the background, into EPUB or Kobo KEPUB volumes."""
+    with metrics.span('build'):
+        return get_prefetcher().build_volumes(sorted(st.session_state.stored_ids), output_file, kepub=kepub,
+                                              volume_articles=VOLUME_ARTICLES)
 
 def main():
     st.title("EPubify PMC")
@@ -165,6 +147,8 @@ def main():
         st.session_state.stored_ids = set()
     if 'cached_titles' not in st.session_state:
         st.session_state.cached_titles = {}
+    if 'cached_hits' not in st.session_state:
+        st.session_state.cached_hits = {}
 
     # User input for comma-separated item IDs
     if 'text_input' not in st.session_state:
@@ -179,6 +163,7 @@ def main():
         'KOBO friendly format:',
         ('Yes', 'No')
     )
+    show_metrics = cols[2].checkbox('Show build metrics')
     if search_option == 'PMC ID':
         st.text_input("Add PMC IDs with commas (e.g. PMC5447237)", key='widget', on_change=submit_ids)
         st.text(f'''max {MAX_ARTICLE_NUM} articles''')
@@ -190,33 +175,55 @@ def main():
         title = st.session_state.cached_titles[pmc_id]
         col1, col2 = st.columns([4, 1])  # Adjust these numbers for column width ratio
         col1.write(f"{pmc_id}: {title}")
+        hit = st.session_state.cached_hits.get(pmc_id)
+        if hit is not None:
+            col1.caption(' · '.join(part for part in (hit.authors, hit.journal, hit.pub_date) if part))
         # Callback button to delete an individual item
         delete_btn = col2.button("Delete", key = f'delete_{pmc_id}', on_click=delete_item, args=(pmc_id, ))
 
+    kepub = kepubify_option == 'Yes'
     if st.button("Save Selected Papers to EPUB"):
-        with temporary_directory() as tmp_dir:
-            epub_name = os.path.join(tmp_dir, 'ebook.epub')
-            run_command(tmp_dir, epub_name)
-
-            if kepubify_option == 'Yes':
-                kepubify(epub_name)
-                #epub_name = os.path.join(tmp_dir, 'ebook_converted.kepub.epub')
-
-            # Read the EPUB file in binary mode
-            with open(epub_name, "rb") as f:
-                binary_data = f.read()
-
-            buffer = io.BytesIO()
-            buffer.write(binary_data)
-            buffer.seek(0)
+        previous = st.session_state.pop('build', None)
+        if previous is not None:
+            shutil.rmtree(previous['dir'], ignore_errors=True)
+        build_dir = tempfile.mkdtemp(dir=get_session_dir())
+        try:
+            with metrics.recording() as build_metrics:
+                volume_files = run_command(os.path.join(build_dir, epub_file_name(kepub=kepub)), kepub=kepub)
+        except BaseException:
+            shutil.rmtree(build_dir, ignore_errors=True)
+            raise
+        # kept in the session: clicking a download button reruns the script without this branch.
+        # Only the paths are kept, the files stay in the session directory.
+        st.session_state.build = {
+            'pmc_ids': sorted(st.session_state.stored_ids),
+            'kepub': kepub,
+            'dir': build_dir,
+            'volumes': volume_files,
+            'zip': None,
+            'metrics': build_metrics.to_dict(),
+        }
 
+    build = st.session_state.get('build')
+    if build is not None and build['pmc_ids'] == sorted(st.session_state.stored_ids) and build['kepub'] == kepub:
+        volume_files = build['volumes']
+        if len(volume_files) > 1:
+            # the zip is only made for those who want it
+            if build['zip'] is None and st.button(f"Bundle all {len(volume_files)} volumes into a zip"):
+                build['zip'] = bundle_volumes(volume_files, os.path.join(build['dir'], 'ebook-volumes.zip'))
+            if build['zip'] is not None:
+                st.download_button(label=f"Download all {len(volume_files)} volumes (zip)",
+                                   data=_read_bytes(build['zip']), file_name=os.path.basename(build['zip']),
+                                   mime="application/zip", key="download_zip")
+        for number, volume_file in enumerate(volume_files, start=1):
+            label = "Download EPUB File" if len(volume_files) == 1 else f"Download volume {number}"
             # Stream the EPUB file to the user
-            st.download_button(
-                label="Download EPUB File",
-                data=buffer,
-                file_name="ebook.epub",
-                mime="application/epub+zip"
-            )
+            file_name = os.path.basename(volume_file)
+            st.download_button(label=label, data=_read_bytes(volume_file), file_name=file_name,
+                               mime="application/epub+zip", key=f"download_{file_name}")
+        if show_metrics:
+            st.json({'build': build['metrics'], 'metadata_caches': cache_stats(),
+                     'http': get_client().get_stats()})
     st.markdown("---")
     st.markdown(
         "More infos and :star: at [github.com/howchihlee/pubmed2epub](https://github.com/howchihlee/pubmed2epub)"
@@ -0,0 +1,189 @@
+"""
+Offline benchmarks of the conversion pipeline.
+
+Runs every stage on a checked-in small article and on synthetic typical and huge articles,
+reports the best wall time and the peak Python-traced memory (tracemalloc, which does
+not see libxml2's own allocations) of each stage, writes the results as
+JSON and compares them with a stored baseline::
+
+    python benchmarks/run_benchmarks.py --output bench.json
+    python benchmarks/run_benchmarks.py --save_baseline          # record benchmarks/baseline.json
+    python benchmarks/run_benchmarks.py --threshold 0.2          # exit 1 on a >20% regression
+"""
+import argparse
+import atexit
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+# keep derived figures of the benchmark out of the user's image cache
+IMAGE_CACHE_DIR = tempfile.mkdtemp(prefix='pubmed2epub-bench-images-')
+atexit.register(shutil.rmtree, IMAGE_CACHE_DIR, ignore_errors=True)
+os.environ['PUBMED2EPUB_IMAGE_CACHE_DIR'] = IMAGE_CACHE_DIR
+sys.path.insert(0, REPO_DIR)
+
+# these imports need REPO_DIR on sys.path and the image cache directory set above
+import make_epub  # isort:skip
+import make_pmc_html  # isort:skip
+from lxml import etree  # isort:skip
+from src import oa_api_helper, oa_parser  # isort:skip
+from src.article_cache import ArticleCache  # isort:skip
+
+import synthetic  # isort:skip
+
+DEFAULT_BASELINE = os.path.join(BENCH_DIR, 'baseline.json')
+CSS_FILE = os.path.join(REPO_DIR, 'styles', 'style.css')
+# last update of every benchmark package, which is cached under this version instead of being looked up online
+PACKAGE_UPDATED = '2024-01-01 00:00:00'
+
+def _fixtures():
+    """Return (name, pmc_id, nxml text, figure names) for every benchmark article."""
+    with open(os.path.join(BENCH_DIR, 'fixtures', 'PMC0000001.nxml'), 'r', encoding='utf-8') as f:
+        yield 'small', 'PMC0000001', f.read(), ['fixture-g001']
+    for i, (name, size) in enumerate(synthetic.SIZES.items(), start=2):
+        pmc_id = f'PMC{i:07d}'
+        figures = [f'synthetic-g{n:03d}' for n in range(1, size['figures'] + 1)]
+        yield name, pmc_id, synthetic.make_article(pmc_id, **size), figures
+
+def measure(fn, setup=None, repeat: int = 5) -> dict:
+    """
+    Time fn over repeat runs and trace its peak memory in one extra run.
+
+    :param fn: The stage, called with the value returned by setup.
+    :param setup: Prepares the input of each run, not measured.
+    :return: The best wall time in seconds and the peak traced allocation in bytes.
+    :rtype: dict
+    """
+    setup = setup or (lambda: None)
+    best = float('inf')
+    for _ in range(repeat):
+        arg = setup()
+        start = time.perf_counter()
+        fn(arg)
+        best = min(best, time.perf_counter() - start)
+
+    arg = setup()
+    tracemalloc.start()
+    try:
+        fn(arg)
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return {'seconds': best, 'peak_bytes': peak}
+
+def bench_article(work_dir: str, pmc_id: str, nxml: str, figures: list, repeat: int) -> dict:
+    package_dir = os.path.join(work_dir, 'package', pmc_id)
+    synthetic.write_article(package_dir, pmc_id, nxml, figures)
+    nxml_file = os.path.join(package_dir, f'{pmc_id}.nxml')
+    cache = ArticleCache(os.path.join(work_dir, 'cache'), max_bytes=1 << 40)
+    cache.put(pmc_id, lambda path: shutil.copytree(package_dir, os.path.join(path, pmc_id)),
+              make_pmc_html.package_version(PACKAGE_UPDATED))
+    html_dir = os.path.join(work_dir, 'html')
+
+    def parse(_=None):
+        return etree.parse(nxml_file)
+
+    def clear_citations():
+        oa_parser._citation_cache.clear()
+        return parse()
+
+    def clear_caches():
+        # every run renders the figures, as for an article converted for the first time
+        shutil.rmtree(IMAGE_CACHE_DIR)
+        os.makedirs(IMAGE_CACHE_DIR)
+        return clear_citations()
+
+    tree = parse()
+    sections = tree.xpath('/article/body/sec')
+    fragments = [e['data']['text'] for sec in sections for e in oa_parser.collect_elements(sec) if e['type'] != 'sec']
+    linked = [oa_parser.replace_xref_with_link(text) for text in fragments]
+
+    results = {
+        'parse': measure(parse, repeat=repeat),
+        'parse_article': measure(oa_parser.parse_article, parse, repeat),
+        'collect_elements': measure(lambda t: [oa_parser.collect_elements(s) for s in t.xpath('/article/body/sec')],
+                                    parse, repeat),
+        'replace_xref_with_link': measure(lambda _: [oa_parser.replace_xref_with_link(t) for t in fragments],
+                                          repeat=repeat),
+        'convert_figs': measure(lambda _: [oa_parser.convert_figs(t) for t in linked], repeat=repeat),
+        'render_body': measure(oa_parser.render_body, parse, repeat),
+        'create_reference_section': measure(oa_parser.create_reference_section, clear_citations, repeat),
+        'make_pmc_html.main': measure(lambda _: make_pmc_html.main(pmc_id, html_dir, cache), clear_caches, repeat),
+    }
+    epub_file = os.path.join(work_dir, f'{pmc_id}.epub')
+    results['make_epub.main'] = measure(lambda _: make_epub.main([pmc_id], html_dir, epub_file, CSS_FILE),
+                                        repeat=repeat)
+    return results
+
+def run(repeat: int) -> dict:
+    # the benchmarks run offline
+    oa_api_helper.get_pmc_package = lambda pmc_id: (f'ftp://ftp.example.org/{pmc_id}.tar.gz', PACKAGE_UPDATED)
+    results = {}
+    for name, pmc_id, nxml, figures in _fixtures():
+        with tempfile.TemporaryDirectory() as work_dir:
+            results[name] = bench_article(work_dir, pmc_id, nxml, figures, repeat)
+    return results
+
+def compare(results: dict, baseline: dict, threshold: float, min_seconds: float) -> list:
+    """
+    List the stages slower or more memory hungry than baseline by more than threshold.
+
+    Stages faster than min_seconds in the baseline are only checked for memory, their
+    timings are too noisy to compare.
+    """
+    regressions = []
+    for fixture, stages in results.items():
+        for stage, result in stages.items():
+            base = baseline.get(fixture, {}).get(stage)
+            if base is None:
+                continue
+            if base['seconds'] >= min_seconds and result['seconds'] > base['seconds'] * (1 + threshold):
+                regressions.append(f"{fixture}/{stage}: {result['seconds']:.4f}s vs {base['seconds']:.4f}s")
+            if result['peak_bytes'] > base['peak_bytes'] * (1 + threshold):
+                regressions.append(f"{fixture}/{stage}: {result['peak_bytes']} B vs {base['peak_bytes']} B peak")
+    return regressions
+
+def print_results(results: dict):
+    for fixture, stages in results.items():
+        print(fixture)
+        for stage, result in stages.items():
+            print(f"  {stage:<28}{result['seconds'] * 1000:>10.2f} ms{result['peak_bytes'] / 1024:>12.0f} KiB")
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description='Benchmark the pmc to epub conversion pipeline.')
+    parser.add_argument('--output', type=str, default=None, help='File to write the results to as JSON.')
+    parser.add_argument('--baseline', type=str, default=DEFAULT_BASELINE, help='Baseline results to compare with.')
+    parser.add_argument('--save_baseline', action='store_true', help='Store the results as the new baseline.')
+    parser.add_argument('--threshold', type=float, default=0.25,
+                        help='Allowed relative slowdown or memory growth per stage, defaults to 0.25.')
+    parser.add_argument('--min_seconds', type=float, default=0.005,
+                        help='Stages faster than this in the baseline are not compared on time.')
+    parser.add_argument('--repeat', type=int, default=5, help='Timed runs per stage, the best one is kept.')
+    return parser.parse_args()
+
+if __name__ == '__main__':
+    args = parse_arguments()
+    results = run(args.repeat)
+    print_results(results)
+    report = {'python': platform.python_version(), 'machine': platform.machine(), 'results': results}
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    if args.save_baseline:
+        with open(args.baseline, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f'baseline written to {args.baseline}')
+    elif os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)['results']
+        regressions = compare(results, baseline, args.threshold, args.min_seconds)
+        for regression in regressions:
+            print(f'REGRESSION {regression}')
+        sys.exit(1 if regressions else 0)
@@ -0,0 +1,75 @@
+import os
+
+from PIL import Image
+
+# sizes of the generated articles: sections, subsections per section, figures, references
+SIZES = {
+    'typical': {'sections': 8, 'subsections': 3, 'figures': 6, 'references': 60},
+    'huge': {'sections': 60, 'subsections': 4, 'figures': 80, 'references': 1500},
+}
+
+PARAGRAPH = ('Lorem ipsum dolor sit amet, consectetur adipiscing elit, sed do eiusmod tempor '
+             'incididunt ut labore et dolore magna aliqua <xref ref-type="bibr" rid="R{ref}">{ref}</xref>. '
+             'Ut enim ad minim veniam, quis nostrud exercitation <italic>ullamco</italic> laboris '
+             '<xref ref-type="fig" rid="F{fig}">Figure {fig}</xref>.')
+
+def _paragraphs(count, seed, references, figures):
+    return ''.join(
+        f'<p>{PARAGRAPH.format(ref=(seed + i) % references + 1, fig=(seed + i) % max(figures, 1) + 1)}</p>'
+        for i in range(count)
+    )
+
+def _figure(n):
+    return (f'<fig id="F{n}"><label>Figure {n}</label><caption><p>Caption of figure {n} '
+            f'<xref ref-type="bibr" rid="R1">1</xref>.</p></caption>'
+            f'<graphic xlink:href="synthetic-g{n:03d}"/></fig>')
+
+def _reference(n):
+    doi = f'<pub-id pub-id-type="doi">10.0000/synthetic.{n}</pub-id>' if n % 3 else ''
+    return (f'<ref id="R{n}"><element-citation publication-type="journal"><person-group person-group-type="author">'
+            f'<name><surname>Author{n}</surname><given-names>A</given-names></name>'
+            f'<name><surname>Coauthor{n}</surname><given-names>B</given-names></name></person-group>'
+            f'<article-title>Synthetic reference number {n}</article-title><source>J Synth</source>'
+            f'<year>{1990 + n % 30}</year>{doi}</element-citation></ref>')
+
+def make_article(pmc_id: str, sections: int, subsections: int, figures: int, references: int) -> str:
+    """
+    Build a JATS article with the given number of sections, figures and references.
+
+    :return: The nxml document.
+    :rtype: str
+    """
+    figs_per_section = -(-figures // sections) if figures else 0
+    body, fig = [], 1
+    for s in range(1, sections + 1):
+        section_figs = []
+        for _ in range(figs_per_section):
+            if fig <= figures:
+                section_figs.append(_figure(fig))
+                fig += 1
+        subs = ''.join(
+            f'<sec id="S{s}-{j}"><title>Subsection {s}.{j}</title>{_paragraphs(3, s * j, references, figures)}</sec>'
+            for j in range(1, subsections + 1)
+        )
+        body.append(f'<sec id="S{s}"><title>Section {s}</title>{_paragraphs(4, s, references, figures)}'
+                    f'{"".join(section_figs)}{subs}</sec>')
+    refs = ''.join(_reference(n) for n in range(1, references + 1))
+    return f'''<?xml version="1.0" encoding="UTF-8"?>
+<article xmlns:xlink="http://www.w3.org/1999/xlink" xmlns:mml="http://www.w3.org/1998/Math/MathML" article-type="research-article">
+<front><article-meta><article-id pub-id-type="pmc">{pmc_id}</article-id>
+<title-group><article-title>Synthetic article {pmc_id}</article-title></title-group>
+<contrib-group><contrib contrib-type="author"><name><surname>Doe</surname><given-names>Jane</given-names></name></contrib>
+<contrib contrib-type="author"><name><surname>Roe</surname><given-names>Richard</given-names></name></contrib></contrib-group>
+<abstract><p>Synthetic abstract.</p></abstract><kwd-group><kwd>synthetic</kwd></kwd-group></article-meta></front>
+<body>{''.join(body)}</body>
+<back><ref-list>{refs}</ref-list></back>
+</article>
+'''
+
+def write_article(directory: str, pmc_id: str, nxml: str, figures: list):
+    """Write an nxml document and small JPEG figures the way an extracted OA package is laid out."""
+    os.makedirs(directory, exist_ok=True)
+    with open(os.path.join(directory, f'{pmc_id}.nxml'), 'w', encoding='utf-8') as f:
+        f.write(nxml)
+    for i, name in enumerate(figures):
+        Image.new('RGB', (640, 480), (i * 37 % 256, 90, 160)).save(os.path.join(directory, f'{name}.jpg'))
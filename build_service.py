@@ -0,0 +1,307 @@
+import argparse
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from convert import convert_articles
+from make_epub import bundle_volumes, epub_file_name
+from src import metrics
+from src.chapter_cache import get_chapter_cache
+from src.http_client import get_client
+from src.image_optimizer import PROFILES
+
+QUEUED, RUNNING, DONE, FAILED = 'queued', 'running', 'done', 'failed'
+
+
+class BuildJob:
+    """One EPUB build: the articles, the options and the state of the build."""
+    def __init__(self, pmc_ids: list, kepub: bool, image_profile: str, text_only: bool = False,
+                 volume_articles: int = None, volume_bytes: int = None):
+        self.id = uuid.uuid4().hex
+        self.pmc_ids = pmc_ids
+        self.kepub = kepub
+        self.image_profile = image_profile
+        self.text_only = text_only
+        self.volume_articles = volume_articles
+        self.volume_bytes = volume_bytes
+        self.volumes = None
+        self.status = QUEUED
+        self.error = None
+        self.artifact = None
+        self.metrics = None
+        self.created = time.time()
+        self.finished = None
+        # artifact downloads in progress, see BuildService.open_artifact
+        self.readers = 0
+
+    @property
+    def key(self) -> tuple:
+        return (tuple(self.pmc_ids), self.kepub, self.image_profile, self.text_only,
+                self.volume_articles, self.volume_bytes)
+
+    @property
+    def file_name(self) -> str:
+        return epub_file_name(self.kepub)
+
+    @property
+    def artifact_name(self) -> str:
+        return os.path.basename(self.artifact) if self.artifact else self.file_name
+
+    def to_dict(self) -> dict:
+        return {
+            'id': self.id,
+            'status': self.status,
+            'pmc_ids': self.pmc_ids,
+            'kepub': self.kepub,
+            'image_profile': self.image_profile,
+            'text_only': self.text_only,
+            'volume_articles': self.volume_articles,
+            'volume_bytes': self.volume_bytes,
+            'volumes': self.volumes,
+            'error': self.error,
+            'created': self.created,
+            'finished': self.finished,
+            'artifact': f'/jobs/{self.id}/artifact' if self.status == DONE else None,
+            'metrics': self.metrics,
+        }
+
+
+class BuildService:
+    """
+    Queue of EPUB builds run on a bounded pool of worker threads.
+
+    A job submitted while another one with the same articles and options is queued or
+    running shares that job instead of building the book twice. Finished jobs are kept,
+    with their EPUB in ``output_dir``, until more than ``max_jobs`` jobs exist; a job whose
+    artifact is being downloaded is kept until the download ends.
+
+    :param output_dir: Directory holding the built EPUBs.
+    :type output_dir: str
+    :param workers: Number of builds run concurrently, defaults to 2.
+    :type workers: int, optional
+    :param max_jobs: Number of jobs remembered, defaults to 100.
+    :type max_jobs: int, optional
+    :param max_articles: Largest number of articles in one job, defaults to 50.
+    :type max_articles: int, optional
+    :param chapter_cache: Cache of prebuilt chapters shared by the builds, see ``make_epub.main``.
+    :type chapter_cache: src.article_cache.ArticleCache, optional
+    """
+    def __init__(self, output_dir: str, workers: int = 2, max_jobs: int = 100, max_articles: int = 50,
+                 chapter_cache=None):
+        self.output_dir = output_dir
+        self.max_jobs = max_jobs
+        self.max_articles = max_articles
+        self.chapter_cache = chapter_cache
+        self._executor = ThreadPoolExecutor(max_workers=workers)
+        self._jobs = OrderedDict()
+        self._in_flight = {}
+        self._lock = threading.Lock()
+        os.makedirs(output_dir, exist_ok=True)
+
+    def submit(self, pmc_ids: list, kepub: bool = False, image_profile: str = 'default', text_only: bool = False,
+               volume_articles: int = None, volume_bytes: int = None):
+        """
+        Queue a build of the given articles, in PMC ID order.
+
+        With ``volume_articles`` or ``volume_bytes`` the book is split into volumes, see
+        ``make_epub.plan_volumes``; the artifact of a job with several volumes is a zip of them.
+
+        :return: The job, and whether it is an identical job already in flight.
+        :rtype: tuple[BuildJob, bool]
+        :raises ValueError: If the IDs or options are not valid; kepub and text_only must be booleans.
+        """
+        pmc_ids = sorted({pmc_id.strip() for pmc_id in pmc_ids if pmc_id.strip()})
+        if not pmc_ids or not all(pmc_id.startswith('PMC') for pmc_id in pmc_ids):
+            raise ValueError('pmc_ids must be a non-empty list of PMC IDs')
+        if len(pmc_ids) > self.max_articles:
+            raise ValueError(f'at most {self.max_articles} articles per job')
+        if image_profile not in PROFILES:
+            raise ValueError(f"image_profile must be one of {', '.join(sorted(PROFILES))}")
+        for name, value in (('kepub', kepub), ('text_only', text_only)):
+            if not isinstance(value, bool):
+                raise ValueError(f'{name} must be true or false')
+        for name, value in (('volume_articles', volume_articles), ('volume_bytes', volume_bytes)):
+            if value is not None and (not isinstance(value, int) or isinstance(value, bool) or value < 1):
+                raise ValueError(f'{name} must be a positive integer')
+
+        job = BuildJob(pmc_ids, kepub, image_profile, text_only, volume_articles, volume_bytes)
+        with self._lock:
+            shared = self._in_flight.get(job.key)
+            if shared is not None:
+                metrics.incr('build_jobs_deduplicated')
+                return shared, True
+            self._in_flight[job.key] = job
+            self._jobs[job.id] = job
+            self._forget_old_jobs()
+        metrics.incr('build_jobs')
+        self._executor.submit(self._run, job)
+        return job, False
+
+    def get(self, job_id: str):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    @contextmanager
+    def open_artifact(self, job: BuildJob):
+        """Open the artifact of a finished job, kept until it is closed; None if the job was forgotten."""
+        with self._lock:
+            kept = self._jobs.get(job.id) is job
+            if kept:
+                job.readers += 1
+        if not kept:
+            yield None
+            return
+        try:
+            with open(job.artifact, 'rb') as f:
+                yield f
+        finally:
+            with self._lock:
+                job.readers -= 1
+
+    def _run(self, job: BuildJob):
+        job.status = RUNNING
+        job_dir = os.path.join(self.output_dir, job.id)
+        os.makedirs(job_dir, exist_ok=True)
+        try:
+            with metrics.recording() as build_metrics, metrics.span('build_job'):
+                output_file = os.path.join(job_dir, job.file_name)
+                built = convert_articles(job.pmc_ids, output_file, image_profile=job.image_profile, kepub=job.kepub,
+                                         chapter_cache=self.chapter_cache, text_only=job.text_only,
+                                         volume_articles=job.volume_articles, volume_bytes=job.volume_bytes)
+                if isinstance(built, list):
+                    job.volumes = [os.path.basename(volume_file) for volume_file in built]
+                    if len(built) > 1:
+                        output_file = bundle_volumes(built, os.path.join(job_dir, 'ebook-volumes.zip'))
+                    else:
+                        output_file = built[0]
+            job.artifact = output_file
+            job.status = DONE
+        except Exception as e:
+            job.error = repr(e)
+            job.status = FAILED
+            metrics.incr('build_job_failures')
+        finally:
+            job.metrics = build_metrics.to_dict()
+            job.finished = time.time()
+            with self._lock:
+                self._in_flight.pop(job.key, None)
+
+    def _forget_old_jobs(self):
+        """Drop the oldest finished jobs and their EPUBs beyond ``max_jobs``; called with the lock held."""
+        excess = len(self._jobs) - self.max_jobs
+        for job_id, job in list(self._jobs.items()):
+            if excess <= 0:
+                break
+            if job.status in (DONE, FAILED) and not job.readers:
+                del self._jobs[job_id]
+                shutil.rmtree(os.path.join(self.output_dir, job_id), ignore_errors=True)
+                excess -= 1
+
+    def shutdown(self, wait: bool = True):
+        self._executor.shutdown(wait=wait, cancel_futures=not wait)
+
+
+class BuildRequestHandler(BaseHTTPRequestHandler):
+    """
+    HTTP front end of a ``BuildService``:
+
+    - ``POST /jobs`` with ``{"pmc_ids": [...], "kepub": false, "image_profile": "default", "text_only": false}``
+      queues a build and answers its status, 202 for a new job and 200 for a shared one;
+      ``volume_articles`` and ``volume_bytes`` split the book into volumes;
+    - ``GET /jobs/{id}`` answers the status of a job;
+    - ``GET /jobs/{id}/artifact`` downloads the EPUB, or the zip of the volumes, of a finished job;
+    - ``GET /metrics`` exposes the process metrics and the per-endpoint HTTP client counters
+      in the Prometheus format.
+    """
+    service = None
+
+    def _send_json(self, status: int, data: dict):
+        body = json.dumps(data).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        if self.path.rstrip('/') != '/jobs':
+            return self._send_json(404, {'error': 'not found'})
+        try:
+            length = int(self.headers.get('Content-Length', 0))
+            request = json.loads(self.rfile.read(length) or b'{}')
+            pmc_ids = request['pmc_ids']
+            if isinstance(pmc_ids, str):
+                pmc_ids = pmc_ids.split(',')
+            job, shared = self.service.submit(pmc_ids, request.get('kepub', False),
+                                              request.get('image_profile', 'default'), request.get('text_only', False),
+                                              request.get('volume_articles'), request.get('volume_bytes'))
+        except (ValueError, KeyError, TypeError, AttributeError) as e:
+            return self._send_json(400, {'error': str(e)})
+        self._send_json(200 if shared else 202, job.to_dict())
+
+    def do_GET(self):
+        parts = [part for part in self.path.split('?')[0].split('/') if part]
+        if parts == ['metrics']:
+            body = (metrics.REGISTRY.to_prometheus() + get_client().to_prometheus()).encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+            return
+        job = self.service.get(parts[1]) if len(parts) in (2, 3) and parts[0] == 'jobs' else None
+        if job is None:
+            return self._send_json(404, {'error': 'not found'})
+        if len(parts) == 2:
+            return self._send_json(200, job.to_dict())
+        if parts[2] != 'artifact':
+            return self._send_json(404, {'error': 'not found'})
+        if job.status != DONE:
+            return self._send_json(409, {'error': f'job is {job.status}'})
+        with self.service.open_artifact(job) as f:
+            if f is None:
+                return self._send_json(404, {'error': 'not found'})
+            self.send_response(200)
+            is_zip = job.artifact_name.endswith('.zip')
+            self.send_header('Content-Type', 'application/zip' if is_zip else 'application/epub+zip')
+            self.send_header('Content-Disposition', f'attachment; filename="{job.artifact_name}"')
+            self.send_header('Content-Length', str(os.fstat(f.fileno()).st_size))
+            self.end_headers()
+            shutil.copyfileobj(f, self.wfile)
+
+
+def serve(service: BuildService, host: str = '127.0.0.1', port: int = 8000):
+    handler = type('Handler', (BuildRequestHandler,), {'service': service})
+    server = ThreadingHTTPServer((host, port), handler)
+    print(f'build service listening on http://{host}:{server.server_port}')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        service.shutdown(wait=False)
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description='Serve EPUB builds of PMC articles over HTTP.')
+    parser.add_argument('--host', type=str, default='127.0.0.1', help='Address to listen on.')
+    parser.add_argument('--port', type=int, default=8000, help='Port to listen on.')
+    parser.add_argument('--workers', type=int, default=2, help='Number of builds run concurrently.')
+    parser.add_argument('--output_dir', type=str, default=None,
+                        help='Directory for the built EPUBs, a temporary directory by default.')
+    parser.add_argument('--max_jobs', type=int, default=100, help='Number of finished jobs kept with their EPUB.')
+    return parser.parse_args()
+
+if __name__ == '__main__':
+    args = parse_arguments()
+    output_dir = args.output_dir or tempfile.mkdtemp(prefix='pubmed2epub-builds-')
+    service = BuildService(output_dir, args.workers, args.max_jobs, chapter_cache=get_chapter_cache())
+    serve(service, args.host, args.port)
@@ -0,0 +1,186 @@
+import argparse
+import os
+import shutil
+import tempfile
+import threading
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+
+import make_epub
+import make_pmc_html
+from src import metrics, oa_api_helper
+from src.chapter_cache import chapter_version, get_chapter_cache
+
+
+def convert_articles(pmc_ids: list, output_file: str = 'ebook.epub', html_dir: str = None,
+                     css_file: str = './styles/style.css', image_profile: str = 'default', kepub: bool = False,
+                     chapter_cache=None, text_only: bool = False, volume_articles: int = None,
+                     volume_bytes: int = None):
+    """
+    Convert PMC OA articles to html and bundle them into one EPUB, or into volumes, in-process.
+
+    :param pmc_ids: The PMC IDs to convert, in chapter order.
+    :type pmc_ids: list[str]
+    :param output_file: Path of the EPUB to write, defaults to 'ebook.epub'.
+    :type output_file: str, optional
+    :param html_dir: Directory for the intermediate html pages and figures. A temporary
+        directory is used and removed afterwards if not given.
+    :type html_dir: str, optional
+    :param css_file: Stylesheet embedded in the book.
+    :type css_file: str, optional
+    :param image_profile: Name of the figure profile, see ``src.image_optimizer.PROFILES``.
+    :type image_profile: str, optional
+    :param kepub: Write a Kobo KEPUB instead of a plain EPUB, defaults to False.
+    :type kepub: bool, optional
+    :param chapter_cache: Cache of prebuilt chapters, see ``make_epub.main``; articles found in
+        it are not fetched nor rendered again.
+    :type chapter_cache: src.article_cache.ArticleCache, optional
+    :param text_only: Convert the articles from their BioC JSON text, without figures, see
+        ``make_pmc_html.main``.
+    :type text_only: bool, optional
+    :param volume_articles: Split the book into volumes of at most this many articles, see
+        ``make_epub.make_volumes``.
+    :type volume_articles: int, optional
+    :param volume_bytes: Split the book into volumes of about this many bytes.
+    :type volume_bytes: int, optional
+    :return: The path of the written EPUB, or the paths of the volumes when splitting.
+    :rtype: str or list[str]
+    """
+    pmc_ids = list(pmc_ids)
+    if html_dir is None:
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            return convert_articles(pmc_ids, output_file, tmp_dir, css_file, image_profile, kepub, chapter_cache,
+                                    text_only, volume_articles, volume_bytes)
+
+    version = chapter_version(image_profile, kepub, text_only)
+    missing = [pmc_id for pmc_id in pmc_ids if chapter_cache is None or not chapter_cache.has(pmc_id, version)]
+    # one batched idconv request instead of one per article
+    pmids = oa_api_helper.pmc_ids2pmids(missing) if text_only and missing else {}
+    for pmc_id in missing:
+        make_pmc_html.main(pmc_id, html_dir, image_profile=image_profile, text_only=text_only, pmid=pmids.get(pmc_id))
+    if volume_articles or volume_bytes:
+        return make_epub.make_volumes(pmc_ids, html_dir, output_file, css_file, kepub, chapter_cache, image_profile,
+                                      text_only, volume_articles, volume_bytes)
+    make_epub.main(pmc_ids, html_dir, output_file, css_file, kepub, chapter_cache, image_profile, text_only)
+    return output_file
+
+class ArticlePrefetcher:
+    """
+    Convert articles to html in the background as soon as they are selected.
+
+    Each submitted article is fetched and rendered into a private html directory on a small
+    thread pool, so that building the EPUB later only has to package the prepared chapters.
+    Articles already prebuilt in ``chapter_cache`` are not rendered again. The directory is
+    removed when the prefetcher is garbage collected.
+
+    :param max_workers: Number of articles prepared concurrently, defaults to 2.
+    :type max_workers: int, optional
+    :param image_profile: Name of the figure profile, see ``src.image_optimizer.PROFILES``.
+    :type image_profile: str, optional
+    :param chapter_cache: Cache of prebuilt chapters, see ``make_epub.main``.
+    :type chapter_cache: src.article_cache.ArticleCache, optional
+    """
+    def __init__(self, max_workers: int = 2, image_profile: str = 'default', chapter_cache=None):
+        self.image_profile = image_profile
+        self.chapter_cache = chapter_cache
+        self.html_dir = tempfile.mkdtemp(prefix='pubmed2epub-prefetch-')
+        self._executor = ThreadPoolExecutor(max_workers=max_workers)
+        self._futures = {}
+        self._lock = threading.Lock()
+        weakref.finalize(self, _close_prefetcher, self._executor, self.html_dir)
+
+    def _prebuilt(self, pmc_id: str, kepub: bool) -> bool:
+        return self.chapter_cache is not None and \
+            self.chapter_cache.has(pmc_id, chapter_version(self.image_profile, kepub))
+
+    def submit(self, pmc_id: str):
+        """Start preparing an article, if it is not already being prepared nor prebuilt."""
+        if not (self._prebuilt(pmc_id, kepub=False) or self._prebuilt(pmc_id, kepub=True)):
+            self._schedule(pmc_id)
+
+    def _schedule(self, pmc_id: str):
+        with self._lock:
+            if pmc_id not in self._futures:
+                self._futures[pmc_id] = self._executor.submit(self._prepare, pmc_id)
+            return self._futures[pmc_id]
+
+    def _prepare(self, pmc_id: str) -> metrics.Metrics:
+        # recorded apart and merged into the recording of the build that uses the article
+        with metrics.recording() as article_metrics:
+            make_pmc_html.main(pmc_id, self.html_dir, image_profile=self.image_profile)
+        return article_metrics
+
+    def cancel(self, pmc_id: str):
+        """Stop preparing an article; a conversion already running is discarded when it ends."""
+        with self._lock:
+            future = self._futures.pop(pmc_id, None)
+        if future is not None and not future.cancel():
+            future.add_done_callback(lambda _: self._discard(pmc_id))
+
+    def _discard(self, pmc_id: str):
+        with self._lock:
+            if pmc_id in self._futures:  # selected again in the meantime
+                return
+            html_file = os.path.join(self.html_dir, f'{pmc_id}.html')
+            if os.path.exists(html_file):
+                os.remove(html_file)
+            shutil.rmtree(os.path.join(self.html_dir, 'figs', pmc_id), ignore_errors=True)
+
+    def wait(self, pmc_ids: list, kepub: bool = False):
+        """
+        Block until the given articles are prepared, converting any that failed again.
+
+        The metrics of their preparation are added to the caller's ``metrics.recording``.
+        """
+        for pmc_id in pmc_ids:
+            if self._prebuilt(pmc_id, kepub):
+                continue
+            try:
+                metrics.merge(self._schedule(pmc_id).result())
+            except Exception:
+                with self._lock:
+                    self._futures.pop(pmc_id, None)
+                make_pmc_html.main(pmc_id, self.html_dir, image_profile=self.image_profile)
+
+    def build(self, pmc_ids: list, output_file: str = 'ebook.epub', css_file: str = './styles/style.css',
+              kepub: bool = False) -> str:
+        """Package the prepared articles into an EPUB, or a Kobo KEPUB, waiting for the ones still in progress."""
+        pmc_ids = list(pmc_ids)
+        self.wait(pmc_ids, kepub)
+        make_epub.main(pmc_ids, self.html_dir, output_file, css_file, kepub, self.chapter_cache, self.image_profile)
+        return output_file
+
+    def build_volumes(self, pmc_ids: list, output_file: str = 'ebook.epub', css_file: str = './styles/style.css',
+                      kepub: bool = False, volume_articles: int = None, volume_bytes: int = None) -> list:
+        """Like ``build``, split into volumes by ``make_epub.make_volumes``; return the volume paths."""
+        pmc_ids = list(pmc_ids)
+        self.wait(pmc_ids, kepub)
+        return make_epub.make_volumes(pmc_ids, self.html_dir, output_file, css_file, kepub, self.chapter_cache,
+                                      self.image_profile, max_articles=volume_articles, max_bytes=volume_bytes)
+
+def _close_prefetcher(executor, html_dir):
+    executor.shutdown(wait=False, cancel_futures=True)
+    shutil.rmtree(html_dir, ignore_errors=True)
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description='Convert PMC articles into a single EPUB.')
+    parser.add_argument('--pmc_ids', type=str, required=True, help='The PMC IDs to be processed. IDs are comma separated')
+    parser.add_argument('--html_dir', type=str, default=None, help='Directory to keep the intermediate html pages.')
+    parser.add_argument('--output_file', type=str, default='ebook.epub', help='The file to write output to.')
+    parser.add_argument('--image_profile', type=str, default='default', help='Figure profile: default, eink or original.')
+    parser.add_argument('--kepub', action='store_true',
+                        help='Write a Kobo KEPUB; name the output file *.kepub.epub for Kobo readers to use it.')
+    parser.add_argument('--text_only', action='store_true',
+                        help='Convert from the BioC JSON text of the articles, without figures; much smaller downloads.')
+    parser.add_argument('--volume_articles', type=int, default=None, help='Split the book into volumes of this many articles.')
+    parser.add_argument('--volume_bytes', type=int, default=None, help='Split the book into volumes of about this many bytes.')
+    parser.add_argument('--reuse_chapters', action='store_true',
+                        help='Keep prebuilt chapters in the chapter cache and reuse them in later builds.')
+    return parser.parse_args()
+
+if __name__ == '__main__':
+    args = parse_arguments()
+    pmc_ids = [s for s in args.pmc_ids.split(',') if s.startswith('PMC')]
+    convert_articles(pmc_ids, args.output_file, args.html_dir, image_profile=args.image_profile, kepub=args.kepub,
+                     chapter_cache=get_chapter_cache() if args.reuse_chapters else None, text_only=args.text_only,
+                     volume_articles=args.volume_articles, volume_bytes=args.volume_bytes)
@@ -1,75 +1,243 @@
 import argparse
-import glob
-
-from ebooklib import epub
-
-
-def main(pmc_ids, html_dir:str,  output_file:str, css_file:str = './styles/style.css'):
-    book = epub.EpubBook()
-    # set metadata
-    book.set_identifier("id123456")
-    book.set_title("Pubmed paper collection")
-    book.set_language("en")
-    book.add_author("Awesome author")
-
-    # define CSS style
-    with open(css_file, 'r', encoding='utf-8') as file:
-        style = file.read()
-    nav_css = epub.EpubItem(
-        uid="style_nav",
-        file_name=f"style/style.css",
-        media_type="text/css",
-        content=style,
-    )
-
-    toc = []
-    chapters = []
-    for i, pmc_id in enumerate(pmc_ids):
-        with open(f'{html_dir}/{pmc_id}.html', 'r', encoding='utf-8') as f:
-            html_content = f.read()
-
-        # create chapter
-        c1 = epub.EpubHtml(title=f"{pmc_id}", file_name=f"{pmc_id}.xhtml", lang="en")
-        c1.content = (html_content)
-        c1.add_item(nav_css)
-
-        book.add_item(c1)
-        chapters.append(c1)
-        toc.append(epub.Link(f"{pmc_id}.xhtml", pmc_id, pmc_id))
-
-    ## move this part to separate pmc_id directories later
-    fig_files = glob.glob(f"{html_dir}/figs/*.jpg", recursive=True)
-    for fn in fig_files:
-        with open(fn, "rb") as reader:
-            image_content = reader.read()
-            ei = epub.EpubImage()
-            ei.file_name = f"figs/{fn.split('/')[-1]}"
-            ei.media_type = 'image/jpg'
-            ei.content = image_content
-            book.add_item(ei)
-
-    # define Table Of Contents
-    book.toc = tuple(toc)
-
-    # add default NCX and Nav file
-    book.add_item(epub.EpubNcx())
-    book.add_item(epub.EpubNav())
-
-    # add CSS file
-    book.add_item(nav_css)
-
-    # basic spine
-    book.spine = ["nav"] + chapters
-
-    # write to the file
+import contextvars
+import os
+import re
+import uuid
+import zipfile
+from concurrent.futures import ThreadPoolExecutor, wait
+
+import make_pmc_html
+from src import metrics
+from src.article_cache import dir_size
+from src.chapter_cache import chapter_version, read_unit, write_unit
+from src.epub_writer import EpubWriter
+from src.image_optimizer import file_digest
+
+
+def _book_image(html_dir: str, src: str):
+    """Return the book path of a local image, named by its content hash, and its file; None if the file is missing."""
+    file_name = os.path.join(html_dir, src)
+    if not os.path.isfile(file_name):
+        metrics.incr('epub_images_missing')
+        return None
+    return f'images/{file_digest(file_name)}{os.path.splitext(src)[1].lower()}', file_name
+
+
+def _image_resolver(book: EpubWriter, html_dir: str):
+    """Pack each referenced image once, named by its content hash; drop the images whose file is missing."""
+    def resolve(src):
+        if '://' in src:
+            return src
+        image = _book_image(html_dir, src)
+        if image is None:
+            return None
+        book_name, file_name = image
+        if not book.has_item(book_name):
+            book.add_image(book_name, file_name)
+            metrics.incr('epub_images')
+        return book_name
+    return resolve
+
+
+def _read_html(html_dir: str, pmc_id: str) -> str:
+    with open(f'{html_dir}/{pmc_id}.html', 'r', encoding='utf-8') as f:
+        return f.read()
+
+
+def _read_or_convert_html(html_dir: str, pmc_id: str, image_profile: str, text_only: bool) -> str:
+    """
+    Read the html page of an article, converting the article first if the page is missing.
+
+    Callers skip converting articles that have a prebuilt chapter; when the chapter is
+    evicted before the book is packaged, its page has to be made after all.
+    """
+    if not os.path.isfile(os.path.join(html_dir, f'{pmc_id}.html')):
+        metrics.incr('chapter_units_lost')
+        make_pmc_html.main(pmc_id, html_dir, image_profile=image_profile, text_only=text_only)
+    return _read_html(html_dir, pmc_id)
+
+
+def _write_unit(book: EpubWriter, unit_dir: str, pmc_id: str, html_dir: str, image_profile: str = 'default',
+                text_only: bool = False):
+    """Render the chapter of an article into a prebuilt unit, together with the images it references."""
+    images = {}
+    def resolve(src):
+        if '://' in src:
+            return src
+        image = _book_image(html_dir, src)
+        if image is None:
+            return None
+        images[image[0]] = image[1]
+        return image[0]
+    with metrics.span('render_chapter'):
+        content = book.render_chapter(pmc_id, _read_or_convert_html(html_dir, pmc_id, image_profile, text_only),
+                                      resolve)
+    write_unit(unit_dir, f'{pmc_id}.xhtml', pmc_id, content, list(images.items()))
+
+
+def _add_unit(book: EpubWriter, unit: dict):
+    for book_name in unit['images']:
+        if not book.has_item(book_name):
+            book.add_image(book_name, os.path.join(unit['dir'], book_name))
+            metrics.incr('epub_images')
+    with open(os.path.join(unit['dir'], unit['file_name']), 'rb') as f:
+        book.add_xhtml(unit['file_name'], unit['title'], f.read())
+
+
+def main(pmc_ids, html_dir:str,  output_file:str, css_file:str = './styles/style.css', kepub:bool = False,
+         chapter_cache = None, image_profile:str = 'default', text_only:bool = False,
+         title:str = "Pubmed paper collection", identifier:str = "id123456"):
+    """
+    Bundle the html pages of the articles in html_dir into one EPUB.
+
+    With a ``chapter_cache`` (see ``src.chapter_cache``) each chapter is kept as a prebuilt
+    xhtml and images unit keyed by PMC ID, renderer version, image_profile, kepub and
+    text_only. Only articles without a unit are converted; the others, whose html page is
+    then not needed, are copied into the book as they are, so a rebuild only regenerates
+    the package document, nav and NCX around them. A unit evicted by a concurrent build
+    before it is read is rendered again, converting the article if its page is missing.
+
+    The book is written under a temporary name and renamed to output_file once complete,
+    so a failed build leaves no truncated EPUB behind.
+    """
     print(f'''write ebook to: {output_file}''')
-    epub.write_epub(output_file, book)
+    tmp_file = f'{output_file}.{uuid.uuid4().hex[:8]}.tmp'
+    try:
+        _write_book(pmc_ids, html_dir, tmp_file, css_file, kepub, chapter_cache, image_profile, text_only,
+                    title, identifier)
+        os.replace(tmp_file, output_file)
+    finally:
+        if os.path.exists(tmp_file):
+            os.remove(tmp_file)
+    metrics.incr('epub_bytes', os.path.getsize(output_file))
+
+def _write_book(pmc_ids, html_dir: str, output_file: str, css_file: str, kepub: bool, chapter_cache,
+                image_profile: str, text_only: bool, title: str, identifier: str):
+    version = chapter_version(image_profile, kepub, text_only)
+    with metrics.span('package'), EpubWriter(output_file, title, identifier=identifier,
+                                             language="en", author="Awesome author", kepub=kepub) as book:
+        # define CSS style
+        book.add_style("style/style.css", css_file)
+
+        # chapters are converted and written one at a time, together with the images they reference
+        resolve_image = _image_resolver(book, html_dir)
+        for pmc_id in pmc_ids:
+            if chapter_cache is None:
+                book.add_chapter(f"{pmc_id}.xhtml", pmc_id, _read_html(html_dir, pmc_id), resolve_image)
+                continue
+            unit_dir = chapter_cache.get_or_fetch(
+                pmc_id, lambda unit_dir: _write_unit(book, unit_dir, pmc_id, html_dir, image_profile, text_only),
+                version)
+            try:
+                _add_unit(book, read_unit(unit_dir))
+            except FileNotFoundError:
+                # evicted while being read; images already added stay in the book
+                metrics.incr('chapter_units_lost')
+                book.add_chapter(f"{pmc_id}.xhtml", pmc_id,
+                                 _read_or_convert_html(html_dir, pmc_id, image_profile, text_only), resolve_image)
+
+def _article_bytes(pmc_id: str, html_dir: str, chapter_cache=None, version: str = None) -> int:
+    """Estimate the size an article adds to a book: its prebuilt chapter, else its html page and figures."""
+    size = chapter_cache.entry_size(pmc_id, version) if chapter_cache is not None else None
+    if size is not None:
+        return size
+    html_file = os.path.join(html_dir, f'{pmc_id}.html')
+    size = os.path.getsize(html_file) if os.path.isfile(html_file) else 0
+    return size + dir_size(os.path.join(html_dir, 'figs', pmc_id))
+
+def plan_volumes(pmc_ids, html_dir: str, max_articles: int = None, max_bytes: int = None,
+                 chapter_cache=None, version: str = None) -> list:
+    """
+    Split the articles, in order, into volumes of at most max_articles articles and about max_bytes.
+
+    A volume is closed before the article that would take it over max_bytes, so only an
+    article larger than max_bytes on its own makes a bigger volume.
+
+    :rtype: list[list[str]]
+    """
+    volumes, volume, volume_bytes = [], [], 0
+    for pmc_id in pmc_ids:
+        size = _article_bytes(pmc_id, html_dir, chapter_cache, version) if max_bytes else 0
+        if volume and ((max_articles and len(volume) >= max_articles) or
+                       (max_bytes and volume_bytes + size > max_bytes)):
+            volumes.append(volume)
+            volume, volume_bytes = [], 0
+        volume.append(pmc_id)
+        volume_bytes += size
+    if volume:
+        volumes.append(volume)
+    return volumes
+
+def epub_file_name(kepub: bool = False, stem: str = 'ebook') -> str:
+    """Name a book file; Kobo readers only use the KEPUB renderer for files named ``*.kepub.epub``."""
+    return f"{stem}{'.kepub' if kepub else ''}.epub"
+
+def volume_file_name(output_file: str, number: int) -> str:
+    """Name volume number of output_file, keeping a ``.kepub.epub`` suffix: ebook.vol02.kepub.epub."""
+    base, ext = re.match(r'(.*?)((?:\.kepub)?\.epub)?$', output_file).groups()
+    return f'{base}.vol{number:02d}{ext or ""}'
+
+def make_volumes(pmc_ids, html_dir: str, output_file: str, css_file: str = './styles/style.css',
+                 kepub: bool = False, chapter_cache=None, image_profile: str = 'default', text_only: bool = False,
+                 max_articles: int = None, max_bytes: int = None, workers: int = 4) -> list:
+    """
+    Write the articles as a set of EPUB volumes, see ``plan_volumes``, assembled in parallel.
+
+    Each volume is a complete book, with the stylesheet, its own nav and NCX, and a title
+    and identifier numbered after the collection's. A collection that fits in one volume
+    is written to output_file as usual. If any volume fails, the volumes already written
+    are removed and the error is raised.
+
+    :param workers: Number of volumes assembled concurrently, defaults to 4.
+    :type workers: int, optional
+    :return: The paths of the volumes, in order.
+    :rtype: list[str]
+    """
+    pmc_ids = list(pmc_ids)
+    version = chapter_version(image_profile, kepub, text_only)
+    volumes = plan_volumes(pmc_ids, html_dir, max_articles, max_bytes, chapter_cache, version)
+    if len(volumes) <= 1:
+        main(pmc_ids, html_dir, output_file, css_file, kepub, chapter_cache, image_profile, text_only)
+        return [output_file]
+
+    def assemble(number, volume):
+        file_name = volume_file_name(output_file, number)
+        main(volume, html_dir, file_name, css_file, kepub, chapter_cache, image_profile, text_only,
+             title=f"Pubmed paper collection, volume {number} of {len(volumes)}", identifier=f"id123456-{number}")
+        return file_name
+
+    with metrics.span('volumes'), ThreadPoolExecutor(min(workers, len(volumes))) as executor:
+        # each volume runs in a copy of the caller's context, so its metrics are recorded
+        futures = [executor.submit(contextvars.copy_context().run, assemble, number, volume)
+                   for number, volume in enumerate(volumes, start=1)]
+        wait(futures)
+    errors = [future.exception() for future in futures if future.exception() is not None]
+    if errors:
+        for future in futures:
+            if future.exception() is None:
+                os.remove(future.result())
+        raise errors[0]
+    files = [future.result() for future in futures]
+    metrics.incr('epub_volumes', len(files))
+    return files
+
+def bundle_volumes(volume_files: list, zip_file: str) -> str:
+    """Store EPUB volumes, already compressed, in one zip archive."""
+    with zipfile.ZipFile(zip_file, 'w', compression=zipfile.ZIP_STORED) as archive:
+        for file_name in volume_files:
+            archive.write(file_name, os.path.basename(file_name))
+    return zip_file
 
 def parse_arguments():
     parser = argparse.ArgumentParser(description='Process PMC IDs and specify output file.')
     parser.add_argument('--pmc_ids', type=str, required=True, help='The PMC IDs to be processed. IDs are comma separated')
     parser.add_argument('--input_dir', type=str, default='./output', help='The file to read pmc htmls.')
     parser.add_argument('--output_file', type=str, default='ebook.epub', help='The file to write output to.')
+    parser.add_argument('--kepub', action='store_true',
+                        help='Write a Kobo KEPUB; name the output file *.kepub.epub for Kobo readers to use it.')
+    parser.add_argument('--volume_articles', type=int, default=None, help='Split the book into volumes of this many articles.')
+    parser.add_argument('--volume_bytes', type=int, default=None, help='Split the book into volumes of about this many bytes.')
+    parser.add_argument('--zip', type=str, default=None, help='Also bundle the volumes into this zip file.')
     return parser.parse_args()
 
 if __name__ == '__main__':
@@ -77,4 +245,10 @@ if __name__ == '__main__':
     pmc_ids = [s for s in args.pmc_ids.split(',') if s.startswith('PMC')]
     html_dir = args.input_dir
     output_file = args.output_file
-    main(pmc_ids, html_dir, output_file)
+    if args.volume_articles or args.volume_bytes:
+        files = make_volumes(pmc_ids, html_dir, output_file, kepub=args.kepub,
+                             max_articles=args.volume_articles, max_bytes=args.volume_bytes)
+        if args.zip:
+            bundle_volumes(files, args.zip)
+    else:
+        main(pmc_ids, html_dir, output_file, kepub=args.kepub)
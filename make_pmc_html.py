@@ -1,7 +1,20 @@
 import argparse
+import json
+import multiprocessing
 import os
+import re
+import sys
+import time
+from concurrent.futures import (FIRST_COMPLETED, ProcessPoolExecutor,
+                                ThreadPoolExecutor, as_completed, wait)
 
-from src import oa_api_helper
+import requests
+
+from src import metrics, oa_api_helper
+from src.article_cache import get_cache
+from src.bioc_parser import get_documents, render_bioc_article
+from src.bulk_archive import iter_bulk_articles
+from src.image_optimizer import PROFILES, optimize_figures
 from src.oa_parser import *
 
 
@@ -13,54 +26,351 @@ def create_directory(directory_path):
     except Exception as e:
         print(f"An error occurred: {e}")
 
-def main(pmc_id: str, output_dir: str):
-    if not os.path.isdir(pmc_id):
-        #print(f'{file_path} does not exist.')
-        url = oa_api_helper.get_pmc_ftp_url(pmc_id)[1].replace('ftp://', 'https://')
-        oa_api_helper.download_file(url, f'{pmc_id}.tar.gz')
-        file_path = f'{pmc_id}.tar.gz'
-        oa_api_helper.extract_tar_gz(file_path)
+def download_article(url: str, extract_path: str):
+    oa_api_helper.download_and_extract(url.replace('ftp://', 'https://'), extract_path)
+
+def package_version(updated: str):
+    """Cache entry version of an OA package last updated at ``updated``, e.g. '2019-01-31 12:00:00'."""
+    return re.sub(r'\D', '', updated or '') or None
+
+# cache entry version of the articles loaded from bulk archives, which carry no figures
+BULK_VERSION = 'bulk'
+
+def get_article_dir(pmc_id: str, cache=None, bulk: bool = False) -> str:
+    """
+    Return a directory holding the extracted OA package, downloading it on a cache miss.
+
+    Entries are versioned with the package's last update, so an updated package is
+    downloaded again instead of being served from an outdated entry. Articles loaded with
+    ``ingest_bulk_archives`` are only used when the package cannot be fetched, or with
+    ``bulk``.
+    """
+    if os.path.isdir(pmc_id):
+        # an already extracted package in the working directory
+        return pmc_id
+    cache = cache or get_cache()
+    if bulk:
+        path = cache.get(pmc_id, BULK_VERSION)
+        if path is None:
+            raise FileNotFoundError(f'{pmc_id} is not in the bulk archives loaded into the cache')
+        return path
+    try:
+        url, updated = oa_api_helper.get_pmc_package(pmc_id)
+        if not url:
+            raise LookupError(f'{pmc_id} is not open access')
+        return cache.get_or_fetch(pmc_id, lambda extract_path: download_article(url, extract_path),
+                                  package_version(updated))
+    except requests.RequestException:
+        # offline: convert the article from a bulk archive, without figures
+        path = cache.get(pmc_id, BULK_VERSION)
+        if path is None:
+            raise
+        metrics.incr('bulk_fallbacks')
+        return path
+
+BIOC_VERSION = 'bioc'
+
+def get_bioc_file(pmc_id: str, cache=None, pmid: str = None) -> str:
+    """
+    Return the cached BioC JSON file of an article, downloading it on a cache miss.
+
+    The article is requested by PMID, converted with idconv unless given, or by PMC ID
+    when it has none.
+    """
+    cache = cache or get_cache()
+
+    def fetch(entry_dir):
+        article_id = pmid or oa_api_helper.pmc_ids2pmids([pmc_id]).get(pmc_id) or pmc_id
+        with open(os.path.join(entry_dir, f'{pmc_id}.json'), 'w', encoding='utf-8') as f:
+            json.dump(oa_api_helper.get_bioc_json(article_id, encoding='unicode'), f)
 
-    nxml_file = find_files('nxml', f'{pmc_id}')[0]
-    with open(nxml_file, 'rb') as file:
+    return os.path.join(cache.get_or_fetch(pmc_id, fetch, BIOC_VERSION), f'{pmc_id}.json')
+
+def _render_text_only(pmc_id: str, output_dir: str, cache=None, pmid: str = None):
+    create_directory(output_dir)
+    with metrics.span('fetch'):
+        bioc_file = get_bioc_file(pmc_id, cache, pmid)
+    with metrics.span('render'), open(bioc_file, 'r', encoding='utf-8') as f:
+        documents = get_documents(json.load(f))
+        if not documents:
+            raise ValueError(f'no BioC document for {pmc_id}')
+        html_content = render_bioc_article(documents[0])
+    write_html(html_content, f'{output_dir}/{pmc_id}.html')
+    metrics.incr('articles')
+
+# nxml files larger than this are converted with the incremental, memory-bounded parser
+INCREMENTAL_PARSE_BYTES = 16 * 1024 ** 2
+
+def _render_html(nxml_file: str, html_file: str, fig_dir: str):
+    with metrics.span('parse'), open(nxml_file, 'rb') as file:
         tree = etree.parse(file)
-    sections = tree.xpath('//body//sec')
-    elements = []
-    for sec in sections:
-        elements += collect_elements(sec)
 
-    create_directory(os.path.join(output_dir, 'figs'))
+    with metrics.span('render'):
+        title_div, (title, authors, abstract, keywords) = parse_article(tree)
+        elements, body_content = render_body(tree, fig_dir)
+        toc = create_toc_section(elements, section_title = 'Table of content', list_type = 'ul')
 
-    title_div, (title, authors, abstract, keywords) = parse_article(tree)
-    toc = create_toc_section(elements, section_title = 'Table of content', list_type = 'ul')
-
-    body_content = ''
-    for elem in elements:
-        if elem['type'] == 'sec':
-            level, text, section_id = elem['data']['level'], elem['data']['text'], elem['data']['section']
-            body_content += f'<h{level} id="{section_id}">{text}</h{level}>'
-        else:
-            text = elem['data']['text']
-            text = replace_xref_with_link(text)
-            text = convert_figs(text)
-            body_content += text
-
-    ref_content = create_reference_section(tree, section_title = 'References', list_type = 'ol')
+    with metrics.span('references'):
+        ref_content = create_reference_section(tree, section_title = 'References', list_type = 'ol')
     main_content = toc + body_content + ref_content
     html_content = add_title_page(title, title_div, main_content)
-    write_html(html_content, f'{output_dir}/{pmc_id}.html')
-    copy_jpg_files(f'{pmc_id}', f'{output_dir}/figs')
+    write_html(html_content, html_file)
+
+def main(pmc_id: str, output_dir: str, cache=None, image_profile: str = 'default', incremental: bool = None,
+         text_only: bool = False, pmid: str = None, bulk: bool = False):
+    """
+    Convert one article to ``{output_dir}/{pmc_id}.html`` and its figures.
+
+    ``incremental`` selects the memory-bounded iterparse renderer; by default it is used for
+    nxml files larger than ``INCREMENTAL_PARSE_BYTES``.
+
+    ``text_only`` renders the page from the article's BioC JSON, tens of kilobytes, instead
+    of the OA package: same sections and references, no figures. ``pmid`` saves the
+    idconv lookup of the article's PMID.
+
+    ``bulk`` converts the article loaded from a bulk archive, without network access.
+    """
+    if text_only:
+        return _render_text_only(pmc_id, output_dir, cache, pmid)
+    for attempt in range(2):
+        with metrics.span('fetch'):
+            article_dir = get_article_dir(pmc_id, cache, bulk)
+        try:
+            figures = _render_package(pmc_id, article_dir, output_dir, image_profile, incremental)
+            break
+        except FileNotFoundError:
+            # the entry was evicted by another worker while it was read: fetch it again, once
+            if attempt:
+                raise
+            metrics.incr('article_entries_lost')
+    metrics.incr('figures', len(figures))
+    metrics.incr('articles')
     return
 
+def _render_package(pmc_id: str, article_dir: str, output_dir: str, image_profile: str, incremental: bool) -> list:
+    nxml_files = find_files('nxml', article_dir)
+    if not nxml_files:
+        raise FileNotFoundError(f'no nxml file in {article_dir}')
+    nxml_file = nxml_files[0]
+    if incremental is None:
+        incremental = os.path.getsize(nxml_file) > INCREMENTAL_PARSE_BYTES
+    # figures live in a directory per article so articles never overwrite each other's files
+    fig_dir = f'figs/{pmc_id}'
+    create_directory(os.path.join(output_dir, fig_dir))
+
+    html_file = f'{output_dir}/{pmc_id}.html'
+    if incremental:
+        with metrics.span('render_incremental'):
+            write_html_incremental(nxml_file, html_file, fig_dir)
+    else:
+        _render_html(nxml_file, html_file, fig_dir)
+    with metrics.span('figures'):
+        return optimize_figures(os.path.dirname(nxml_file), os.path.join(output_dir, fig_dir),
+                                PROFILES[image_profile])
+
+def _convert(pmc_id: str, output_dir: str, image_profile: str, incremental: bool, text_only: bool = False,
+             bulk: bool = False) -> str:
+    main(pmc_id, output_dir, image_profile=image_profile, incremental=incremental, text_only=text_only, bulk=bulk)
+    return pmc_id
+
+def convert_batch(pmc_ids: list, output_dir: str, workers: int = None, download_workers: int = 4,
+                  image_profile: str = 'default', incremental: bool = None, text_only: bool = False):
+    """
+    Convert many articles, overlapping downloads with conversion.
+
+    Packages are fetched into the article cache on a thread pool; as soon as one is
+    available its conversion is handed to a pool of ``workers`` processes. A failing
+    article is recorded and the batch carries on.
+
+    :param pmc_ids: The PMC IDs to convert.
+    :type pmc_ids: list[str]
+    :param output_dir: Directory to store the output HTML pages.
+    :type output_dir: str
+    :param workers: Number of conversion processes, defaults to the number of CPUs.
+    :type workers: int, optional
+    :param download_workers: Number of concurrent downloads, defaults to 4.
+    :type download_workers: int, optional
+    :param image_profile: Name of the figure profile in ``PROFILES``, defaults to 'default'.
+    :type image_profile: str, optional
+    :param incremental: Use the incremental parser, see ``main``.
+    :type incremental: bool, optional
+    :param text_only: Convert from BioC JSON, see ``main``. The PMIDs of the whole batch are
+        then resolved with batched idconv requests up front.
+    :type text_only: bool, optional
+    :return: The converted PMC IDs and a dictionary of failed PMC IDs to their error.
+    :rtype: tuple[list[str], dict]
+    """
+    pmc_ids = list(dict.fromkeys(pmc_ids))
+    create_directory(os.path.join(output_dir, 'figs'))
+    if text_only:
+        pmids = oa_api_helper.pmc_ids2pmids(pmc_ids)
+        fetch = lambda pmc_id: get_bioc_file(pmc_id, pmid=pmids.get(pmc_id))
+    else:
+        fetch = get_article_dir
+    converted, failures = [], {}
+    start = time.perf_counter()
+    # spawn, not fork: the parent runs download threads that may hold locks
+    mp_context = multiprocessing.get_context('spawn')
+    with ThreadPoolExecutor(download_workers) as downloader, \
+            ProcessPoolExecutor(workers, mp_context=mp_context) as converter:
+        downloads = {downloader.submit(fetch, pmc_id): pmc_id for pmc_id in pmc_ids}
+        conversions = {}
+        for future in as_completed(downloads):
+            pmc_id = downloads[future]
+            try:
+                future.result()
+            except Exception as e:
+                failures[pmc_id] = e
+                continue
+            conversions[converter.submit(_convert, pmc_id, output_dir, image_profile, incremental,
+                                         text_only)] = pmc_id
+        for future in as_completed(conversions):
+            pmc_id = conversions[future]
+            try:
+                converted.append(future.result())
+            except Exception as e:
+                failures[pmc_id] = e
+    print_summary(converted, failures, time.perf_counter() - start)
+    return converted, failures
+
+def _store_nxml(entry_dir: str, pmc_id: str, nxml: bytes):
+    os.makedirs(os.path.join(entry_dir, pmc_id))
+    with open(os.path.join(entry_dir, pmc_id, f'{pmc_id}.nxml'), 'wb') as f:
+        f.write(nxml)
+
+def ingest_bulk_archives(archive_files: list, output_dir: str = None, pmc_ids: list = None, workers: int = None,
+                         image_profile: str = 'default', incremental: bool = None):
+    """
+    Load articles from local PMC OA bulk archives, without network access.
+
+    Each ``.tar.gz`` is streamed in one sequential pass and never extracted as a whole. Every
+    article, or only those in pmc_ids, is stored in the article cache under ``BULK_VERSION``,
+    apart from the full OA packages. If output_dir is given, the articles are also converted
+    to html there, on a pool of ``workers`` processes, while the archive is still being read.
+    Bulk packages carry no figures.
+
+    The cache is only trimmed to its byte budget at the end; raise ``PUBMED2EPUB_CACHE_BYTES``
+    to keep every ingested article.
+
+    :param archive_files: Paths of the bulk archives.
+    :type archive_files: list[str]
+    :param output_dir: Directory to store the html pages, defaults to only filling the cache.
+    :type output_dir: str, optional
+    :param pmc_ids: Only ingest these articles, defaults to every article.
+    :type pmc_ids: list[str], optional
+    :param workers: Number of conversion processes, defaults to the number of CPUs.
+    :type workers: int, optional
+    :param image_profile: Name of the figure profile in ``PROFILES``, defaults to 'default'.
+    :type image_profile: str, optional
+    :param incremental: Use the incremental parser, see ``main``.
+    :type incremental: bool, optional
+    :return: The ingested PMC IDs and a dictionary of failed PMC IDs to their error.
+    :rtype: tuple[list[str], dict]
+    """
+    cache = get_cache()
+    wanted = set(pmc_ids) if pmc_ids else None
+    if output_dir is not None:
+        create_directory(os.path.join(output_dir, 'figs'))
+    ingested, failures = [], {}
+    start = time.perf_counter()
+    # bound the queued conversions so a huge archive is not buffered in the pool's queue
+    max_pending = 4 * (workers or os.cpu_count() or 1)
+    pending = {}
+
+    def collect(futures):
+        for future in futures:
+            pmc_id = pending.pop(future)
+            try:
+                future.result()
+                ingested.append(pmc_id)
+            except Exception as e:
+                failures[pmc_id] = e
+
+    mp_context = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(workers, mp_context=mp_context) as converter:
+        for archive_file in archive_files:
+            for pmc_id, nxml in iter_bulk_articles(archive_file, wanted):
+                try:
+                    cache.put(pmc_id, lambda entry_dir: _store_nxml(entry_dir, pmc_id, nxml), BULK_VERSION,
+                              evict=False)
+                except OSError as e:
+                    failures[pmc_id] = e
+                    continue
+                metrics.incr('bulk_articles')
+                if output_dir is None:
+                    ingested.append(pmc_id)
+                    continue
+                if len(pending) >= max_pending:
+                    collect(wait(pending, return_when=FIRST_COMPLETED).done)
+                pending[converter.submit(_convert, pmc_id, output_dir, image_profile, incremental, bulk=True)] = pmc_id
+        collect(list(as_completed(pending)))
+    cache.evict()
+    for pmc_id in sorted((wanted or set()) - set(ingested) - set(failures)):
+        failures[pmc_id] = LookupError('not found in the bulk archives')
+    print_summary(ingested, failures, time.perf_counter() - start)
+    return ingested, failures
+
+def print_summary(converted: list, failures: dict, elapsed: float):
+    total = len(converted) + len(failures)
+    print(f'converted {len(converted)}/{total} articles in {elapsed:.1f}s '
+          f'({len(converted) / elapsed if elapsed else 0:.2f} articles/s)')
+    for pmc_id, error in failures.items():
+        print(f'  failed {pmc_id}: {error!r}')
+
+def read_id_file(file_name: str) -> list:
+    with open(file_name, 'r') as f:
+        return [s.strip() for line in f for s in line.split(',') if s.strip()]
+
 def parse_arguments():
     parser = argparse.ArgumentParser(description='make a html page for a pmc article')
-    parser.add_argument('pmc_id', help='pmc id PMCXXXXXX.')
+    parser.add_argument('pmc_ids', nargs='*', help='pmc ids PMCXXXXXX.')
+    parser.add_argument('--id_file',
+                        type=str,
+                        default=None,
+                        help='File listing PMC IDs to convert, one per line or comma separated.')
     parser.add_argument('--output_dir',
                         type=str,
                         default='./output',
                         help='Directory to store the output HTML page.')
-    return parser.parse_args()
+    parser.add_argument('--workers',
+                        type=int,
+                        default=None,
+                        help='Number of conversion processes in batch mode, defaults to the number of CPUs.')
+    parser.add_argument('--incremental',
+                        action='store_true',
+                        default=None,
+                        help='Always use the memory-bounded incremental parser (default: only for very large files).')
+    parser.add_argument('--image_profile',
+                        choices=sorted(PROFILES),
+                        default='default',
+                        help='How figures are scaled and encoded for the e-reader.')
+    parser.add_argument('--text_only',
+                        action='store_true',
+                        help='Convert from the BioC JSON text of the articles, without figures, instead of the OA packages.')
+    parser.add_argument('--bulk_archive',
+                        nargs='+',
+                        default=None,
+                        help='Local PMC OA bulk .tar.gz files to convert, offline; the pmc ids select a subset.')
+    parser.add_argument('--cache_only',
+                        action='store_true',
+                        help='With --bulk_archive, only load the articles into the article cache.')
+    args = parser.parse_args()
+    if not args.pmc_ids and not args.id_file and not args.bulk_archive:
+        parser.error('give at least one pmc id, --id_file or --bulk_archive')
+    return args
 
 if __name__ == "__main__":
     args = parse_arguments()
-    main(args.pmc_id, args.output_dir)
+    pmc_ids = args.pmc_ids + (read_id_file(args.id_file) if args.id_file else [])
+    if args.bulk_archive:
+        ingested, failures = ingest_bulk_archives(args.bulk_archive, None if args.cache_only else args.output_dir,
+                                                  pmc_ids, args.workers, args.image_profile, args.incremental)
+        sys.exit(1 if failures else 0)
+    elif len(pmc_ids) == 1:
+        main(pmc_ids[0], args.output_dir, image_profile=args.image_profile, incremental=args.incremental,
+             text_only=args.text_only)
+    else:
+        converted, failures = convert_batch(pmc_ids, args.output_dir, args.workers,
+                                            image_profile=args.image_profile, incremental=args.incremental,
+                                            text_only=args.text_only)
+        sys.exit(1 if failures else 0)
@@ -0,0 +1,191 @@
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+
+from src import metrics
+
+META_FILE = '.cache_meta.json'
+DEFAULT_CACHE_DIR = os.environ.get('PUBMED2EPUB_CACHE_DIR', os.path.expanduser('~/.cache/pubmed2epub'))
+DEFAULT_MAX_BYTES = int(os.environ.get('PUBMED2EPUB_CACHE_BYTES', 2 * 1024 ** 3))
+
+def dir_size(path):
+    size = 0
+    for root, dirs, files in os.walk(path):
+        for file in files:
+            size += os.path.getsize(os.path.join(root, file))
+    return size
+
+class ArticleCache:
+    """
+    Size-bounded on-disk cache of extracted OA packages (nxml and figures), keyed by PMC ID.
+
+    Each entry is one directory under ``root``. Entries are built in a temporary directory
+    and renamed into place, so several workers or processes can share one cache. When the
+    total size exceeds ``max_bytes`` the least recently used entries are evicted.
+
+    :param root: Directory holding the cache entries.
+    :type root: str
+    :param max_bytes: Byte budget of the cache.
+    :type max_bytes: int
+    :param name: Prefix of the hit and miss counters in ``metrics``, defaults to 'article_cache'.
+    :type name: str, optional
+    """
+    def __init__(self, root: str = DEFAULT_CACHE_DIR, max_bytes: int = DEFAULT_MAX_BYTES, name: str = 'article_cache'):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.name = name
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        os.makedirs(root, exist_ok=True)
+
+    def _entry_path(self, pmc_id: str, version: str = None) -> str:
+        key = pmc_id if version is None else f'{pmc_id}.{version}'
+        return os.path.join(self.root, key)
+
+    def has(self, pmc_id: str, version: str = None) -> bool:
+        """Tell whether an entry is cached, without counting a lookup or marking it as used."""
+        return os.path.isfile(os.path.join(self._entry_path(pmc_id, version), META_FILE))
+
+    def get(self, pmc_id: str, version: str = None):
+        """
+        Return the entry directory of an article, or None on a cache miss.
+
+        :param pmc_id: The PubMed Central ID.
+        :type pmc_id: str
+        :param version: Article version, if known.
+        :type version: str, optional
+        :rtype: str or None
+        """
+        path = self._entry_path(pmc_id, version)
+        if os.path.isfile(os.path.join(path, META_FILE)):
+            try:
+                os.utime(path)  # mark as recently used
+            except FileNotFoundError:  # evicted by another worker
+                pass
+            else:
+                with self._lock:
+                    self.hits += 1
+                metrics.incr(f'{self.name}_hits')
+                return path
+        with self._lock:
+            self.misses += 1
+        metrics.incr(f'{self.name}_misses')
+        return None
+
+    def put(self, pmc_id: str, populate, version: str = None, evict: bool = True) -> str:
+        """
+        Build a cache entry and atomically move it into place.
+
+        :param pmc_id: The PubMed Central ID.
+        :type pmc_id: str
+        :param populate: Callable that fills the directory it is given with the article files.
+        :type populate: function
+        :param version: Article version, if known.
+        :type version: str, optional
+        :param evict: Trim the cache to its byte budget afterwards, defaults to True. Bulk
+            loads turn it off and call ``evict`` once at the end.
+        :type evict: bool, optional
+        :return: The entry directory.
+        :rtype: str
+        """
+        path = self._entry_path(pmc_id, version)
+        tmp_dir = tempfile.mkdtemp(prefix='.tmp-', dir=self.root)
+        try:
+            populate(tmp_dir)
+            meta = {'pmc_id': pmc_id, 'version': version, 'size': dir_size(tmp_dir), 'created': time.time()}
+            with open(os.path.join(tmp_dir, META_FILE), 'w') as f:
+                json.dump(meta, f)
+            try:
+                os.rename(tmp_dir, path)
+            except OSError:
+                # another worker stored the same article first, keep theirs
+                if not os.path.isfile(os.path.join(path, META_FILE)):
+                    raise
+        finally:
+            if os.path.isdir(tmp_dir):
+                shutil.rmtree(tmp_dir, ignore_errors=True)
+        if evict:
+            self.evict(keep=path)
+        return path
+
+    def entry_size(self, pmc_id: str, version: str = None):
+        """Return the size in bytes of a cached entry, or None if it is not cached."""
+        try:
+            with open(os.path.join(self._entry_path(pmc_id, version), META_FILE)) as f:
+                return json.load(f)['size']
+        except (OSError, ValueError, KeyError):
+            return None
+
+    def get_or_fetch(self, pmc_id: str, populate, version: str = None) -> str:
+        """Return the entry directory of an article, calling ``put`` with ``populate`` on a miss."""
+        path = self.get(pmc_id, version)
+        if path is None:
+            path = self.put(pmc_id, populate, version)
+        return path
+
+    def _entries(self):
+        entries = []
+        for name in os.listdir(self.root):
+            path = os.path.join(self.root, name)
+            try:
+                with open(os.path.join(path, META_FILE)) as f:
+                    size = json.load(f)['size']
+                entries.append((os.stat(path).st_mtime, size, path))
+            except (OSError, ValueError, KeyError):
+                continue
+        return entries
+
+    def evict(self, keep: str = None):
+        """Remove least recently used entries until the cache fits in its byte budget."""
+        entries = sorted(self._entries())
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            if path == keep:
+                continue
+            trash = tempfile.mkdtemp(prefix='.evict-', dir=self.root)
+            try:
+                os.rename(path, os.path.join(trash, 'entry'))
+            except OSError:  # already evicted by another worker
+                pass
+            else:
+                total -= size
+                with self._lock:
+                    self.evictions += 1
+            shutil.rmtree(trash, ignore_errors=True)
+
+    def get_stats(self) -> dict:
+        """
+        Return hit/miss statistics of this process and the current cache size.
+
+        :rtype: dict
+        """
+        entries = self._entries()
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'evictions': self.evictions,
+                'entries': len(entries),
+                'bytes': sum(size for _, size, _ in entries),
+                'max_bytes': self.max_bytes,
+            }
+
+_cache = None
+_cache_lock = threading.Lock()
+
+def get_cache() -> ArticleCache:
+    """Return the process-wide ``ArticleCache``, creating it on first use."""
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = ArticleCache()
+        return _cache
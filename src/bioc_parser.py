@@ -0,0 +1,138 @@
+import re
+from html import escape
+
+from lxml import etree
+
+from src import metrics
+from src.oa_parser import (add_header_to_list, add_title_page,
+                           create_toc_section)
+
+# passages of these section types are not part of the body
+FRONT_SECTIONS = {'TITLE', 'ABSTRACT', 'REF'}
+_name = re.compile(r'surname:([^;]*);?(?:given-names:(.*))?')
+
+def get_documents(bioc) -> list:
+    """Return the BioC documents of a BioC JSON response, a collection or a list of collections."""
+    collections = bioc if isinstance(bioc, list) else [bioc]
+    return [document for collection in collections for document in collection.get('documents', [])]
+
+def _names(infons: dict) -> list:
+    names = []
+    for key in sorted((k for k in infons if k.startswith('name_')), key=lambda k: int(k[5:])):
+        match = _name.match(infons[key])
+        if match:
+            surname, given_names = match.group(1), match.group(2) or ''
+            names.append(f'{given_names} {surname}'.strip())
+    return names
+
+def _title_div(passages: list):
+    title, authors, keywords, abstract = '', [], '', []
+    for passage in passages:
+        infons = passage.get('infons', {})
+        section_type = infons.get('section_type')
+        if section_type == 'TITLE' and infons.get('type') == 'front':
+            title = passage.get('text', '')
+            authors = _names(infons)
+            keywords = infons.get('kwd', '')
+        elif section_type == 'ABSTRACT':
+            text = escape(passage.get('text', ''))
+            if infons.get('type', '').startswith('abstract_title'):
+                abstract.append(f'<p><strong>{text}</strong></p>')
+            else:
+                abstract.append(f'<p>{text}</p>')
+
+    author_str = authors[-1] if authors else ''
+    if len(authors) > 1:
+        author_str = ', '.join(authors[:-1]) + ' and ' + author_str
+    title_div = f"""<div class="title">{escape(title)}</div>
+            <div class="authors">Authors: {escape(author_str)}</div>
+            <div class="abstract">
+                <strong>Abstract:</strong>
+                <div>{''.join(abstract)}</div>
+            </div>
+            <div class="keywords">Keywords: {escape(keywords)}</div>"""
+    return title, title_div
+
+def _table(passage: dict) -> str:
+    table_xml = passage.get('infons', {}).get('xml')
+    if table_xml:
+        try:
+            table = etree.fromstring(table_xml.encode('utf-8'))
+        except etree.XMLSyntaxError:
+            pass
+        else:
+            for elem in table.iter():
+                if isinstance(elem.tag, str):
+                    elem.tag = etree.QName(elem).localname
+            etree.cleanup_namespaces(table)
+            return etree.tostring(table, encoding='unicode', with_tail=False)
+    return f"<p>{escape(passage.get('text', ''))}</p>"
+
+def render_bioc_body(passages: list):
+    """
+    Render the body passages of a BioC document.
+
+    Section titles open a heading one level per ``title_N``, like the sections of
+    ``oa_parser.render_body``; figures keep their caption only.
+
+    :return: The section entries of the toc and the body html.
+    :rtype: tuple[list[dict], str]
+    """
+    elements, parts = [], []
+    for passage in passages:
+        infons = passage.get('infons', {})
+        if infons.get('section_type') in FRONT_SECTIONS:
+            continue
+        kind = infons.get('type', '')
+        text = escape(passage.get('text', ''))
+        if kind.startswith('title'):
+            level = int(kind[6:]) if kind[6:].isdigit() else 1
+            sec_id = f'sec{len(elements) + 1}'
+            elements.append({'type': 'sec', 'data': {'text': text, 'level': level, 'section': sec_id}})
+            parts.append(f'<h{level} id="{sec_id}">{text}</h{level}>')
+        elif kind in ('fig_title_caption', 'table_title_caption'):
+            parts.append(f'<p><strong>{text}</strong></p>')
+        elif kind in ('fig_caption', 'table_caption', 'table_footnote'):
+            parts.append(f'<figure><figcaption><p>{text}</p></figcaption></figure>')
+        elif kind == 'table':
+            parts.append(_table(passage))
+        elif text:
+            parts.append(f'<p>{text}</p>')
+    return elements, ''.join(parts)
+
+def format_bioc_reference(passage: dict) -> str:
+    infons = passage.get('infons', {})
+    names = ', '.join(_names(infons))
+    article_title = escape(passage.get('text', '').replace('\n', ' ').strip())
+    journal = escape(infons.get('source', ''))
+    year = escape(infons.get('year', ''))
+    text = [escape(names), article_title, f'<i>{journal}</i>' if journal else '', year]
+    return ', '.join([s for s in text if s])
+
+def create_bioc_reference_section(passages: list, section_title='References', list_type='ol'):
+    entries = []
+    for passage in passages:
+        infons = passage.get('infons', {})
+        if infons.get('section_type') == 'REF' and infons.get('type') == 'ref':
+            entries.append(f'<li id="ref{len(entries) + 1}" epub:type="footnote">{format_bioc_reference(passage)}</li>\n')
+    metrics.incr('references', len(entries))
+    return add_header_to_list(''.join(entries), section_title, list_type)
+
+def render_bioc_article(document: dict) -> str:
+    """
+    Render a BioC document into the same html page ``make_pmc_html`` writes from nxml.
+
+    Title page, table of content, sections and references come from the BioC passages;
+    the page has no figures, only their captions.
+
+    :param document: One document of a BioC JSON collection.
+    :type document: dict
+    :return: The html page.
+    :rtype: str
+    """
+    passages = document.get('passages', [])
+    title, title_div = _title_div(passages)
+    elements, body_content = render_bioc_body(passages)
+    toc = create_toc_section(elements, section_title = 'Table of content', list_type = 'ul')
+    ref_content = create_bioc_reference_section(passages, section_title = 'References', list_type = 'ol')
+    return add_title_page(escape(title), title_div, toc + body_content + ref_content)
@@ -0,0 +1,51 @@
+import os
+import re
+import tarfile
+
+ARTICLE_EXTENSIONS = ('.nxml', '.xml')
+_pmc_file_name = re.compile(r'(PMC\d+)\.n?xml$')
+_pmc_article_id = re.compile(rb'<article-id pub-id-type="pmc(?:id)?">\s*(?:PMC)?(\d+)\s*</article-id>')
+
+def pmc_id_of(member_name: str, head: bytes = b''):
+    """
+    Return the PMC ID of an article in a bulk archive, or None.
+
+    Bulk packages name the files after the article (``PMC000xxxxxx/PMC1234567.xml``); older
+    per-journal packages do not, then the ID is read from the ``article-id`` in head, the
+    beginning of the document.
+    """
+    match = _pmc_file_name.search(os.path.basename(member_name))
+    if match:
+        return match.group(1)
+    match = _pmc_article_id.search(head)
+    if match:
+        return f'PMC{match.group(1).decode()}'
+    return None
+
+def iter_bulk_articles(archive_file: str, pmc_ids=None):
+    """
+    Stream the articles of a PMC OA bulk ``.tar.gz`` in one sequential pass.
+
+    Nothing is extracted to disk and only one article is held in memory at a time. Bulk
+    packages only hold the XML, not the figures.
+
+    :param archive_file: Path of the bulk archive.
+    :type archive_file: str
+    :param pmc_ids: Only yield these articles, defaults to every article.
+    :type pmc_ids: set[str], optional
+    :return: Iterator of (PMC ID, nxml bytes).
+    :rtype: iterator[tuple[str, bytes]]
+    """
+    with tarfile.open(archive_file, mode='r|gz') as archive:
+        for member in archive:
+            if not member.isfile() or not member.name.endswith(ARTICLE_EXTENSIONS):
+                continue
+            pmc_id = pmc_id_of(member.name)
+            if pmc_id is not None and pmc_ids is not None and pmc_id not in pmc_ids:
+                continue  # skipped without reading the member
+            with archive.extractfile(member) as f:
+                nxml = f.read()
+            pmc_id = pmc_id or pmc_id_of(member.name, nxml[:65536])
+            if pmc_id is None or (pmc_ids is not None and pmc_id not in pmc_ids):
+                continue
+            yield pmc_id, nxml
@@ -0,0 +1,53 @@
+import json
+import os
+import shutil
+import threading
+
+from src.article_cache import ArticleCache
+
+# bump whenever oa_parser, image_optimizer, epub_writer or kepub change their output
+RENDERER_VERSION = '2'
+UNIT_FILE = 'chapter.json'
+DEFAULT_CHAPTER_CACHE_DIR = os.environ.get('PUBMED2EPUB_CHAPTER_CACHE_DIR',
+                                           os.path.expanduser('~/.cache/pubmed2epub-chapters'))
+DEFAULT_CHAPTER_CACHE_BYTES = int(os.environ.get('PUBMED2EPUB_CHAPTER_CACHE_BYTES', 1024 ** 3))
+
+def chapter_version(image_profile: str = 'default', kepub: bool = False, text_only: bool = False) -> str:
+    """Return the part of a chapter unit key besides the PMC ID: renderer version and build options."""
+    source = 'text' if text_only else image_profile
+    return f"r{RENDERER_VERSION}-{source}{'-kepub' if kepub else ''}"
+
+def write_unit(unit_dir: str, file_name: str, title: str, content: bytes, images: list):
+    """
+    Write a prebuilt chapter: its xhtml and the images it references, under their book paths.
+
+    :param images: (book path, source file) of every image of the chapter.
+    :type images: list[tuple[str, str]]
+    """
+    with open(os.path.join(unit_dir, file_name), 'wb') as f:
+        f.write(content)
+    for book_name, image_file in images:
+        target = os.path.join(unit_dir, book_name)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        if not os.path.exists(target):
+            shutil.copyfile(image_file, target)
+    with open(os.path.join(unit_dir, UNIT_FILE), 'w') as f:
+        json.dump({'file_name': file_name, 'title': title, 'images': [name for name, _ in images]}, f)
+
+def read_unit(unit_dir: str) -> dict:
+    """Return the description of a prebuilt chapter, with ``unit_dir`` added."""
+    with open(os.path.join(unit_dir, UNIT_FILE)) as f:
+        unit = json.load(f)
+    unit['dir'] = unit_dir
+    return unit
+
+_chapter_cache = None
+_chapter_cache_lock = threading.Lock()
+
+def get_chapter_cache() -> ArticleCache:
+    """Return the process-wide cache of prebuilt chapters, creating it on first use."""
+    global _chapter_cache
+    with _chapter_cache_lock:
+        if _chapter_cache is None:
+            _chapter_cache = ArticleCache(DEFAULT_CHAPTER_CACHE_DIR, DEFAULT_CHAPTER_CACHE_BYTES, name='chapter_cache')
+        return _chapter_cache
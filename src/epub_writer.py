@@ -0,0 +1,266 @@
+import mimetypes
+import time
+import zipfile
+from xml.sax.saxutils import escape, quoteattr
+
+from lxml import etree
+from lxml import html as lxml_html
+
+from src.kepub import kepubify_document
+
+CONTAINER_XML = '''<?xml version="1.0" encoding="utf-8"?>
+<container xmlns="urn:oasis:names:tc:opendocument:xmlns:container" version="1.0">
+  <rootfiles>
+    <rootfile media-type="application/oebps-package+xml" full-path="EPUB/content.opf"/>
+  </rootfiles>
+</container>
+'''
+
+CHAPTER_TEMPLATE = '''<!DOCTYPE html>
+<html xmlns="http://www.w3.org/1999/xhtml" xmlns:epub="http://www.idpf.org/2007/ops" epub:prefix="z3998: http://www.daisy.org/z3998/2012/vocab/structure/#"></html>'''
+
+XHTML_NS = 'http://www.w3.org/1999/xhtml'
+XML_LANG = '{http://www.w3.org/XML/1998/namespace}lang'
+
+def _remove_element(elem):
+    # remove elem from the tree, keeping the text that follows it
+    parent, previous = elem.getparent(), elem.getprevious()
+    if elem.tail:
+        if previous is not None:
+            previous.tail = (previous.tail or '') + elem.tail
+        else:
+            parent.text = (parent.text or '') + elem.tail
+    parent.remove(elem)
+
+def html_to_xhtml(html_content: str, title: str, lang: str = 'en', stylesheets=(), resolve_image=None,
+                  kepub: bool = False) -> bytes:
+    """
+    Wrap the body of an html page into an EPUB xhtml document.
+
+    :param html_content: The html page.
+    :type html_content: str
+    :param title: Title written to the document head.
+    :type title: str
+    :param lang: Document language, defaults to 'en'.
+    :type lang: str, optional
+    :param stylesheets: Book relative paths of the stylesheets to link.
+    :type stylesheets: list[str], optional
+    :param resolve_image: Called with the src of every image, returns the src to write instead, or
+        None to leave the image out, e.g. when its file is missing.
+    :type resolve_image: function, optional
+    :param kepub: Add the Kobo KEPUB markup, defaults to False.
+    :type kepub: bool, optional
+    :return: The serialized xhtml document.
+    :rtype: bytes
+    """
+    tree = etree.ElementTree(etree.fromstring(CHAPTER_TEMPLATE))
+    root = tree.getroot()
+    root.set('lang', lang)
+    root.set(XML_LANG, lang)
+
+    head = etree.SubElement(root, 'head')
+    if title:
+        etree.SubElement(head, 'title').text = title
+    for href in stylesheets:
+        etree.SubElement(head, 'link', {'href': href, 'rel': 'stylesheet', 'type': 'text/css'})
+
+    body = etree.SubElement(root, 'body')
+    html_body = lxml_html.document_fromstring(html_content, parser=lxml_html.HTMLParser(encoding='utf-8')).find('body')
+    if html_body is not None:
+        for child in html_body:
+            body.append(child)
+    if resolve_image is not None:
+        for img in list(body.iter('img')):
+            src = img.get('src')
+            if not src:
+                continue
+            resolved = resolve_image(src)
+            if resolved is None:
+                _remove_element(img)
+            else:
+                img.set('src', resolved)
+    if kepub:
+        # indenting would add text to the koboSpans
+        kepubify_document(root)
+    return etree.tostring(tree, pretty_print=not kepub, encoding='utf-8', xml_declaration=True)
+
+class EpubWriter:
+    """
+    EPUB 3 writer that streams chapters and images into the zip container as they are added.
+
+    Only the list of manifest entries is kept in memory; the package document, nav and NCX
+    are written when the writer is closed. Use it as a context manager::
+
+        with EpubWriter('book.epub', 'My collection') as book:
+            book.add_style('style/style.css', './styles/style.css')
+            book.add_chapter('PMC1.xhtml', 'PMC1', html_content)
+            book.add_image('figs/a.jpg', '/path/to/a.jpg')
+
+    :param output_file: Path of the EPUB to write.
+    :type output_file: str
+    :param title: Book title.
+    :type title: str
+    :param identifier: Unique identifier of the book.
+    :type identifier: str
+    :param language: Book language, defaults to 'en'.
+    :type language: str, optional
+    :param author: Book author.
+    :type author: str, optional
+    :param kepub: Write the chapters with Kobo KEPUB markup, defaults to False. Kobo readers
+        only treat the book as a KEPUB if its file name ends with ``.kepub.epub``.
+    :type kepub: bool, optional
+    """
+    def __init__(self, output_file: str, title: str, identifier: str = 'id123456', language: str = 'en',
+                 author: str = None, kepub: bool = False):
+        self.title = title
+        self.identifier = identifier
+        self.language = language
+        self.author = author
+        self.kepub = kepub
+        self._items = []
+        self._spine = []
+        self._toc = []
+        self._stylesheets = []
+        self._names = set()
+        self._zip = zipfile.ZipFile(output_file, 'w', compression=zipfile.ZIP_DEFLATED)
+        # the mimetype entry must come first and be stored uncompressed
+        self._zip.writestr('mimetype', 'application/epub+zip', compress_type=zipfile.ZIP_STORED)
+        self._zip.writestr('META-INF/container.xml', CONTAINER_XML)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self._zip.close()
+
+    def _add_item(self, file_name: str, media_type: str, properties: str = None) -> str:
+        uid = f'item_{len(self._items)}'
+        self._items.append((uid, file_name, media_type, properties))
+        self._names.add(file_name)
+        return uid
+
+    def has_item(self, file_name: str) -> bool:
+        return file_name in self._names
+
+    def add_style(self, file_name: str, css_file: str):
+        """Add a stylesheet from css_file, every chapter added afterwards links to it."""
+        self._zip.write(css_file, f'EPUB/{file_name}')
+        self._add_item(file_name, 'text/css')
+        self._stylesheets.append(file_name)
+
+    def render_chapter(self, title: str, html_content: str, resolve_image=None) -> bytes:
+        """Convert an html page to the xhtml of a chapter of this book, see ``html_to_xhtml``."""
+        return html_to_xhtml(html_content, title, self.language, self._stylesheets, resolve_image, self.kepub)
+
+    def add_chapter(self, file_name: str, title: str, html_content: str, resolve_image=None):
+        """
+        Convert an html page to xhtml, write it and append it to the spine and table of contents.
+
+        ``resolve_image`` is called with each image src of the chapter and returns the src to
+        use in the book; it is the place to add the referenced images with ``add_image``.
+        """
+        self.add_xhtml(file_name, title, self.render_chapter(title, html_content, resolve_image))
+
+    def add_xhtml(self, file_name: str, title: str, content: bytes):
+        """Write an already converted chapter and append it to the spine and table of contents."""
+        self._zip.writestr(f'EPUB/{file_name}', content)
+        uid = self._add_item(file_name, 'application/xhtml+xml')
+        self._spine.append(uid)
+        self._toc.append((file_name, title))
+
+    def add_image(self, file_name: str, image_file: str, media_type: str = None):
+        """Copy an image file into the book, streamed from disk."""
+        media_type = media_type or mimetypes.guess_type(file_name)[0] or 'application/octet-stream'
+        self._zip.write(image_file, f'EPUB/{file_name}')
+        self._add_item(file_name, media_type)
+
+    def _package_document(self) -> str:
+        modified = time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime())
+        metadata = [
+            f'    <meta property="dcterms:modified">{modified}</meta>',
+            f'    <dc:identifier id="id">{escape(self.identifier)}</dc:identifier>',
+            f'    <dc:title>{escape(self.title)}</dc:title>',
+            f'    <dc:language>{escape(self.language)}</dc:language>',
+        ]
+        if self.author:
+            metadata.append(f'    <dc:creator id="creator">{escape(self.author)}</dc:creator>')
+        manifest = []
+        for uid, file_name, media_type, properties in self._items:
+            props = f' properties="{properties}"' if properties else ''
+            manifest.append(f'    <item href={quoteattr(file_name)} id="{uid}" media-type="{media_type}"{props}/>')
+        spine = [f'    <itemref idref="{uid}"/>' for uid in ['nav'] + self._spine]
+        return '\n'.join([
+            "<?xml version='1.0' encoding='utf-8'?>",
+            '<package xmlns="http://www.idpf.org/2007/opf" unique-identifier="id" version="3.0">',
+            '  <metadata xmlns:dc="http://purl.org/dc/elements/1.1/" xmlns:opf="http://www.idpf.org/2007/opf">',
+            *metadata,
+            '  </metadata>',
+            '  <manifest>',
+            *manifest,
+            '    <item href="toc.ncx" id="ncx" media-type="application/x-dtbncx+xml"/>',
+            '    <item href="nav.xhtml" id="nav" media-type="application/xhtml+xml" properties="nav"/>',
+            '  </manifest>',
+            '  <spine toc="ncx">',
+            *spine,
+            '  </spine>',
+            '</package>',
+            '',
+        ])
+
+    def _nav_document(self) -> str:
+        links = [f'        <li><a href={quoteattr(href)}>{escape(title)}</a></li>' for href, title in self._toc]
+        return '\n'.join([
+            "<?xml version='1.0' encoding='utf-8'?>",
+            '<!DOCTYPE html>',
+            f'<html xmlns="{XHTML_NS}" xmlns:epub="http://www.idpf.org/2007/ops" lang={quoteattr(self.language)} '
+            f'xml:lang={quoteattr(self.language)}>',
+            '  <head>',
+            f'    <title>{escape(self.title)}</title>',
+            '  </head>',
+            '  <body>',
+            '    <nav epub:type="toc" id="id" role="doc-toc">',
+            f'      <h2>{escape(self.title)}</h2>',
+            '      <ol>',
+            *links,
+            '      </ol>',
+            '    </nav>',
+            '  </body>',
+            '</html>',
+            '',
+        ])
+
+    def _ncx_document(self) -> str:
+        nav_points = []
+        for i, (href, title) in enumerate(self._toc):
+            nav_points += [
+                f'    <navPoint id="navpoint_{i}">',
+                f'      <navLabel><text>{escape(title)}</text></navLabel>',
+                f'      <content src={quoteattr(href)}/>',
+                '    </navPoint>',
+            ]
+        return '\n'.join([
+            "<?xml version='1.0' encoding='utf-8'?>",
+            '<ncx xmlns="http://www.daisy.org/z3986/2005/ncx/" version="2005-1">',
+            '  <head>',
+            f'    <meta content={quoteattr(self.identifier)} name="dtb:uid"/>',
+            '    <meta content="0" name="dtb:depth"/>',
+            '    <meta content="0" name="dtb:totalPageCount"/>',
+            '    <meta content="0" name="dtb:maxPageNumber"/>',
+            '  </head>',
+            f'  <docTitle><text>{escape(self.title)}</text></docTitle>',
+            '  <navMap>',
+            *nav_points,
+            '  </navMap>',
+            '</ncx>',
+            '',
+        ])
+
+    def close(self):
+        """Write the package document, nav and NCX and close the archive."""
+        self._zip.writestr('EPUB/nav.xhtml', self._nav_document())
+        self._zip.writestr('EPUB/toc.ncx', self._ncx_document())
+        self._zip.writestr('EPUB/content.opf', self._package_document())
+        self._zip.close()
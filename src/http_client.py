@@ -0,0 +1,131 @@
+import os
+import threading
+import time
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+# settings of the process-wide client, see ``get_client``
+DEFAULT_TIMEOUT = (float(os.environ.get('PUBMED2EPUB_HTTP_CONNECT_TIMEOUT', 5)),
+                   float(os.environ.get('PUBMED2EPUB_HTTP_READ_TIMEOUT', 30)))
+DEFAULT_RETRIES = int(os.environ.get('PUBMED2EPUB_HTTP_RETRIES', 3))
+DEFAULT_BACKOFF_FACTOR = float(os.environ.get('PUBMED2EPUB_HTTP_BACKOFF_FACTOR', 0.5))
+
+class HttpClient:
+    """
+    Shared HTTP client with per-host connection pooling, timeouts and retries.
+
+    Failed GETs (connection errors and ``RETRY_STATUSES``) are retried with exponential
+    backoff; a ``Retry-After`` header from the server takes precedence over the backoff.
+    Request counts and latencies are kept per endpoint (host + path).
+
+    :param timeout: Default ``(connect, read)`` timeout in seconds.
+    :type timeout: tuple[float, float]
+    :param retries: Maximum number of retries per request, defaults to 3.
+    :type retries: int, optional
+    :param backoff_factor: Backoff base in seconds, the n-th retry sleeps ``backoff_factor * 2 ** (n - 1)``.
+    :type backoff_factor: float, optional
+    :param pool_maxsize: Maximum number of kept-alive connections per host, defaults to 10.
+    :type pool_maxsize: int, optional
+    """
+    def __init__(self, timeout=DEFAULT_TIMEOUT, retries: int = DEFAULT_RETRIES,
+                 backoff_factor: float = DEFAULT_BACKOFF_FACTOR, pool_maxsize: int = 10):
+        self.timeout = timeout
+        retry = Retry(
+            total=retries,
+            backoff_factor=backoff_factor,
+            status_forcelist=RETRY_STATUSES,
+            allowed_methods=frozenset(['GET', 'HEAD']),
+            respect_retry_after_header=True,
+            raise_on_status=False,
+        )
+        adapter = HTTPAdapter(pool_connections=10, pool_maxsize=pool_maxsize, max_retries=retry)
+        self.session = requests.Session()
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self._stats = {}
+        self._lock = threading.Lock()
+
+    def _record(self, endpoint: str, elapsed: float, status=None, retries: int = 0):
+        with self._lock:
+            stats = self._stats.setdefault(endpoint, {
+                'requests': 0, 'errors': 0, 'retries': 0, 'total_seconds': 0.0, 'max_seconds': 0.0,
+            })
+            stats['requests'] += 1
+            stats['retries'] += retries
+            stats['total_seconds'] += elapsed
+            stats['max_seconds'] = max(stats['max_seconds'], elapsed)
+            if status is None or status >= 400:
+                stats['errors'] += 1
+
+    def get(self, url: str, **kwargs) -> requests.Response:
+        """Send a GET request through the pool, ``kwargs`` are passed on to ``requests``."""
+        kwargs.setdefault('timeout', self.timeout)
+        parts = urlsplit(url)
+        endpoint = f'{parts.netloc}{parts.path}'
+        start = time.perf_counter()
+        try:
+            response = self.session.get(url, **kwargs)
+        except requests.RequestException:
+            self._record(endpoint, time.perf_counter() - start)
+            raise
+        retry_state = getattr(response.raw, 'retries', None)
+        retries = len(retry_state.history) if retry_state is not None else 0
+        self._record(endpoint, time.perf_counter() - start, response.status_code, retries)
+        return response
+
+    def get_stats(self) -> dict:
+        """
+        Return a snapshot of the per-endpoint counters.
+
+        :return: A dictionary keyed by endpoint with request, error and retry counts and
+            total/mean/max latency in seconds.
+        :rtype: dict
+        """
+        with self._lock:
+            snapshot = {endpoint: dict(stats) for endpoint, stats in self._stats.items()}
+        for stats in snapshot.values():
+            stats['mean_seconds'] = stats['total_seconds'] / stats['requests']
+        return snapshot
+
+    def to_prometheus(self, prefix: str = 'pubmed2epub') -> str:
+        """Render the per-endpoint counters in the Prometheus text exposition format."""
+        stats = self.get_stats()
+        lines = []
+        for suffix, key, kind in (('http_requests_total', 'requests', 'counter'),
+                                  ('http_errors_total', 'errors', 'counter'),
+                                  ('http_retries_total', 'retries', 'counter'),
+                                  ('http_seconds_total', 'total_seconds', 'counter'),
+                                  ('http_seconds_max', 'max_seconds', 'gauge')):
+            if stats:
+                lines.append(f'# TYPE {prefix}_{suffix} {kind}')
+            for endpoint, endpoint_stats in sorted(stats.items()):
+                lines.append(f'{prefix}_{suffix}{{endpoint="{endpoint}"}} {endpoint_stats[key]}')
+        return ''.join(line + '\n' for line in lines)
+
+_client = None
+_client_lock = threading.Lock()
+
+def get_client() -> HttpClient:
+    """
+    Return the process-wide ``HttpClient``, creating it on first use.
+
+    Its timeouts and retries come from ``PUBMED2EPUB_HTTP_CONNECT_TIMEOUT``,
+    ``PUBMED2EPUB_HTTP_READ_TIMEOUT``, ``PUBMED2EPUB_HTTP_RETRIES`` and
+    ``PUBMED2EPUB_HTTP_BACKOFF_FACTOR``, or from the last ``configure_client`` call.
+    """
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = HttpClient()
+        return _client
+
+def configure_client(**kwargs) -> HttpClient:
+    """Replace the process-wide client with one built from ``kwargs``, see ``HttpClient``."""
+    global _client
+    with _client_lock:
+        _client = HttpClient(**kwargs)
+        return _client
@@ -0,0 +1,159 @@
+import hashlib
+import os
+import shutil
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import NamedTuple
+
+from PIL import Image, ImageOps
+
+from src.article_cache import ArticleCache
+
+DEFAULT_IMAGE_CACHE_DIR = os.environ.get('PUBMED2EPUB_IMAGE_CACHE_DIR',
+                                         os.path.expanduser('~/.cache/pubmed2epub-images'))
+DEFAULT_IMAGE_CACHE_BYTES = int(os.environ.get('PUBMED2EPUB_IMAGE_CACHE_BYTES', 1024 ** 3))
+DERIVATIVE_FILE = 'figure.jpg'
+# figure formats found in OA packages, in order of preference when a figure ships in several
+SOURCE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.tif', '.tiff', '.gif')
+
+class ImageProfile(NamedTuple):
+    """
+    Target rendering of figures for a kind of e-reader.
+
+    :param max_dimension: Longest side in pixels, None keeps the original size.
+    :param grayscale: Convert figures to grayscale.
+    :param quality: JPEG quality of the output.
+    """
+    max_dimension: int = 1600
+    grayscale: bool = False
+    quality: int = 85
+
+    @property
+    def key(self) -> str:
+        return f"{self.max_dimension or 'full'}-{'gray' if self.grayscale else 'rgb'}-q{self.quality}"
+
+PROFILES = {
+    'default': ImageProfile(),
+    'eink': ImageProfile(max_dimension=1200, grayscale=True, quality=70),
+    'original': ImageProfile(max_dimension=None, grayscale=False, quality=95),
+}
+
+def file_digest(file_name: str) -> str:
+    digest = hashlib.sha256()
+    with open(file_name, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def render_image(src_file: str, dest_file: str, profile: ImageProfile):
+    """Write src_file as a JPEG scaled and converted according to profile."""
+    with Image.open(src_file) as image:
+        image = ImageOps.exif_transpose(image)
+        if image.mode in ('RGBA', 'LA', 'P') and (image.mode != 'P' or 'transparency' in image.info):
+            # flatten transparent figures onto a white page
+            image = image.convert('RGBA')
+            background = Image.new('RGBA', image.size, (255, 255, 255, 255))
+            image = Image.alpha_composite(background, image)
+        image = image.convert('L' if profile.grayscale else 'RGB')
+        if profile.max_dimension:
+            image.thumbnail((profile.max_dimension, profile.max_dimension), Image.LANCZOS)
+        image.save(dest_file, 'JPEG', quality=profile.quality, optimize=True, progressive=True)
+
+_image_cache = None
+_image_cache_lock = threading.Lock()
+
+def get_image_cache() -> ArticleCache:
+    """Return the process-wide cache of figure derivatives, creating it on first use."""
+    global _image_cache
+    with _image_cache_lock:
+        if _image_cache is None:
+            _image_cache = ArticleCache(DEFAULT_IMAGE_CACHE_DIR, DEFAULT_IMAGE_CACHE_BYTES, name='image_cache')
+        return _image_cache
+
+def optimize_image(src_file: str, profile: ImageProfile = PROFILES['default'], cache: ArticleCache = None,
+                   evict: bool = True) -> str:
+    """
+    Return the path of the derivative of src_file for profile, rendering it on a cache miss.
+
+    Derivatives are keyed by the source content hash and the profile, so each one is
+    computed once and shared by every article and build that uses the same figure.
+
+    :param src_file: The source figure.
+    :type src_file: str
+    :param profile: Target image profile.
+    :type profile: ImageProfile, optional
+    :param cache: Cache holding the derivatives, defaults to ``get_image_cache()``.
+    :type cache: src.article_cache.ArticleCache, optional
+    :param evict: Trim the cache to its byte budget after a miss, defaults to True.
+    :type evict: bool, optional
+    :return: Path of the cached JPEG derivative.
+    :rtype: str
+    """
+    cache = cache or get_image_cache()
+    digest = file_digest(src_file)
+    entry_dir = cache.get(digest, profile.key)
+    if entry_dir is None:
+        entry_dir = cache.put(digest, lambda tmp_dir: render_image(src_file, os.path.join(tmp_dir, DERIVATIVE_FILE),
+                                                                   profile),
+                              profile.key, evict=evict)
+    return os.path.join(entry_dir, DERIVATIVE_FILE)
+
+def find_figure_sources(src_dir: str) -> dict:
+    """Map each figure name in src_dir to its preferred source file."""
+    sources = {}
+    for file_name in os.listdir(src_dir):
+        stem, ext = os.path.splitext(file_name)
+        ext = ext.lower()
+        if ext not in SOURCE_EXTENSIONS:
+            continue
+        current = sources.get(stem)
+        if current is None or SOURCE_EXTENSIONS.index(ext) < SOURCE_EXTENSIONS.index(os.path.splitext(current)[1].lower()):
+            sources[stem] = file_name
+    return {stem: os.path.join(src_dir, file_name) for stem, file_name in sources.items()}
+
+def optimize_figures(src_dir: str, dest_dir: str, profile: ImageProfile = PROFILES['default'],
+                     cache: ArticleCache = None, workers: int = 4) -> list:
+    """
+    Normalize the figures of an article to ``{dest_dir}/{name}.jpg`` in parallel.
+
+    Figures that cannot be decoded, or exceed Pillow's decompression bomb limit, are copied
+    unchanged if they are JPEGs and skipped otherwise. The derivative cache is trimmed to its
+    byte budget once the article is done.
+
+    :param src_dir: Directory of the extracted article package.
+    :type src_dir: str
+    :param dest_dir: Directory to write the figures to.
+    :type dest_dir: str
+    :param profile: Target image profile.
+    :type profile: ImageProfile, optional
+    :param cache: Cache holding the derivatives, defaults to ``get_image_cache()``.
+    :type cache: src.article_cache.ArticleCache, optional
+    :param workers: Number of images processed concurrently, defaults to 4.
+    :type workers: int, optional
+    :return: The written figure paths.
+    :rtype: list[str]
+    """
+    os.makedirs(dest_dir, exist_ok=True)
+    sources = find_figure_sources(src_dir)
+    cache = cache or get_image_cache()
+
+    def process(item):
+        stem, src_file = item
+        dest_file = os.path.join(dest_dir, f'{stem}.jpg')
+        try:
+            shutil.copyfile(optimize_image(src_file, profile, cache, evict=False), dest_file)
+        except (OSError, Image.DecompressionBombError):
+            if not os.path.isfile(src_file):
+                raise  # the package was evicted while it was read
+            # a figure Pillow cannot decode is shipped as is if it already is a JPEG
+            if not src_file.lower().endswith(('.jpg', '.jpeg')):
+                return None
+            shutil.copyfile(src_file, dest_file)
+        return dest_file
+
+    if not sources:
+        return []
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        figures = [dest_file for dest_file in executor.map(process, sources.items()) if dest_file]
+    cache.evict()
+    return figures
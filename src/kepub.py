@@ -0,0 +1,115 @@
+import re
+
+from lxml import etree
+
+# elements starting a new Kobo paragraph
+PARAGRAPH_TAGS = {'p', 'ol', 'ul', 'table', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6'}
+# elements whose content is left alone
+SKIP_TAGS = {'pre', 'script', 'style', 'svg', 'math'}
+KOBO_STYLE_HACKS = 'div#book-inner { margin-top: 0; margin-bottom: 0;}'
+
+# a sentence ends with . ! or ?, optional closing quotes or brackets, and the whitespace after it
+_sentences = re.compile(r'.*?[.!?]+[\'"’”)\]]*\s+|.+', re.S)
+
+def _localname(elem):
+    return etree.QName(elem).localname
+
+def split_sentences(text: str) -> list:
+    return _sentences.findall(text)
+
+class _KoboSpanner:
+    """Numbers text the way Kobo's reader expects: kobo.{paragraph}.{segment}."""
+    def __init__(self):
+        self.paragraph = 0
+        self.segment = 0
+
+    def _span(self):
+        self.segment += 1
+        span = etree.Element('span', {'class': 'koboSpan', 'id': f'kobo.{self.paragraph}.{self.segment}'})
+        return span
+
+    def _spans_for(self, text, keep_blank):
+        if not text or (not keep_blank and not text.strip()):
+            return None
+        spans = []
+        for sentence in split_sentences(text):
+            span = self._span()
+            span.text = sentence
+            spans.append(span)
+        return spans
+
+    def _wrap_tail(self, parent, child, keep_blank):
+        spans = self._spans_for(child.tail, keep_blank)
+        if spans is None:
+            return child
+        child.tail = None
+        index = parent.index(child)
+        for offset, span in enumerate(spans, start=1):
+            parent.insert(index + offset, span)
+        return spans[-1]
+
+    def walk(self, elem, in_paragraph=False):
+        name = _localname(elem)
+        if name in SKIP_TAGS:
+            return
+        if name in PARAGRAPH_TAGS:
+            self.paragraph += 1
+            self.segment = 0
+        in_paragraph = in_paragraph or name == 'p'
+
+        children = list(elem)
+        spans = self._spans_for(elem.text, in_paragraph)
+        if spans is not None:
+            elem.text = None
+            for index, span in enumerate(spans):
+                elem.insert(index, span)
+
+        for child in children:
+            if not isinstance(child.tag, str):
+                self._wrap_tail(elem, child, in_paragraph)
+                continue
+            if _localname(child) == 'img':
+                if self.segment:
+                    self.paragraph += 1
+                    self.segment = 0
+                span = self._span()
+                span.tail, child.tail = child.tail, None
+                elem.replace(child, span)
+                span.append(child)
+                child = span
+            else:
+                self.walk(child, in_paragraph)
+            self._wrap_tail(elem, child, in_paragraph)
+
+def kepubify_document(root):
+    """
+    Apply Kobo KEPUB markup to a parsed xhtml chapter, in place.
+
+    Sentences and images in the body are wrapped in numbered ``koboSpan`` elements, the body
+    content is wrapped in the ``book-columns``/``book-inner`` divs and Kobo's style fixes are
+    added to the head, matching what kepubify produces.
+    """
+    head = body = None
+    for child in root:
+        if isinstance(child.tag, str):
+            name = _localname(child)
+            if name == 'head':
+                head = child
+            elif name == 'body':
+                body = child
+    if body is None:
+        return root
+
+    _KoboSpanner().walk(body)
+
+    columns = etree.Element('div', {'id': 'book-columns'})
+    inner = etree.SubElement(columns, 'div', {'id': 'book-inner'})
+    inner.text, body.text = body.text, None
+    for child in list(body):
+        inner.append(child)
+    body.append(columns)
+
+    if head is not None:
+        style = etree.SubElement(head, 'style', {'type': 'text/css', 'class': 'kobostylehacks'})
+        style.text = KOBO_STYLE_HACKS
+    return root
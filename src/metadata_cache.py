@@ -0,0 +1,112 @@
+import functools
+import threading
+import time
+from collections import OrderedDict
+
+_MISSING = object()
+
+class TTLCache:
+    """
+    Thread-safe LRU cache whose entries also expire after a time to live.
+
+    Lookups, inserts and evictions are O(1): entries are kept in an ``OrderedDict`` in
+    recency order, so the least recently used one is always first.
+
+    :param maxsize: Maximum number of entries, defaults to 1024.
+    :type maxsize: int, optional
+    :param ttl: Default time to live of an entry in seconds, defaults to 3600.
+    :type ttl: float, optional
+    """
+    def __init__(self, maxsize: int = 1024, ttl: float = 3600):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+        self._expirations = 0
+
+    def get(self, key, default=None):
+        with self._lock:
+            item = self._data.get(key, _MISSING)
+            if item is _MISSING:
+                self._misses += 1
+                return default
+            expires_at, value = item
+            if expires_at < time.monotonic():
+                del self._data[key]
+                self._expirations += 1
+                self._misses += 1
+                return default
+            self._data.move_to_end(key)
+            self._hits += 1
+            return value
+
+    def set(self, key, value, ttl: float = None):
+        expires_at = time.monotonic() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._data[key] = (expires_at, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self._evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self._hits + self._misses
+            return {
+                'size': len(self._data),
+                'maxsize': self.maxsize,
+                'hits': self._hits,
+                'misses': self._misses,
+                'hit_rate': self._hits / lookups if lookups else 0.0,
+                'evictions': self._evictions,
+                'expirations': self._expirations,
+            }
+
+# caches shared by every session of the process, by name
+_caches = {}
+_caches_lock = threading.Lock()
+
+def named_cache(name: str, maxsize: int = 1024, ttl: float = 3600) -> TTLCache:
+    """Return the process-wide cache called name, creating it with maxsize and ttl on first use."""
+    with _caches_lock:
+        if name not in _caches:
+            _caches[name] = TTLCache(maxsize, ttl)
+        return _caches[name]
+
+def cache_stats() -> dict:
+    """Return the statistics of every named cache."""
+    with _caches_lock:
+        caches = dict(_caches)
+    return {name: cache.stats() for name, cache in caches.items()}
+
+def ttl_lru_cache(name: str, maxsize: int = 1024, ttl: float = 3600):
+    """
+    Decorator caching the results of a function with hashable arguments in ``named_cache(name)``.
+
+    Exceptions are not cached.
+    """
+    def decorator(fn):
+        cache = named_cache(name, maxsize, ttl)
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            key = (args, tuple(sorted(kwargs.items())))
+            value = cache.get(key, _MISSING)
+            if value is _MISSING:
+                value = fn(*args, **kwargs)
+                cache.set(key, value)
+            return value
+
+        wrapper.cache = cache
+        return wrapper
+    return decorator
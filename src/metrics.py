@@ -0,0 +1,119 @@
+import contextvars
+import json
+import logging
+import re
+import threading
+import time
+from contextlib import contextmanager
+
+logger = logging.getLogger('pubmed2epub.metrics')
+
+class Metrics:
+    """
+    Thread-safe span timers and counters.
+
+    Spans accumulate their count, total and maximum duration in seconds; counters accumulate
+    a number (bytes downloaded, figures, references, cache hits, ...).
+    """
+    def __init__(self):
+        self._spans = {}
+        self._counters = {}
+        self._lock = threading.Lock()
+
+    def record_span(self, name: str, seconds: float):
+        with self._lock:
+            span = self._spans.setdefault(name, {'count': 0, 'total_seconds': 0.0, 'max_seconds': 0.0})
+            span['count'] += 1
+            span['total_seconds'] += seconds
+            span['max_seconds'] = max(span['max_seconds'], seconds)
+
+    def incr(self, name: str, value=1):
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + value
+
+    def merge(self, other: 'Metrics'):
+        """Add the spans and counters of other to these metrics."""
+        data = other.to_dict()
+        with self._lock:
+            for name, other_span in data['spans'].items():
+                span = self._spans.setdefault(name, {'count': 0, 'total_seconds': 0.0, 'max_seconds': 0.0})
+                span['count'] += other_span['count']
+                span['total_seconds'] += other_span['total_seconds']
+                span['max_seconds'] = max(span['max_seconds'], other_span['max_seconds'])
+            for name, value in data['counters'].items():
+                self._counters[name] = self._counters.get(name, 0) + value
+
+    def to_dict(self) -> dict:
+        with self._lock:
+            return {
+                'spans': {name: dict(span) for name, span in self._spans.items()},
+                'counters': dict(self._counters),
+            }
+
+    def to_json(self) -> str:
+        return json.dumps(self.to_dict(), sort_keys=True)
+
+    def to_prometheus(self, prefix: str = 'pubmed2epub') -> str:
+        """Render the metrics in the Prometheus text exposition format."""
+        data = self.to_dict()
+        lines = []
+        if data['spans']:
+            for suffix, key, kind in (('span_seconds_total', 'total_seconds', 'counter'),
+                                      ('span_count', 'count', 'counter'),
+                                      ('span_seconds_max', 'max_seconds', 'gauge')):
+                lines.append(f'# TYPE {prefix}_{suffix} {kind}')
+                for name, span in sorted(data['spans'].items()):
+                    lines.append(f'{prefix}_{suffix}{{span="{name}"}} {span[key]}')
+        for name, value in sorted(data['counters'].items()):
+            metric = f"{prefix}_{re.sub('[^a-zA-Z0-9_]', '_', name)}_total"
+            lines.append(f'# TYPE {metric} counter')
+            lines.append(f'{metric} {value}')
+        return '\n'.join(lines) + '\n'
+
+# process-wide metrics, plus the per-build collectors opened with ``recording``
+REGISTRY = Metrics()
+_recorders = contextvars.ContextVar('pubmed2epub_metrics_recorders', default=())
+
+def _targets():
+    return (REGISTRY,) + _recorders.get()
+
+@contextmanager
+def span(name: str):
+    """Time the enclosed block as span ``name`` and log it as a JSON line."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        seconds = time.perf_counter() - start
+        for metrics in _targets():
+            metrics.record_span(name, seconds)
+        if logger.isEnabledFor(logging.INFO):
+            logger.info(json.dumps({'event': 'span', 'span': name, 'seconds': round(seconds, 6)}))
+
+def incr(name: str, value=1):
+    """Add value to counter ``name``."""
+    for metrics in _targets():
+        metrics.incr(name, value)
+
+def merge(recorded: Metrics):
+    """
+    Add metrics recorded apart, e.g. by work done ahead of a build on another thread, to the
+    open recordings. ``REGISTRY`` is left alone: it already saw them as they happened.
+    """
+    for metrics in _recorders.get():
+        metrics.merge(recorded)
+
+@contextmanager
+def recording():
+    """
+    Collect the spans and counters of the enclosed block, e.g. one build, in a new ``Metrics``.
+
+    Work handed to other threads is only included if it runs in a copy of the caller's
+    context (``contextvars.copy_context().run``).
+    """
+    metrics = Metrics()
+    token = _recorders.set(_recorders.get() + (metrics,))
+    try:
+        yield metrics
+    finally:
+        _recorders.reset(token)
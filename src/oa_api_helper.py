@@ -1,8 +1,86 @@
+import hashlib
 import json
+import os
+import re
+import shutil
 import tarfile
+import threading
+import time
 import xml.etree.ElementTree as ET
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import NamedTuple
+from urllib.parse import urlsplit
 
-import requests
+from src import metrics
+from src.http_client import get_client
+from src.metadata_cache import ttl_lru_cache
+from src.oa_index import get_oa_index
+
+try:
+    import fcntl
+except ImportError:  # Windows: downloads of a package are only serialized within the process
+    fcntl = None
+
+OA_API_URL = "https://www.ncbi.nlm.nih.gov/pmc/utils/oa/oa.fcgi"
+ESEARCH_URL = "https://eutils.ncbi.nlm.nih.gov/entrez/eutils/esearch.fcgi"
+ESUMMARY_URL = "https://eutils.ncbi.nlm.nih.gov/entrez/eutils/esummary.fcgi"
+
+class TokenBucket:
+    """
+    Thread-safe token bucket used to stay under NCBI's request-rate limits.
+
+    :param rate: Tokens added per second.
+    :type rate: float
+    :param capacity: Maximum burst size, defaults to ``rate``.
+    :type capacity: float, optional
+    """
+    def __init__(self, rate: float, capacity: float = None):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else rate
+        self._tokens = self.capacity
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, tokens: float = 1):
+        """
+        Block until tokens are available and take them.
+
+        A request larger than ``capacity`` waits for a full bucket and leaves it in debt,
+        which later requests pay back.
+        """
+        needed = min(tokens, self.capacity)
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._last) * self.rate)
+                self._last = now
+                if self._tokens >= needed:
+                    self._tokens -= tokens
+                    return
+                wait = (needed - self._tokens) / self.rate
+            time.sleep(wait)
+
+# NCBI allows 3 requests per second per client without an API key.
+NCBI_RATE_LIMITER = TokenBucket(rate=3)
+
+# package members used by the conversion: the article xml and its figures
+PACKAGE_MEMBER_EXTENSIONS = ('.nxml', '.jpg', '.jpeg', '.png', '.tif', '.tiff', '.gif')
+
+# packages at least this large are downloaded in ranges to a file, smaller ones are streamed
+RANGED_DOWNLOAD_BYTES = 32 * 1024 ** 2
+DOWNLOAD_CHUNK_BYTES = 4 * 1024 ** 2
+DOWNLOAD_WORKERS = 4
+DEFAULT_DOWNLOAD_DIR = os.environ.get('PUBMED2EPUB_DOWNLOAD_DIR', os.path.expanduser('~/.cache/pubmed2epub-downloads'))
+# range requests in flight across every download of the process
+DOWNLOAD_SLOTS = threading.BoundedSemaphore(int(os.environ.get('PUBMED2EPUB_DOWNLOAD_CONNECTIONS', 8)))
+# bytes per second across every download of the process, unlimited by default
+_bandwidth = int(os.environ.get('PUBMED2EPUB_DOWNLOAD_BYTES_PER_SECOND', 0))
+DOWNLOAD_BANDWIDTH = TokenBucket(rate=_bandwidth) if _bandwidth else None
+_BLOCK_BYTES = 64 * 1024
+_download_locks = {}
+_download_locks_lock = threading.Lock()
+_content_range = re.compile(r'bytes\s+\d+-\d+/(\d+)')
 
 
 def extract_tar_gz(file_path, extract_path='.'):
@@ -11,15 +89,244 @@ def extract_tar_gz(file_path, extract_path='.'):
         # Extract all files into the directory specified by extract_path
         file.extractall(path=extract_path)
 
-def download_file(url, local_filename):
-    with requests.get(url, stream=True) as r:
-        r.raise_for_status()
-        with open(local_filename, 'wb') as f:
-            for chunk in r.iter_content(chunk_size=8192):
-                f.write(chunk)
+def _copy_body(response, f) -> int:
+    """Write a streamed response body to f under ``DOWNLOAD_BANDWIDTH``, return the bytes written."""
+    written = 0
+    for block in response.iter_content(chunk_size=_BLOCK_BYTES):
+        if DOWNLOAD_BANDWIDTH is not None:
+            DOWNLOAD_BANDWIDTH.acquire(len(block))
+        f.write(block)
+        written += len(block)
+    metrics.incr('bytes_downloaded', written)
+    return written
+
+def _save_state(state_file: str, state: dict):
+    tmp_file = f'{state_file}.tmp'
+    with open(tmp_file, 'w') as f:
+        json.dump(state, f)
+    os.replace(tmp_file, state_file)
+
+def _load_state(state_file: str, part_file: str, expected: dict) -> set:
+    """Return the chunks already downloaded, if the partial file was started with the same parameters."""
+    try:
+        with open(state_file) as f:
+            state = json.load(f)
+    except (OSError, ValueError):
+        return set()
+    if any(state.get(key) != value for key, value in expected.items()) or not os.path.isfile(part_file):
+        return set()
+    return set(state.get('done', []))
+
+def _download_ranges(url: str, part_file: str, state_file: str, size: int, validator: str,
+                     chunk_bytes: int, workers: int):
+    expected = {'url': url, 'size': size, 'validator': validator, 'chunk_bytes': chunk_bytes}
+    done = _load_state(state_file, part_file, expected)
+    if done:
+        metrics.incr('download_resumes')
+    else:
+        with open(part_file, 'wb') as f:
+            f.truncate(size)
+    lock = threading.Lock()
+
+    def fetch(index):
+        start = index * chunk_bytes
+        end = min(size, start + chunk_bytes) - 1
+        # If-Range turns the answer into the full, changed file instead of a range of it
+        headers = {'Range': f'bytes={start}-{end}', 'Accept-Encoding': 'identity'}
+        if validator:
+            headers['If-Range'] = validator
+        with DOWNLOAD_SLOTS, get_client().get(url, headers=headers, stream=True) as r:
+            r.raise_for_status()
+            if r.status_code != 206:
+                raise ValueError(f'{url} changed during the download')
+            with open(part_file, 'r+b') as f:
+                f.seek(start)
+                written = _copy_body(r, f)
+        if written != end - start + 1:
+            raise OSError(f'short range {start}-{end} of {url}: {written} bytes')
+        with lock:
+            done.add(index)
+            _save_state(state_file, dict(expected, done=sorted(done)))
+
+    pending = [index for index in range(-(-size // chunk_bytes)) if index not in done]
+    metrics.incr('download_chunks', len(pending))
+    if pending:
+        with ThreadPoolExecutor(max_workers=min(workers, len(pending))) as executor:
+            list(executor.map(fetch, pending))
+
+def _verify(part_file: str, size: int, checksum: str, hash_name: str):
+    actual_size = os.path.getsize(part_file)
+    if size is not None and actual_size != size:
+        raise ValueError(f'{part_file}: {actual_size} bytes, expected {size}')
+    if checksum:
+        digest = hashlib.new(hash_name)
+        with open(part_file, 'rb') as f:
+            for block in iter(lambda: f.read(1024 ** 2), b''):
+                digest.update(block)
+        if digest.hexdigest() != checksum.lower():
+            raise ValueError(f'{part_file}: {hash_name} {digest.hexdigest()}, expected {checksum}')
+
+def download_file(url, local_filename, expected_size: int = None, checksum: str = None, hash_name: str = 'md5',
+                  chunk_bytes: int = DOWNLOAD_CHUNK_BYTES, workers: int = DOWNLOAD_WORKERS):
+    """
+    Download url to local_filename, in parallel ranges when the server supports them.
+
+    The data goes to ``{local_filename}.part``; with ranges, the finished chunks are
+    recorded in the sidecar ``{local_filename}.part.json``, so a later call after a dropped
+    connection or a crash only fetches the missing chunks, provided the file on the server
+    has the same size and ETag (or Last-Modified). Servers without range support get a
+    single streamed GET. The file is renamed to local_filename once its size, and checksum
+    if given, are verified.
+
+    Every range request takes one of the process-wide ``DOWNLOAD_SLOTS``, and all downloads
+    share ``DOWNLOAD_BANDWIDTH`` when ``PUBMED2EPUB_DOWNLOAD_BYTES_PER_SECOND`` is set.
+    Concurrent calls must not share a local_filename; ``download_and_extract`` locks it.
+
+    :param expected_size: Size in bytes the file must have.
+    :type expected_size: int, optional
+    :param checksum: Hex digest the file must have.
+    :type checksum: str, optional
+    :param hash_name: ``hashlib`` algorithm of checksum, defaults to 'md5'.
+    :type hash_name: str, optional
+    :param chunk_bytes: Size of one range request, defaults to ``DOWNLOAD_CHUNK_BYTES``.
+    :type chunk_bytes: int, optional
+    :param workers: Range requests in flight for this file, defaults to ``DOWNLOAD_WORKERS``.
+    :type workers: int, optional
+    :raises ValueError: If the file does not verify or changes on the server during the download;
+        the partial download is dropped. Other failures keep it for the next call.
+    """
+    part_file, state_file = f'{local_filename}.part', f'{local_filename}.part.json'
+    with metrics.span('download'):
+        # a one byte range tells whether ranges are supported, the size and the version of the file
+        with DOWNLOAD_SLOTS, get_client().get(url, headers={'Range': 'bytes=0-0', 'Accept-Encoding': 'identity'},
+                                              stream=True) as r:
+            r.raise_for_status()
+            match = _content_range.match(r.headers.get('Content-Range', ''))
+            ranged = r.status_code == 206 and match is not None
+            if ranged:
+                size = int(match.group(1))
+            else:
+                size = int(r.headers['Content-Length']) if 'Content-Length' in r.headers else None
+                with open(part_file, 'wb') as f:
+                    _copy_body(r, f)
+            validator = r.headers.get('ETag') or r.headers.get('Last-Modified')
+        try:
+            if expected_size is not None and size is not None and size != expected_size:
+                raise ValueError(f'{url} is {size} bytes, expected {expected_size}')
+            if ranged:
+                _download_ranges(url, part_file, state_file, size, validator, chunk_bytes, workers)
+            _verify(part_file, expected_size if size is None else size, checksum, hash_name)
+        except ValueError:
+            # start over next time rather than resume a corrupt file
+            for file in (part_file, state_file):
+                if os.path.exists(file):
+                    os.remove(file)
+            raise
+        os.replace(part_file, local_filename)
+        if os.path.exists(state_file):
+            os.remove(state_file)
+
+def is_needed_member(name: str) -> bool:
+    return name.lower().endswith(PACKAGE_MEMBER_EXTENSIONS)
+
+def extract_tar_gz_stream(fileobj, extract_path='.', member_filter=is_needed_member):
+    """
+    Extract selected members from a gzip tar stream in one sequential pass.
+
+    Members rejected by ``member_filter`` are read past without being written or buffered,
+    so the stream never has to be saved to disk first.
+
+    :param fileobj: A readable binary file object positioned at the start of the .tar.gz data.
+    :param extract_path: Directory to extract into, defaults to the working directory.
+    :type extract_path: str, optional
+    :param member_filter: Predicate on the member name deciding whether to extract it.
+    :type member_filter: function, optional
+    :return: The paths of the extracted files.
+    :rtype: list[str]
+    """
+    root = os.path.realpath(extract_path)
+    extracted = []
+    with tarfile.open(fileobj=fileobj, mode='r|gz') as file:
+        for member in file:
+            if not member.isfile() or not member_filter(member.name):
+                continue
+            target = os.path.realpath(os.path.join(root, member.name))
+            if not target.startswith(root + os.sep):
+                continue  # do not follow absolute or ../ member names out of extract_path
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            with file.extractfile(member) as src, open(target, 'wb') as dst:
+                shutil.copyfileobj(src, dst)
+            extracted.append(target)
+    return extracted
+
+@contextmanager
+def _exclusive(path: str):
+    """Hold a path, against other threads and, where ``fcntl`` exists, other processes."""
+    with _download_locks_lock:
+        lock = _download_locks.setdefault(path, threading.Lock())
+    with lock, open(f'{path}.lock', 'a') as lock_file:
+        if fcntl is not None:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+        yield
+
+class _ThrottledReader:
+    """Binary file object over a streamed response body, read under ``DOWNLOAD_BANDWIDTH``."""
+    def __init__(self, raw):
+        self.raw = raw
+        self.bytes_read = 0
+
+    def read(self, size=-1) -> bytes:
+        data = self.raw.read(size)
+        if DOWNLOAD_BANDWIDTH is not None and data:
+            DOWNLOAD_BANDWIDTH.acquire(len(data))
+        self.bytes_read += len(data)
+        return data
+
+def _extract_response(response, extract_path, member_filter) -> list:
+    reader = _ThrottledReader(response.raw)
+    try:
+        return extract_tar_gz_stream(reader, extract_path, member_filter)
+    finally:
+        metrics.incr('bytes_downloaded', reader.bytes_read)
+
+def download_and_extract(url, extract_path='.', member_filter=is_needed_member, download_dir=DEFAULT_DOWNLOAD_DIR):
+    """
+    Stream an OA package from url and extract the members the conversion needs.
+
+    Packages of ``RANGED_DOWNLOAD_BYTES`` or more, from a server accepting ranges, are
+    downloaded to download_dir by ``download_file`` instead, which resumes an interrupted
+    download, then extracted from there. ``download_dir=None`` always streams. Builds of
+    the same package take turns on its file, so one never removes it under another.
+
+    Streamed packages take one of the ``DOWNLOAD_SLOTS`` and are read under
+    ``DOWNLOAD_BANDWIDTH``, like the range requests of ``download_file``.
+    """
+    with metrics.span('download_extract'):
+        # a one byte range tells whether ranges are supported and the size of the package
+        with DOWNLOAD_SLOTS, get_client().get(url, headers={'Range': 'bytes=0-0', 'Accept-Encoding': 'identity'},
+                                              stream=True) as r:
+            r.raise_for_status()
+            match = _content_range.match(r.headers.get('Content-Range', ''))
+            if r.status_code != 206 or match is None:
+                # no range support: the answer is the whole package
+                return _extract_response(r, extract_path, member_filter)
+            size = int(match.group(1))
+        if download_dir is None or size < RANGED_DOWNLOAD_BYTES:
+            with DOWNLOAD_SLOTS, get_client().get(url, headers={'Accept-Encoding': 'identity'}, stream=True) as r:
+                r.raise_for_status()
+                return _extract_response(r, extract_path, member_filter)
+        os.makedirs(download_dir, exist_ok=True)
+        package_file = os.path.join(download_dir, os.path.basename(urlsplit(url).path))
+        with _exclusive(package_file):
+            download_file(url, package_file, expected_size=size)
+            try:
+                with open(package_file, 'rb') as f:
+                    return extract_tar_gz_stream(f, extract_path, member_filter)
+            finally:
+                os.remove(package_file)
 
 def fetch_json_from_url(url: str):
-    response = requests.get(url)
+    response = get_client().get(url)
     if response.status_code == 200:
         json_data = response.json()
         return json_data
@@ -28,7 +335,11 @@ def fetch_json_from_url(url: str):
 
 def get_pmc_ftp_url(pmc_id: str) -> (bool, str):
     """
-    Checks if a given PMC ID corresponds to an open access article using the provided OA API.
+    Checks if a given PMC ID corresponds to an open access article.
+
+    The local index of the OA file list (``src.oa_index``) answers first, when it was built;
+    IDs it does not list are checked with the OA API, whose answers are cached process-wide
+    for a day.
 
     Parameters:
         - pmc_id (str): The PubMed Central ID to check.
@@ -38,16 +349,49 @@ def get_pmc_ftp_url(pmc_id: str) -> (bool, str):
             bool: True if the PMC ID corresponds to an open access article, False otherwise.
             str: FTP address of the open access article package if open access, empty string otherwise.
     """
-    BASE_URL = "https://www.ncbi.nlm.nih.gov/pmc/utils/oa/oa.fcgi"
+    index = get_oa_index()
+    if index is not None:
+        entry = index.lookup(pmc_id)
+        if entry is not None:
+            metrics.incr('oa_index_hits')
+            return entry
+    return _lookup_oa_api(pmc_id)[:2]
+
+def get_pmc_package(pmc_id: str) -> (str, str):
+    """
+    Return the ftp address of the OA package of an article and when it was last updated.
+
+    Like ``get_pmc_ftp_url``, the local OA index answers first, then the OA API. The
+    update time identifies the package version; it is None when the source does not
+    give it.
+
+    :param pmc_id: The PubMed Central ID.
+    :type pmc_id: str
+    :return: The ftp address, empty if the article is not open access, and the update time.
+    :rtype: tuple[str, str or None]
+    """
+    index = get_oa_index()
+    if index is not None:
+        info = index.get_info(pmc_id)
+        if info is not None:
+            metrics.incr('oa_index_hits')
+            return info['url'], info['last_updated']
+    is_open_access, ftp_address, updated = _lookup_oa_api(pmc_id)
+    return ftp_address, updated
+
+@ttl_lru_cache('oa_status', maxsize=10000, ttl=24 * 3600)
+def _lookup_oa_api(pmc_id: str) -> (bool, str, str):
     params = {"id": pmc_id}
 
-    response = requests.get(BASE_URL, params=params)
+    NCBI_RATE_LIMITER.acquire()
+    with metrics.span('oa_lookup'):
+        response = get_client().get(OA_API_URL, params=params)
     tree = ET.fromstring(response.content)
 
     # Check for the error indicating non-open access
     error_element = tree.find(".//error[@code='idIsNotOpenAccess']")
     if error_element is not None:
-        return False, ""
+        return False, "", None
 
     # Check for the record indicating open access
     assert tree.find('request').attrib['id'] == pmc_id
@@ -57,20 +401,76 @@ def get_pmc_ftp_url(pmc_id: str) -> (bool, str):
         link_element = record_element.find(".//link[@format='tgz']")
         if link_element is not None:
             ftp_address = link_element.get("href")
-            return True, ftp_address
+            return True, ftp_address, link_element.get("updated")
 
-    return False, ""
+    return False, "", None
+
+def get_pmc_ftp_urls(pmc_ids: list, max_workers: int = 4) -> dict:
+    """
+    Resolve the open access status of many PMC IDs concurrently.
+
+    IDs listed in the local OA index are resolved in one query. The others are looked up
+    with the OA API; these lookups share ``NCBI_RATE_LIMITER``, so the batch never exceeds
+    the NCBI request rate however many workers are used. An ID whose lookup fails is
+    reported as not open access.
+
+    :param pmc_ids: The PubMed Central IDs to check.
+    :type pmc_ids: list[str]
+    :param max_workers: Maximum number of lookups in flight, defaults to 4.
+    :type max_workers: int, optional
+    :return: A dictionary mapping each PMC ID to the ``(is_open_access, ftp_address)`` tuple
+        returned by ``get_pmc_ftp_url``.
+    :rtype: dict
+    """
+    def lookup(pmc_id):
+        try:
+            return _lookup_oa_api(pmc_id)[:2]
+        except Exception:
+            return False, ""
+
+    pmc_ids = list(dict.fromkeys(pmc_ids))
+    index = get_oa_index()
+    found = index.lookup_many(pmc_ids) if index is not None else {}
+    metrics.incr('oa_index_hits', len(found))
+    missing = [pmc_id for pmc_id in pmc_ids if pmc_id not in found]
+    if missing:
+        with ThreadPoolExecutor(max_workers=min(max_workers, len(missing))) as executor:
+            found.update(zip(missing, executor.map(lookup, missing)))
+    return {pmc_id: found[pmc_id] for pmc_id in pmc_ids}
+
+IDCONV_URL = 'https://www.ncbi.nlm.nih.gov/pmc/utils/idconv/v1.0/'
+# largest number of IDs idconv converts in one request
+IDCONV_BATCH = 200
+
+def pmc_ids2pmids(pmc_ids: list) -> dict:
+    """
+    Convert PMC IDs to PMIDs with idconv, up to ``IDCONV_BATCH`` IDs per request.
+
+    :param pmc_ids: The PubMed Central IDs.
+    :type pmc_ids: list[str]
+    :return: A dictionary mapping each PMC ID that has a PMID to its PMID.
+    :rtype: dict
+    """
+    pmc_ids = list(dict.fromkeys(pmc_ids))
+    pmids = {}
+    for start in range(0, len(pmc_ids), IDCONV_BATCH):
+        params = {'ids': ','.join(pmc_ids[start:start + IDCONV_BATCH]), 'format': 'json'}
+        NCBI_RATE_LIMITER.acquire()
+        with metrics.span('idconv'):
+            records = get_client().get(IDCONV_URL, params=params).json().get('records', [])
+        for record in records:
+            if record.get('pmcid') and record.get('pmid'):
+                pmids[record['pmcid']] = record['pmid']
+    return pmids
 
 def pmc_id2pmid(pmc_id: str):
     '''
     input: a string of a PMC_ID
     return
     '''
-    url = f'https://www.ncbi.nlm.nih.gov/pmc/utils/idconv/v1.0/?ids={pmc_id}&format=json'
-    json_data = fetch_json_from_url(url)
-    pmid = [r['pmid'] for r in json_data['records'] if r['pmcid'] == pmc_id][0]
-    return pmid
+    return pmc_ids2pmids([pmc_id])[pmc_id]
 
+@ttl_lru_cache('title_search', maxsize=1024, ttl=3600)
 def search_pmc_by_title(title: str, max_results: int=10):
     """
     Search the PMC database by title and retrieve a list of PMCID ordered by relevance.
@@ -91,15 +491,96 @@ def search_pmc_by_title(title: str, max_results: int=10):
         "retmax": max_results
     }
 
-    response = requests.get(base_url, params=params)
+    with metrics.span('search'):
+        response = get_client().get(base_url, params=params)
     response_data = response.json()
 
     pmc_ids = response_data['esearchresult']['idlist']
 
     return pmc_ids
 
-def get_bioc_json(pmid):
-    url = f'https://www.ncbi.nlm.nih.gov/research/bionlp/RESTful/pmcoa.cgi/BioC_json/{pmid}/ascii'
-    req = requests.get(url)
+class SearchHit(NamedTuple):
+    """An open access article found by ``search_open_access``."""
+    pmc_id: str
+    title: str
+    authors: str
+    journal: str
+    pub_date: str
+
+class SearchResults(NamedTuple):
+    """A page of hits and the Entrez history entry of the search it comes from."""
+    hits: list
+    count: int
+    page: int
+    webenv: str
+    query_key: str
+
+def _summary_to_hit(uid: str, summary: dict) -> SearchHit:
+    authors = [author['name'] for author in summary.get('authors', []) if author.get('name')]
+    if len(authors) > 3:
+        authors = authors[:3] + ['et al.']
+    return SearchHit(
+        pmc_id=f'PMC{uid}',
+        title=summary.get('title') or 'Title not found',
+        authors=', '.join(authors),
+        journal=summary.get('fulljournalname') or summary.get('source', ''),
+        pub_date=summary.get('pubdate', ''),
+    )
+
+@ttl_lru_cache('open_access_search', maxsize=1024, ttl=3600)
+def _esearch_history(term: str) -> (int, str, str):
+    """Run an esearch on the history server, return the hit count, WebEnv and query_key."""
+    params = {"db": "pmc", "term": term, "usehistory": "y", "retmax": 0, "retmode": "json"}
+    NCBI_RATE_LIMITER.acquire()
+    with metrics.span('search'):
+        result = get_client().get(ESEARCH_URL, params=params).json()['esearchresult']
+    return int(result['count']), result['webenv'], result['querykey']
+
+@ttl_lru_cache('open_access_search_pages', maxsize=1024, ttl=3600)
+def _esummary_page(webenv: str, query_key: str, start: int, max_results: int) -> list:
+    params = {"db": "pmc", "WebEnv": webenv, "query_key": query_key, "retstart": start, "retmax": max_results,
+              "retmode": "json"}
+    NCBI_RATE_LIMITER.acquire()
+    with metrics.span('search_summary'):
+        result = get_client().get(ESUMMARY_URL, params=params).json().get('result', {})
+    return [_summary_to_hit(uid, result[uid]) for uid in result.get('uids', []) if uid in result]
+
+def search_open_access(title: str, max_results: int = 10, page: int = 0) -> SearchResults:
+    """
+    Search PMC open access articles by title and summarize a page of hits.
+
+    The open access filter is part of the esearch query, so every hit can be converted and
+    no per-hit OA lookup is needed. The search is stored on the Entrez history server:
+    the summaries of a page, titles included, come from one esummary call on it, and later
+    pages reuse the same search. Searches and pages are cached process-wide for an hour.
+
+    :param title: The title to search for.
+    :type title: str
+    :param max_results: Number of hits per page, defaults to 10.
+    :type max_results: int, optional
+    :param page: Page number, from 0.
+    :type page: int, optional
+    :return: The hits of the page, in relevance order, and the total number of hits.
+    :rtype: SearchResults
+    """
+    count, webenv, query_key = _esearch_history(f'({title}[Title]) AND "open access"[filter]')
+    start = page * max_results
+    hits = _esummary_page(webenv, query_key, start, max_results) if count > start else []
+    return SearchResults(hits, count, page, webenv, query_key)
+
+BIOC_URL = 'https://www.ncbi.nlm.nih.gov/research/bionlp/RESTful/pmcoa.cgi/BioC_json/{id}/{encoding}'
+
+def get_bioc_json(pmid, encoding='ascii'):
+    """
+    Download the BioC JSON of an open access article, by PMID or PMC ID.
+
+    :param encoding: 'ascii' or 'unicode', defaults to 'ascii'.
+    :type encoding: str, optional
+    """
+    NCBI_RATE_LIMITER.acquire()
+    with metrics.span('bioc'):
+        req = get_client().get(BIOC_URL.format(id=pmid, encoding=encoding))
+        req.raise_for_status()
+    metrics.incr('bytes_downloaded', len(req.content))
     reads = json.loads(req.content.decode('utf8'))
     return reads
@@ -0,0 +1,178 @@
+import argparse
+import csv
+import gzip
+import os
+import sqlite3
+import threading
+import time
+
+OA_FTP_ROOT = 'ftp://ftp.ncbi.nlm.nih.gov/pub/pmc/'
+DEFAULT_OA_INDEX = os.environ.get('PUBMED2EPUB_OA_INDEX', os.path.expanduser('~/.cache/pubmed2epub-oa_index.sqlite'))
+# SQLite's default limit of host parameters in one statement
+_BATCH = 900
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS articles (
+    pmc_id TEXT PRIMARY KEY,
+    package TEXT NOT NULL,
+    license TEXT,
+    pmid TEXT,
+    last_updated TEXT
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT) WITHOUT ROWID;
+'''
+
+def read_file_list(file_name: str):
+    """
+    Parse an OA file list, ``oa_file_list.csv`` or ``oa_file_list.txt``, optionally gzipped.
+
+    :return: Iterator of (PMC ID, package path, license, PMID, last updated).
+    :rtype: iterator[tuple]
+    """
+    opener = gzip.open if file_name.endswith('.gz') else open
+    with opener(file_name, 'rt', encoding='utf-8', newline='') as f:
+        first_line = f.readline()
+        if first_line.startswith('File,'):
+            # File,Article Citation,Accession ID,Last Updated (YYYY-MM-DD HH:MM:SS),PMID,License
+            for row in csv.reader(f):
+                if len(row) >= 6 and row[2].startswith('PMC'):
+                    yield row[2], row[0], row[5], row[4].removeprefix('PMID:') or None, row[3]
+        else:
+            # a timestamp line, then: package path, citation, PMC ID, PMID:n, license
+            for line in f:
+                row = line.rstrip('\n').split('\t')
+                if len(row) >= 3 and row[2].startswith('PMC'):
+                    pmid = row[3].removeprefix('PMID:') if len(row) > 3 else ''
+                    yield row[2], row[0], row[4] if len(row) > 4 else None, pmid or None, None
+
+class OAIndex:
+    """
+    SQLite index of the PMC OA file list: open access status and package of every article.
+
+    Lookups are primary key reads on a local file and take microseconds. Each thread gets
+    its own connection; the database is in WAL mode, so lookups go on during a refresh.
+
+    :param path: Path of the index database.
+    :type path: str
+    """
+    def __init__(self, path: str = DEFAULT_OA_INDEX):
+        self.path = path
+        self._local = threading.local()
+        self._connection().executescript(SCHEMA)
+
+    def _connection(self) -> sqlite3.Connection:
+        db = getattr(self._local, 'db', None)
+        if db is None:
+            db = sqlite3.connect(self.path, isolation_level=None)
+            db.execute('PRAGMA journal_mode=WAL')
+            db.execute('PRAGMA synchronous=NORMAL')
+            self._local.db = db
+        return db
+
+    @staticmethod
+    def _url(package: str) -> str:
+        return package if '://' in package else OA_FTP_ROOT + package
+
+    def lookup(self, pmc_id: str):
+        """
+        Return ``(True, ftp address)`` for an article of the OA file list, None if it is not listed.
+
+        :rtype: tuple[bool, str] or None
+        """
+        row = self._connection().execute('SELECT package FROM articles WHERE pmc_id = ?', (pmc_id,)).fetchone()
+        return None if row is None else (True, self._url(row[0]))
+
+    def lookup_many(self, pmc_ids: list) -> dict:
+        """Return ``(True, ftp address)`` by PMC ID for the listed articles among pmc_ids."""
+        pmc_ids = list(dict.fromkeys(pmc_ids))
+        found = {}
+        db = self._connection()
+        for start in range(0, len(pmc_ids), _BATCH):
+            batch = pmc_ids[start:start + _BATCH]
+            query = f"SELECT pmc_id, package FROM articles WHERE pmc_id IN ({','.join('?' * len(batch))})"
+            for pmc_id, package in db.execute(query, batch):
+                found[pmc_id] = (True, self._url(package))
+        return found
+
+    def get_info(self, pmc_id: str):
+        """Return the package and its ftp address, license, PMID and last update of a listed article, or None."""
+        row = self._connection().execute(
+            'SELECT package, license, pmid, last_updated FROM articles WHERE pmc_id = ?', (pmc_id,)).fetchone()
+        if row is None:
+            return None
+        return dict(zip(('package', 'license', 'pmid', 'last_updated'), row), url=self._url(row[0]))
+
+    def refresh(self, file_name: str) -> dict:
+        """
+        Bring the index up to date with a newer OA file list.
+
+        Only new or changed rows are written. Articles missing from the new list, which are
+        no longer open access, are removed.
+
+        :param file_name: Path of the OA file list.
+        :type file_name: str
+        :return: Numbers of rows in the list, rows written and rows removed.
+        :rtype: dict
+        """
+        db = self._connection()
+        listed = written = 0
+        db.execute('BEGIN IMMEDIATE')
+        try:
+            db.execute('CREATE TEMP TABLE seen (pmc_id TEXT PRIMARY KEY) WITHOUT ROWID')
+            rows = []
+            for record in read_file_list(file_name):
+                rows.append(record)
+                if len(rows) >= 10000:
+                    written += self._upsert(db, rows)
+                    listed += len(rows)
+                    rows = []
+            written += self._upsert(db, rows)
+            listed += len(rows)
+            removed = db.execute('DELETE FROM articles WHERE pmc_id NOT IN (SELECT pmc_id FROM temp.seen)').rowcount
+            db.execute('DROP TABLE temp.seen')
+            db.executemany('INSERT OR REPLACE INTO meta VALUES (?, ?)',
+                           [('source', os.path.abspath(file_name)), ('refreshed', time.strftime('%Y-%m-%d %H:%M:%S'))])
+            db.execute('COMMIT')
+        except BaseException:
+            db.execute('ROLLBACK')
+            raise
+        return {'listed': listed, 'written': written, 'removed': removed}
+
+    @staticmethod
+    def _upsert(db, rows) -> int:
+        """Insert new and update changed rows, return the number of rows written."""
+        db.executemany('INSERT OR IGNORE INTO temp.seen VALUES (?)', [(row[0],) for row in rows])
+        return db.executemany(
+            'INSERT INTO articles VALUES (?, ?, ?, ?, ?) ON CONFLICT (pmc_id) DO UPDATE SET '
+            'package = excluded.package, license = excluded.license, pmid = excluded.pmid, '
+            'last_updated = excluded.last_updated '
+            'WHERE articles.package IS NOT excluded.package OR articles.license IS NOT excluded.license '
+            'OR articles.pmid IS NOT excluded.pmid OR articles.last_updated IS NOT excluded.last_updated',
+            rows).rowcount
+
+    def __len__(self):
+        return self._connection().execute('SELECT COUNT(*) FROM articles').fetchone()[0]
+
+_index = None
+_index_lock = threading.Lock()
+
+def get_oa_index():
+    """Return the process-wide ``OAIndex`` if the index at ``DEFAULT_OA_INDEX`` was built, None otherwise."""
+    global _index
+    with _index_lock:
+        if _index is None and os.path.isfile(DEFAULT_OA_INDEX):
+            _index = OAIndex(DEFAULT_OA_INDEX)
+        return _index
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description='Build or refresh the local index of the PMC OA file list.')
+    parser.add_argument('file_list', help='oa_file_list.csv or oa_file_list.txt, optionally gzipped.')
+    parser.add_argument('--index', type=str, default=DEFAULT_OA_INDEX, help='Path of the index database.')
+    return parser.parse_args()
+
+if __name__ == '__main__':
+    args = parse_arguments()
+    start = time.perf_counter()
+    stats = OAIndex(args.index).refresh(args.file_list)
+    print(f"{stats['listed']} articles listed, {stats['written']} written, {stats['removed']} removed "
+          f'in {time.perf_counter() - start:.1f}s')
@@ -1,10 +1,14 @@
+import hashlib
 import os
-import re
 import shutil
+import tempfile
+import threading
+from collections import OrderedDict
+from copy import deepcopy
 
-import lxml
 from lxml import etree
-from lxml import html as lxml_html
+
+from src import metrics
 
 
 def to_unicode_string(node, method = 'xml'):
@@ -108,66 +112,110 @@ def parse_article(tree):
             <div class="keywords">Keywords: {', '.join(keywords)}</div>"""
     return title_div, (title, authors, abstract, keywords)
 
+def _xref_to_link(xref_element):
+    rid = xref_element.get('rid')
+    ref_type = xref_element.get('ref-type')
+    xref_element.attrib.clear()
+    xref_element.tag = 'a'
+    if rid:
+        xref_element.set('href', f'#{rid}')
+    if ref_type:
+        xref_element.set('ref-type', ref_type)
+
+def rewrite_xrefs(root):
+    """Turn every <xref> under root into an <a href="#rid"> link, in place."""
+    for xref_element in root.xpath('.//xref'):
+        _xref_to_link(xref_element)
+    return root
+
 def replace_xref_with_link(xml_string):
     root = etree.fromstring(xml_string)
-    xref_elements = root.xpath('.//xref')
-
-    for xref_element in xref_elements:
-        a_element = etree.Element('a')
-        rid = xref_element.get('rid')
-        ref_type = xref_element.get('ref-type')
-        if rid:
-            a_element.set('href', f'#{rid}')
-        if ref_type:
-            a_element.set('ref-type', ref_type)
-
-        for child in xref_element:
-            a_element.append(child)
-
-        a_element.text = xref_element.text
-        a_element.tail = xref_element.tail
-        xref_element.getparent().replace(xref_element, a_element)
-
+    rewrite_xrefs(root)
     html_string = to_unicode_string(root)
     return html_string
 
-def _get_caption(node):
-    p_element = node.xpath('./caption/p')
-    if p_element:
-        return to_unicode_string(p_element[0])
-    else:
-        return to_unicode_string(node)
+def _fig_to_figure(fig, fig_dir='figs'):
+    fig_id = fig.get('id')
+    fig_label = fig.xpath('string(./label)')
+    p_element = fig.xpath('./caption/p')
+    caption = p_element[0] if p_element else fig
+    fig_url = fig.xpath("./graphic/@*[local-name()='href']")[0]
+    # Create the new <figure> element
+    figure_elem = etree.Element('figure')
+    etree.SubElement(figure_elem, 'img', {
+        'src': f'{fig_dir}/{fig_url}.jpg',
+        'alt': fig_label,
+        'id': fig_id
+    })
+    figcaption_elem = etree.SubElement(figure_elem, 'figcaption')
+    caption = deepcopy(caption)
+    caption.tail = None
+    figcaption_elem.append(caption)
+    figure_elem.tail = fig.tail
+    # Replace the old <fig> element with the new <figure> element
+    fig.getparent().replace(fig, figure_elem)
+
+def rewrite_figs(root, fig_dir='figs'):
+    """Replace every <fig> under root with an html <figure> showing {fig_dir}/{graphic}.jpg, in place."""
+    for fig in root.xpath('.//fig'):
+        _fig_to_figure(fig, fig_dir)
+    return root
 
 def convert_figs(xml_text):
     xml_text = f'<dummyroot>{xml_text}</dummyroot>'
     #parser = etree.XMLParser(recover=True)  # recover from bad characters.
     root = etree.fromstring(xml_text)
-    for fig in root.xpath('//fig'):
-        fig_id = fig.get('id')
-        fig_label = fig.xpath('string(./label)')
-        caption_elem = fig.find('caption')
-        caption_text = _get_caption(fig)
-        fig_url = fig.xpath("./graphic/@*[local-name()='href']")[0]
-        # Create the new <figure> element
-        figure_elem = etree.Element('figure')
-        img_elem = etree.SubElement(figure_elem, 'img', {
-            'src': f'figs/{fig_url}.jpg',
-            'alt': fig_label,
-            'id': fig_id
-        })
-        #figcaption_elem = etree.SubElement(figure_elem, 'figcaption')
-        figcaption_elem = etree.SubElement(figure_elem, 'figcaption')
-
-        # Create an HTML fragment for the figcaption content
-        #figcaption_content = f'{fig_label}: {caption_text}'
-        figcaption_content = caption_text
-        figcaption_fragment = lxml_html.fragment_fromstring(figcaption_content)
-        figcaption_elem.append(figcaption_fragment)
-        # Replace the old <fig> element with the new <figure> element
-        fig.getparent().replace(fig, figure_elem)
-
+    rewrite_figs(root)
     return ''.join([to_unicode_string(child) for child in root])
 
+def _render_section(sec, level, elements, parts):
+    level += 1
+    title_elem = sec.find('title')
+    if title_elem is None:
+        return
+
+    title, sec_id = title_elem.text, sec.get('id')
+    elements.append({'type': sec.tag, 'data': {'text': title, 'level': level, 'section': sec_id}})
+    parts.append(f'<h{level} id="{sec_id}">{title}</h{level}>')
+    for child in sec:
+        if child.tag == 'sec':
+            _render_section(child, level, elements, parts)
+        elif child.tag != 'title':
+            parts.append(to_unicode_string(child))
+
+def _is_top_level(sec):
+    # directly in a <body>, or in a container such as <boxed-text> that is not itself in a section
+    for ancestor in sec.iterancestors():
+        if ancestor.tag == 'sec':
+            return False
+        if ancestor.tag == 'body':
+            return True
+    return False
+
+def render_body(tree, fig_dir='figs'):
+    """
+    Render the article body in a single pass over the parsed tree.
+
+    Xrefs and figures are rewritten in place, then every titled section is
+    emitted exactly once, nested sections one heading level deeper. The bodies
+    of sub-articles, such as decision letters and author responses, follow the
+    body of the article, their sections at the top level.
+
+    :param tree: The parsed nxml document.
+    :param fig_dir: Directory of the figures, relative to the html page.
+    :type fig_dir: str, optional
+    :return: The section entries (same shape as ``collect_elements``) and the body html.
+    :rtype: tuple[list[dict], str]
+    """
+    elements, parts = [], []
+    for body in tree.iter('body'):
+        rewrite_xrefs(body)
+        rewrite_figs(body, fig_dir)
+        for sec in body.iter('sec'):
+            if _is_top_level(sec):
+                _render_section(sec, 0, elements, parts)
+    return elements, ''.join(parts)
+
 def create_toc_section(elements, section_title = 'Table of content', list_type = 'ul'):
     assert list_type == 'ol' or list_type == 'ul'
     # Loop through each text and id
@@ -193,6 +241,18 @@ def add_header_to_list(html_output, section_title = 'Table of content', list_typ
         end = '</ol>\n'
     return head + html_output + end
 
+_find_references = etree.XPath('.//ref-list/ref[@id]')
+_find_given_names = etree.XPath('given-names/text()')
+_find_surnames = etree.XPath('surname/text()')
+_find_comments = etree.XPath('.//comment')
+_find_doi = etree.XPath("string(pub-id[@pub-id-type='doi'])")
+_find_pmid = etree.XPath("string(pub-id[@pub-id-type='pmid'])")
+
+# formatted citations shared by all articles converted in this process, keyed by citation_key
+CITATION_CACHE_SIZE = 20000
+_citation_cache = OrderedDict()
+_citation_cache_lock = threading.Lock()
+
 def find_text(ref, tag):
     node = ref.find(tag)
     return (node.text or "").strip() if node is not None else ""
@@ -202,28 +262,29 @@ def find_names(ref, tag):
     names = []
     for n in nodes:
         if tag == "name":
-            name_parts = [t.text or "" for t in n.getchildren()]
+            name_parts = [t.text or "" for t in n]
             name = " ".join(name_parts[::-1]).strip()
             names.append(name)
         elif tag == "person-group":
             for person in n:
-                given_names = person.xpath("given-names/text()")
-                surnames = person.xpath("surname/text()")
+                given_names = _find_given_names(person)
+                surnames = _find_surnames(person)
                 name = " ".join(given_names + surnames).strip()
                 names.append(name)
     return ', '.join([s for s in names if s])
 
-def get_reference_entry(reference):
-    ref_id = reference.attrib.get("id", "")
-    mixed_citation = reference.find("mixed-citation")
-    element_citation = reference.find("element-citation")
-    ref = mixed_citation if mixed_citation is not None else element_citation
-
-    if ref is None:
-        return None  # Return None or some other default value if ref is not found
-
+def citation_key(ref):
+    """Stable identity of a citation: its DOI, else its PMID, else a hash of its markup."""
+    doi = _find_doi(ref).strip()
+    if doi:
+        return f'doi:{doi.lower()}'
+    pmid = _find_pmid(ref).strip()
+    if pmid:
+        return f'pmid:{pmid}'
+    return 'sha1:' + hashlib.sha1(etree.tostring(ref, with_tail=False)).hexdigest()
+
+def format_citation(ref):
     publication_type = ref.attrib.get("publication-type", "")
-    journal_type = next(iter(ref.attrib.values()), "")  # Grab the first attribute value, if any
 
     names = find_names(ref, "name") or find_names(ref, "person-group")
     article_title = find_text(ref, "article-title").replace("\n", " ").strip()
@@ -232,17 +293,116 @@ def get_reference_entry(reference):
 
     if article_title != '' or journal != '':
         text = [names, article_title, f'<i>{journal}</i>', year]
-        text = ', '.join([s for s in text if s])
+        return ', '.join([s for s in text if s])
     elif publication_type == 'webpage':
-        text = to_unicode_string(ref.xpath('.//comment')[0], method='text')
+        return to_unicode_string(_find_comments(ref)[0], method='text')
     else:
-        text = to_unicode_string(ref, method='text').replace('\n', '')
+        return to_unicode_string(ref, method='text').replace('\n', '')
+
+def _cached_format_citation(ref):
+    key = citation_key(ref)
+    with _citation_cache_lock:
+        text = _citation_cache.get(key)
+        if text is not None:
+            _citation_cache.move_to_end(key)
+            return text
+    text = format_citation(ref)
+    with _citation_cache_lock:
+        _citation_cache[key] = text
+        if len(_citation_cache) > CITATION_CACHE_SIZE:
+            _citation_cache.popitem(last=False)
+    return text
+
+def get_reference_entry(reference):
+    ref_id = reference.attrib.get("id", "")
+    mixed_citation = reference.find("mixed-citation")
+    ref = mixed_citation if mixed_citation is not None else reference.find("element-citation")
+
+    if ref is None:
+        return None  # Return None or some other default value if ref is not found
+
+    text = _cached_format_citation(ref)
     return f'<li id="{ref_id}" epub:type="footnote">{text}</li>\n'
 
 def create_reference_section(tree, section_title = 'References', list_type = 'ol'):
     assert list_type == 'ol' or list_type == 'ul'
-    references = tree.xpath(".//ref-list/ref[@id]")
-    html_output = ''
-    for ref in references:
-        html_output += get_reference_entry(ref)
+    entries = [get_reference_entry(ref) for ref in _find_references(tree)]
+    metrics.incr('references', len(entries))
+    html_output = ''.join([entry for entry in entries if entry])
     return  add_header_to_list(html_output, section_title, list_type)
+
+def _free(elem):
+    # drop an element that has been rendered, and the already rendered siblings before it
+    elem.clear()
+    parent = elem.getparent()
+    if parent is not None:
+        while elem.getprevious() is not None:
+            del parent[0]
+
+def _in_sub_article(elem):
+    return any(ancestor.tag == 'sub-article' for ancestor in elem.iterancestors())
+
+def render_article_incremental(source, body_out, refs_out, fig_dir='figs'):
+    """
+    Render an nxml document while it is parsed, freeing each part once it is written.
+
+    Front matter, top-level body sections and references are rendered as soon as their
+    closing tag is read, in the order ``render_body`` renders them, so memory is bounded
+    by the largest section rather than by the whole document.
+
+    :param source: Path or binary file object of the nxml document.
+    :param body_out: Text file the body html is written to.
+    :param refs_out: Text file the reference list entries are written to.
+    :param fig_dir: Directory of the figures, relative to the html page.
+    :type fig_dir: str, optional
+    :return: The article title, the title page div and the section entries of the toc.
+    :rtype: tuple[str, str, list[dict]]
+    """
+    title, title_div, elements = '', '', []
+    for _, elem in etree.iterparse(source, events=('end',), tag=('front', 'sec', 'ref')):
+        parent = elem.getparent()
+        parent_tag = parent.tag if parent is not None else None
+        if elem.tag == 'front':
+            if _in_sub_article(elem):
+                continue  # decision letters and replies have their own front matter
+            title_div, (title, authors, abstract, keywords) = parse_article(elem)
+        elif elem.tag == 'sec':
+            if not _is_top_level(elem):
+                continue  # nested sections are rendered with their top-level section
+            rewrite_xrefs(elem)
+            rewrite_figs(elem, fig_dir)
+            parts = []
+            _render_section(elem, 0, elements, parts)
+            body_out.write(''.join(parts))
+        elif elem.tag == 'ref':
+            if parent_tag != 'ref-list' or elem.get('id') is None:
+                continue
+            entry = get_reference_entry(elem)
+            if entry:
+                refs_out.write(entry)
+                metrics.incr('references')
+        _free(elem)
+    return title, title_div, elements
+
+def write_html_incremental(nxml_file, file_name='output.html', fig_dir='figs'):
+    """
+    Convert an nxml file to an html page with ``render_article_incremental``.
+
+    Body and references are spooled to temporary files and copied into the page, so
+    they are never held in memory as a whole.
+    """
+    marker = '\0content\0'
+    with tempfile.TemporaryFile('w+') as body_out, tempfile.TemporaryFile('w+') as refs_out:
+        title, title_div, elements = render_article_incremental(nxml_file, body_out, refs_out, fig_dir)
+        page_head, page_tail = add_title_page(title, title_div, marker).split(marker)
+        refs_head, refs_tail = add_header_to_list(marker, section_title = 'References', list_type = 'ol').split(marker)
+        with open(file_name, 'w') as f:
+            f.write(page_head)
+            f.write(create_toc_section(elements, section_title = 'Table of content', list_type = 'ul'))
+            body_out.seek(0)
+            shutil.copyfileobj(body_out, f)
+            f.write(refs_head)
+            refs_out.seek(0)
+            shutil.copyfileobj(refs_out, f)
+            f.write(refs_tail)
+            f.write(page_tail)
@@ -0,0 +1,118 @@
+import os
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+import pytest
+
+# the modules import each other as ``src.*`` and top-level scripts from the repository root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture
+def serve():
+    """Start a local ``ThreadingHTTPServer`` with the given handler class, return its base URL."""
+    servers = []
+
+    def start(handler_class) -> str:
+        server = ThreadingHTTPServer(('127.0.0.1', 0), handler_class)
+        threading.Thread(target=server.serve_forever, kwargs={'poll_interval': 0.05}, daemon=True).start()
+        servers.append(server)
+        return f'http://127.0.0.1:{server.server_port}'
+
+    yield start
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+
+@pytest.fixture
+def client(monkeypatch):
+    """A fresh ``HttpClient`` with a short backoff, used by every ``get_client()`` call."""
+    from src import http_client
+    test_client = http_client.HttpClient(timeout=(2, 5), backoff_factor=0.01)
+    monkeypatch.setattr(http_client, '_client', test_client)
+    return test_client
+
+@pytest.fixture
+def css_file() -> str:
+    return os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'styles', 'style.css')
+
+def _write_page(html_dir, pmc_id):
+    os.makedirs(html_dir, exist_ok=True)
+    with open(os.path.join(html_dir, f'{pmc_id}.html'), 'w', encoding='utf-8') as f:
+        f.write(f'<html><head><title>{pmc_id}</title></head><body><p>Text of {pmc_id}.</p></body></html>')
+
+@pytest.fixture
+def html_pages():
+    """Write a minimal html page for each given PMC ID, as ``make_pmc_html.main`` would."""
+    def write(html_dir, pmc_ids):
+        for pmc_id in pmc_ids:
+            _write_page(html_dir, pmc_id)
+    return write
+
+@pytest.fixture
+def fake_conversion(monkeypatch):
+    """Replace ``make_pmc_html.main`` with one writing a minimal page; return the converted PMC IDs."""
+    import make_pmc_html
+    from src import metrics
+    converted = []
+
+    def main(pmc_id, html_dir, image_profile='default', **kwargs):
+        with metrics.span('render'):
+            _write_page(html_dir, pmc_id)
+            metrics.incr('articles')
+        converted.append(pmc_id)
+
+    monkeypatch.setattr(make_pmc_html, 'main', main)
+    return converted
+
+OPEN_ACCESS = {'PMC1', 'PMC2', 'PMC3'}
+
+class OAHandler(BaseHTTPRequestHandler):
+    """Minimal OA web service: PMC1-3 are open access; ``failures`` maps an ID to statuses answered first."""
+    requests = []
+    failures = {}
+    lock = threading.Lock()
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        pmc_id = parse_qs(urlsplit(self.path).query)['id'][0]
+        with self.lock:
+            self.requests.append((pmc_id, time.monotonic()))
+            failure = self.failures.get(pmc_id)
+            if failure:
+                self.failures[pmc_id] = failure[1:] or None
+        if failure:
+            self.send_response(failure[0])
+            self.send_header('Retry-After', '0')
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        if pmc_id in OPEN_ACCESS:
+            body = (f'<OA><request id="{pmc_id}"/><records><record id="{pmc_id}">'
+                    f'<link format="tgz" href="ftp://ftp.example.org/{pmc_id}.tar.gz"/></record></records></OA>')
+        else:
+            body = f'<OA><request id="{pmc_id}"/><error code="idIsNotOpenAccess">not OA</error></OA>'
+        body = body.encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/xml')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+@pytest.fixture
+def oa_service(serve, client, monkeypatch):
+    """Point the OA API at a local ``OAHandler``, without an OA index or rate limit and with an empty cache."""
+    from src import oa_api_helper
+    OAHandler.requests = []
+    OAHandler.failures = {}
+    monkeypatch.setattr(oa_api_helper, 'OA_API_URL', serve(OAHandler) + '/oa.fcgi')
+    monkeypatch.setattr(oa_api_helper, 'get_oa_index', lambda: None)
+    monkeypatch.setattr(oa_api_helper, 'NCBI_RATE_LIMITER', oa_api_helper.TokenBucket(rate=1000))
+    oa_api_helper._lookup_oa_api.cache.clear()
+    yield OAHandler
+    oa_api_helper._lookup_oa_api.cache.clear()
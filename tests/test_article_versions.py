@@ -0,0 +1,61 @@
+import os
+import shutil
+
+import make_pmc_html
+from src import image_optimizer, oa_api_helper
+from src.article_cache import ArticleCache
+
+NXML_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures', 'PMC0000002.nxml')
+
+
+def _fake_package(monkeypatch, updated):
+    """Answer every lookup with the given last update and record the package downloads."""
+    downloads = []
+
+    def download_article(url, extract_path):
+        downloads.append(url)
+        os.makedirs(os.path.join(extract_path, 'PMC2'))
+        shutil.copyfile(NXML_FILE, os.path.join(extract_path, 'PMC2', 'PMC2.nxml'))
+
+    monkeypatch.setattr(oa_api_helper, 'get_pmc_package',
+                        lambda pmc_id: (f'ftp://ftp.example.org/{pmc_id}.tar.gz', updated[0]))
+    monkeypatch.setattr(make_pmc_html, 'download_article', download_article)
+    return downloads
+
+
+def test_updated_package_is_downloaded_again(tmp_path, monkeypatch):
+    cache = ArticleCache(str(tmp_path / 'cache'))
+    updated = ['2020-01-31 12:00:00']
+    downloads = _fake_package(monkeypatch, updated)
+
+    first = make_pmc_html.get_article_dir('PMC2', cache)
+    assert make_pmc_html.get_article_dir('PMC2', cache) == first
+    updated[0] = '2021-06-01 08:30:00'
+    second = make_pmc_html.get_article_dir('PMC2', cache)
+
+    assert len(downloads) == 2
+    assert os.path.basename(first) == 'PMC2.20200131120000'
+    assert os.path.basename(second) == 'PMC2.20210601083000'
+
+
+class EvictingCache(ArticleCache):
+    """Evicts the entry right after handing it out the first time."""
+    evicted = False
+
+    def get_or_fetch(self, pmc_id, populate, version=None):
+        path = super().get_or_fetch(pmc_id, populate, version)
+        if not self.evicted:
+            self.evicted = True
+            shutil.rmtree(path)
+        return path
+
+
+def test_entry_evicted_before_it_is_read_is_fetched_again(tmp_path, monkeypatch):
+    cache = EvictingCache(str(tmp_path / 'cache'))
+    downloads = _fake_package(monkeypatch, ['2020-01-31 12:00:00'])
+    monkeypatch.setattr(image_optimizer, '_image_cache', ArticleCache(str(tmp_path / 'images')))
+
+    make_pmc_html.main('PMC2', str(tmp_path / 'html'), cache)
+
+    assert len(downloads) == 2
+    assert 'Reply section' in (tmp_path / 'html' / 'PMC2.html').read_text()
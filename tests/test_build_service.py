@@ -0,0 +1,90 @@
+import json
+import os
+import threading
+import time
+import urllib.error
+import urllib.request
+from types import SimpleNamespace
+
+import pytest
+
+import build_service
+
+
+@pytest.fixture
+def builds(monkeypatch):
+    """Replace the conversion with one that waits for ``release`` and records its articles."""
+    builds = SimpleNamespace(calls=[], release=threading.Event())
+
+    def convert_articles(pmc_ids, output_file, **kwargs):
+        builds.calls.append(pmc_ids)
+        builds.release.wait(5)
+        with open(output_file, 'wb') as f:
+            f.write(b'epub')
+
+    monkeypatch.setattr(build_service, 'convert_articles', convert_articles)
+    return builds
+
+
+def _wait_done(job):
+    deadline = time.monotonic() + 5
+    while job.status not in (build_service.DONE, build_service.FAILED) and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert job.status == build_service.DONE
+
+
+def _post(base_url, request):
+    data = json.dumps(request).encode('utf-8')
+    try:
+        with urllib.request.urlopen(urllib.request.Request(base_url + '/jobs', data=data, method='POST')) as r:
+            return r.status, json.load(r)
+    except urllib.error.HTTPError as e:
+        return e.code, json.load(e)
+
+
+def test_identical_submissions_share_one_build(tmp_path, builds, serve):
+    service = build_service.BuildService(str(tmp_path))
+    base_url = serve(type('Handler', (build_service.BuildRequestHandler,), {'service': service}))
+
+    first = _post(base_url, {'pmc_ids': ['PMC2', 'PMC1']})
+    second = _post(base_url, {'pmc_ids': 'PMC1,PMC2'})
+    builds.release.set()
+    _wait_done(service.get(first[1]['id']))
+    service.shutdown()
+
+    assert (first[0], second[0]) == (202, 200)
+    assert first[1]['id'] == second[1]['id']
+    assert builds.calls == [['PMC1', 'PMC2']]
+
+
+@pytest.mark.parametrize('option', ['kepub', 'text_only'])
+def test_options_must_be_json_booleans(tmp_path, builds, serve, option):
+    service = build_service.BuildService(str(tmp_path))
+    base_url = serve(type('Handler', (build_service.BuildRequestHandler,), {'service': service}))
+
+    status, answer = _post(base_url, {'pmc_ids': ['PMC1'], option: 'false'})
+
+    assert status == 400 and option in answer['error']
+    assert builds.calls == []
+
+
+def test_job_is_kept_while_its_artifact_is_read(tmp_path, builds):
+    builds.release.set()
+    service = build_service.BuildService(str(tmp_path), max_jobs=1)
+    old, _ = service.submit(['PMC1'])
+    _wait_done(old)
+
+    with service.open_artifact(old) as f:
+        new, _ = service.submit(['PMC2'])
+        _wait_done(new)
+        assert f.read() == b'epub'
+        assert service.get(old.id) is old
+    # forgotten once the download is over and another job comes in
+    newest, _ = service.submit(['PMC3'])
+    _wait_done(newest)
+    service.shutdown()
+
+    assert service.get(old.id) is None
+    assert not os.path.exists(tmp_path / old.id)
+    with service.open_artifact(old) as f:
+        assert f is None
@@ -0,0 +1,52 @@
+import io
+import os
+import tarfile
+
+import pytest
+import requests
+
+import make_pmc_html
+from src import oa_api_helper
+from src.article_cache import ArticleCache
+
+NXML_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures', 'PMC0000002.nxml')
+
+
+@pytest.fixture
+def bulk_cache(tmp_path, monkeypatch):
+    """An article cache holding PMC2, ingested from a bulk archive."""
+    with open(NXML_FILE, 'rb') as f:
+        nxml = f.read()
+    archive_file = str(tmp_path / 'oa_comm_xml.PMC000xxxxxx.tar.gz')
+    with tarfile.open(archive_file, 'w:gz') as archive:
+        info = tarfile.TarInfo('PMC000xxxxxx/PMC2.xml')
+        info.size = len(nxml)
+        archive.addfile(info, io.BytesIO(nxml))
+    cache = ArticleCache(str(tmp_path / 'cache'))
+    monkeypatch.setattr(make_pmc_html, 'get_cache', lambda: cache)
+
+    ingested, failures = make_pmc_html.ingest_bulk_archives([archive_file], workers=1)
+
+    assert (ingested, failures) == (['PMC2'], {})
+    return cache
+
+
+def test_bulk_articles_are_kept_apart_from_packages(bulk_cache, monkeypatch):
+    monkeypatch.setattr(oa_api_helper, 'get_pmc_package', lambda pmc_id: ('ftp://ftp.example.org/PMC2.tar.gz', None))
+    monkeypatch.setattr(make_pmc_html, 'download_article',
+                        lambda url, extract_path: os.makedirs(os.path.join(extract_path, 'PMC2')))
+
+    assert os.path.basename(make_pmc_html.get_article_dir('PMC2', bulk_cache, bulk=True)) == 'PMC2.bulk'
+    # online, the full package with its figures is downloaded
+    assert os.path.basename(make_pmc_html.get_article_dir('PMC2', bulk_cache)) == 'PMC2'
+
+
+def test_bulk_article_is_used_offline(bulk_cache, monkeypatch):
+    def offline(pmc_id):
+        raise requests.ConnectionError('offline')
+
+    monkeypatch.setattr(oa_api_helper, 'get_pmc_package', offline)
+
+    assert os.path.basename(make_pmc_html.get_article_dir('PMC2', bulk_cache)) == 'PMC2.bulk'
+    with pytest.raises(requests.ConnectionError):
+        make_pmc_html.get_article_dir('PMC3', bulk_cache)
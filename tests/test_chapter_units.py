@@ -0,0 +1,41 @@
+import os
+import zipfile
+
+import convert
+import make_epub
+from src.article_cache import ArticleCache
+
+
+class EvictedCache(ArticleCache):
+    """Claims every unit is cached, then loses it before the build reads it."""
+    def has(self, pmc_id, version=None):
+        return True
+
+
+class VanishingCache(ArticleCache):
+    """Hands out unit directories that are evicted before they are read."""
+    def get_or_fetch(self, pmc_id, populate, version=None):
+        return os.path.join(self.root, 'evicted')
+
+
+def _chapters(epub_file):
+    with zipfile.ZipFile(epub_file) as book:
+        return sorted(name for name in book.namelist() if name.endswith('.xhtml') and 'nav' not in name)
+
+
+def test_unit_evicted_after_the_build_skipped_converting(tmp_path, fake_conversion, css_file):
+    cache = EvictedCache(str(tmp_path / 'chapters'), name='chapter_cache')
+    output_file = str(tmp_path / 'book.epub')
+
+    convert.convert_articles(['PMC1', 'PMC2'], output_file, str(tmp_path / 'html'), css_file, chapter_cache=cache)
+
+    assert _chapters(output_file) == ['EPUB/PMC1.xhtml', 'EPUB/PMC2.xhtml']
+
+
+def test_unit_evicted_while_being_read(tmp_path, fake_conversion, css_file):
+    cache = VanishingCache(str(tmp_path / 'chapters'), name='chapter_cache')
+    output_file = str(tmp_path / 'book.epub')
+
+    make_epub.main(['PMC1'], str(tmp_path / 'html'), output_file, css_file, chapter_cache=cache)
+
+    assert _chapters(output_file) == ['EPUB/PMC1.xhtml']
@@ -0,0 +1,31 @@
+import os
+import re
+import zipfile
+
+from PIL import Image
+
+import make_epub
+
+PAGE = ('<html><head><title>PMC1</title></head><body><p>Results</p>'
+        '<figure><img src="figs/PMC1/fig1.jpg" alt="Figure 1" id="F1"/><figcaption><p>First figure.</p></figcaption>'
+        '</figure><figure><img src="figs/PMC1/fig2.jpg" alt="Figure 2" id="F2"/>'
+        '<figcaption><p>Undecodable figure.</p></figcaption></figure></body></html>')
+
+
+def test_images_without_a_file_are_left_out(tmp_path, css_file):
+    html_dir = tmp_path / 'html'
+    os.makedirs(html_dir / 'figs' / 'PMC1')
+    (html_dir / 'PMC1.html').write_text(PAGE)
+    # fig2 could not be decoded, so no file was written for it
+    Image.new('RGB', (10, 10)).save(html_dir / 'figs' / 'PMC1' / 'fig1.jpg')
+    output_file = str(tmp_path / 'book.epub')
+
+    make_epub.main(['PMC1'], str(html_dir), output_file, css_file)
+
+    with zipfile.ZipFile(output_file) as epub:
+        chapter = epub.read('EPUB/PMC1.xhtml').decode('utf-8')
+        manifest = epub.read('EPUB/content.opf').decode('utf-8')
+    sources = re.findall(r'<img [^>]*src="([^"]+)"', chapter)
+    assert len(sources) == 1
+    assert f'href="{sources[0]}"' in manifest
+    assert 'First figure.' in chapter and 'Undecodable figure.' in chapter
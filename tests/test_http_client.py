@@ -0,0 +1,54 @@
+from http.server import BaseHTTPRequestHandler
+
+import pytest
+
+from src import http_client, oa_api_helper
+
+
+class FlakyHandler(BaseHTTPRequestHandler):
+    """Answers 503 to the first request of each path, 200 afterwards."""
+    seen = set()
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        status = 200 if self.path in self.seen else 503
+        self.seen.add(self.path)
+        self.send_response(status)
+        self.send_header('Content-Length', '2')
+        self.end_headers()
+        self.wfile.write(b'ok')
+
+
+def test_stats_count_requests_and_retries_per_endpoint(serve, client):
+    FlakyHandler.seen = set()
+    base_url = serve(FlakyHandler)
+
+    assert client.get(base_url + '/a').status_code == 200
+    assert client.get(base_url + '/a').status_code == 200
+    assert client.get(base_url + '/b').status_code == 200
+
+    stats = client.get_stats()
+    endpoint_a = base_url.removeprefix('http://') + '/a'
+    assert stats[endpoint_a]['requests'] == 2
+    assert stats[endpoint_a]['retries'] == 1
+    assert stats[endpoint_a]['errors'] == 0
+    assert f'pubmed2epub_http_retries_total{{endpoint="{endpoint_a}"}} 1' in client.to_prometheus()
+
+
+def test_configure_client_replaces_the_shared_client(monkeypatch):
+    monkeypatch.setattr(http_client, '_client', None)
+    client = http_client.configure_client(timeout=(1, 2), retries=0)
+
+    assert http_client.get_client() is client
+    assert client.timeout == (1, 2)
+    assert client.session.get_adapter('https://').max_retries.total == 0
+
+
+@pytest.mark.parametrize('status', [429, 500, 503])
+def test_throttled_and_failed_requests_are_retried(oa_service, status):
+    oa_service.failures['PMC2'] = [status, status]
+
+    assert oa_api_helper.get_pmc_ftp_url('PMC2') == (True, 'ftp://ftp.example.org/PMC2.tar.gz')
+    assert [pmc_id for pmc_id, _ in oa_service.requests] == ['PMC2'] * 3
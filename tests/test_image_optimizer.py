@@ -0,0 +1,37 @@
+import os
+
+from PIL import Image
+
+from src import image_optimizer
+from src.article_cache import ArticleCache
+
+
+def _figures(src_dir, count):
+    os.makedirs(src_dir)
+    for n in range(count):
+        Image.new('RGB', (400, 300), (n * 40, 0, 0)).save(os.path.join(src_dir, f'fig{n}.png'))
+    Image.new('RGB', (100, 100)).save(os.path.join(src_dir, 'photo.jpg'))
+
+
+def test_derivative_cache_stays_in_budget(tmp_path):
+    _figures(tmp_path / 'src', 5)
+    cache = ArticleCache(str(tmp_path / 'cache'), max_bytes=4000, name='image_cache')
+
+    figures = image_optimizer.optimize_figures(str(tmp_path / 'src'), str(tmp_path / 'out'), cache=cache)
+
+    assert len(figures) == 6
+    assert cache.get_stats()['bytes'] <= 4000
+    assert cache.get_stats()['evictions'] > 0
+
+
+def test_decompression_bomb_falls_back_to_original(tmp_path, monkeypatch):
+    _figures(tmp_path / 'src', 2)
+    cache = ArticleCache(str(tmp_path / 'cache'), name='image_cache')
+    monkeypatch.setattr(Image, 'MAX_IMAGE_PIXELS', 1000)
+
+    figures = image_optimizer.optimize_figures(str(tmp_path / 'src'), str(tmp_path / 'out'), cache=cache)
+
+    # the PNGs are dropped, the JPEG is shipped unchanged
+    assert [os.path.basename(figure) for figure in figures] == ['photo.jpg']
+    with open(figures[0], 'rb') as f, open(tmp_path / 'src' / 'photo.jpg', 'rb') as original:
+        assert f.read() == original.read()
@@ -0,0 +1,39 @@
+import os
+
+import pytest
+
+import make_pmc_html
+from src.oa_parser import write_html_incremental
+
+FIXTURES = [
+    os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'benchmarks', 'fixtures',
+                 'PMC0000001.nxml'),
+    # with a boxed section, a decision letter and an author response as sub-articles
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures', 'PMC0000002.nxml'),
+]
+
+
+@pytest.mark.parametrize('nxml_file', FIXTURES, ids=os.path.basename)
+def test_incremental_output_matches_tree_output(nxml_file, tmp_path):
+    tree_file, incremental_file = tmp_path / 'tree.html', tmp_path / 'incremental.html'
+
+    make_pmc_html._render_html(nxml_file, str(tree_file), 'figs/PMC1')
+    write_html_incremental(nxml_file, str(incremental_file), 'figs/PMC1')
+
+    assert incremental_file.read_text() == tree_file.read_text()
+
+
+@pytest.mark.parametrize('incremental', [False, True], ids=['tree', 'incremental'])
+def test_boxed_and_sub_article_sections_are_rendered_once(incremental, tmp_path):
+    html_file = tmp_path / 'article.html'
+    if incremental:
+        write_html_incremental(FIXTURES[1], str(html_file), 'figs/PMC1')
+    else:
+        make_pmc_html._render_html(FIXTURES[1], str(html_file), 'figs/PMC1')
+
+    html = html_file.read_text()
+    for heading in ('<h1 id="box1-sec1">Box section</h1>', '<h1 id="sa1-sec1">Review section</h1>',
+                    '<h1 id="sa2-sec1">Reply section</h1>'):
+        assert html.count(heading) == 1
+    assert html.index('Reply section</h1>') > html.index('Review section</h1>') > html.index('<h1 id="sec2">')
+    assert 'A small open access article' in html
@@ -0,0 +1,52 @@
+import time
+
+import pytest
+
+from src import oa_api_helper
+from src.metadata_cache import TTLCache, ttl_lru_cache
+
+
+def test_least_recently_used_entry_is_evicted():
+    cache = TTLCache(maxsize=2)
+    cache.set('a', 1)
+    cache.set('b', 2)
+    assert cache.get('a') == 1
+    cache.set('c', 3)
+
+    assert cache.get('b') is None
+    assert (cache.get('a'), cache.get('c')) == (1, 3)
+    assert cache.stats()['evictions'] == 1
+
+
+def test_entries_expire():
+    cache = TTLCache(ttl=0.05)
+    cache.set('a', 1)
+    cache.set('b', 2, ttl=60)
+    time.sleep(0.1)
+
+    assert cache.get('a') is None
+    assert cache.get('b') == 2
+    assert cache.stats()['expirations'] == 1
+
+
+def test_exceptions_are_not_cached():
+    calls = []
+
+    @ttl_lru_cache('test_exceptions_are_not_cached')
+    def lookup(key):
+        calls.append(key)
+        if len(calls) == 1:
+            raise ValueError(key)
+        return key
+
+    with pytest.raises(ValueError):
+        lookup('a')
+    assert lookup('a') == 'a'
+    assert lookup('a') == 'a'
+    assert calls == ['a', 'a']
+
+
+def test_batch_lookup_is_cached(oa_service):
+    oa_api_helper.get_pmc_ftp_urls(['PMC1', 'PMC2'])
+    oa_api_helper.get_pmc_ftp_urls(['PMC1', 'PMC2'])
+    assert len(oa_service.requests) == 2
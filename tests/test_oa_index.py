@@ -0,0 +1,37 @@
+from src import oa_api_helper
+from src.oa_index import OAIndex
+
+HEADER = 'File,Article Citation,Accession ID,Last Updated (YYYY-MM-DD HH:MM:SS),PMID,License\n'
+
+
+def _file_list(path, rows):
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write(HEADER)
+        for pmc_id, updated in rows:
+            f.write(f'oa_package/00/00/{pmc_id}.tar.gz,Citation,{pmc_id},{updated},PMID:1,CC BY\n')
+    return str(path)
+
+
+def test_refresh_writes_changed_rows_and_removes_unlisted(tmp_path):
+    index = OAIndex(str(tmp_path / 'index.sqlite'))
+    first = _file_list(tmp_path / 'first.csv', [('PMC1', '2020-01-01 00:00:00'), ('PMC2', '2020-01-01 00:00:00')])
+    assert index.refresh(first) == {'listed': 2, 'written': 2, 'removed': 0}
+
+    second = _file_list(tmp_path / 'second.csv', [('PMC1', '2021-01-01 00:00:00')])
+    assert index.refresh(second) == {'listed': 1, 'written': 1, 'removed': 1}
+    assert index.lookup('PMC2') is None
+    assert index.get_info('PMC1')['last_updated'] == '2021-01-01 00:00:00'
+
+
+def test_listed_ids_bypass_the_oa_api(tmp_path, oa_service, monkeypatch):
+    index = OAIndex(str(tmp_path / 'index.sqlite'))
+    index.refresh(_file_list(tmp_path / 'list.csv', [('PMC1', '2020-01-01 00:00:00')]))
+    monkeypatch.setattr(oa_api_helper, 'get_oa_index', lambda: index)
+
+    assert oa_api_helper.get_pmc_ftp_url('PMC1') == (
+        True, 'ftp://ftp.ncbi.nlm.nih.gov/pub/pmc/oa_package/00/00/PMC1.tar.gz')
+    results = oa_api_helper.get_pmc_ftp_urls(['PMC1', 'PMC2'])
+
+    assert results['PMC2'] == (True, 'ftp://ftp.example.org/PMC2.tar.gz')
+    # only the ID missing from the index reached the OA API
+    assert [pmc_id for pmc_id, _ in oa_service.requests] == ['PMC2']
@@ -0,0 +1,44 @@
+import time
+
+from src import oa_api_helper
+
+
+def test_batch_lookup_returns_per_id_results(oa_service):
+    results = oa_api_helper.get_pmc_ftp_urls(['PMC1', 'PMC9', 'PMC2', 'PMC1', 'PMC3'])
+
+    assert list(results) == ['PMC1', 'PMC9', 'PMC2', 'PMC3']
+    assert results['PMC1'] == (True, 'ftp://ftp.example.org/PMC1.tar.gz')
+    assert results['PMC9'] == (False, '')
+    # duplicates are looked up once
+    assert sorted(pmc_id for pmc_id, _ in oa_service.requests) == ['PMC1', 'PMC2', 'PMC3', 'PMC9']
+
+
+def test_failed_lookup_is_reported_not_open_access(oa_service, client):
+    client.session.get_adapter('http://').max_retries.total = 1
+    oa_service.failures['PMC3'] = [500, 500, 500]
+
+    results = oa_api_helper.get_pmc_ftp_urls(['PMC1', 'PMC3'])
+    assert results == {'PMC1': (True, 'ftp://ftp.example.org/PMC1.tar.gz'), 'PMC3': (False, '')}
+
+
+def test_batch_lookup_respects_rate_limit(oa_service, monkeypatch):
+    monkeypatch.setattr(oa_api_helper, 'NCBI_RATE_LIMITER', oa_api_helper.TokenBucket(rate=20, capacity=1))
+    pmc_ids = [f'PMC{n}' for n in range(10, 20)]
+
+    oa_api_helper.get_pmc_ftp_urls(pmc_ids, max_workers=8)
+
+    times = sorted(t for _, t in oa_service.requests)
+    assert len(times) == 10
+    # one token up front, then 20 per second for the other nine requests
+    assert times[-1] - times[0] >= 9 / 20 * 0.9
+
+
+def test_token_bucket_allows_burst_then_rate():
+    bucket = oa_api_helper.TokenBucket(rate=50, capacity=5)
+    start = time.monotonic()
+    for _ in range(5):
+        bucket.acquire()
+    assert time.monotonic() - start < 0.05
+    for _ in range(5):
+        bucket.acquire()
+    assert time.monotonic() - start >= 5 / 50 * 0.9
@@ -0,0 +1,30 @@
+import convert
+from src import metrics
+
+
+def test_prefetched_article_metrics_reach_the_build_recording(fake_conversion):
+    prefetcher = convert.ArticlePrefetcher()
+    for pmc_id in ('PMC1', 'PMC2'):
+        # prepared outside any recording, like articles selected in the app
+        prefetcher.submit(pmc_id)
+
+    with metrics.recording() as build_metrics:
+        prefetcher.wait(['PMC1', 'PMC2'])
+
+    data = build_metrics.to_dict()
+    assert data['counters']['articles'] == 2
+    assert data['spans']['render']['count'] == 2
+
+
+def test_merge_adds_spans_and_counters():
+    total, part = metrics.Metrics(), metrics.Metrics()
+    total.record_span('fetch', 1.0)
+    part.record_span('fetch', 3.0)
+    part.incr('figures', 4)
+
+    total.merge(part)
+
+    assert total.to_dict() == {
+        'spans': {'fetch': {'count': 2, 'total_seconds': 4.0, 'max_seconds': 3.0}},
+        'counters': {'figures': 4},
+    }
@@ -0,0 +1,270 @@
+import hashlib
+import io
+import json
+import os
+import re
+import tarfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler
+
+import pytest
+import requests
+
+from src import oa_api_helper
+
+CHUNK = 64 * 1024
+
+
+class RangeHandler(BaseHTTPRequestHandler):
+    """
+    File server with Range and If-Range support.
+
+    ``ranges = False`` ignores Range headers; requests after ``fail_after`` send half of
+    their body and drop the connection.
+    """
+    data = b''
+    etag = '"v1"'
+    ranges = True
+    fail_after = None
+    delay = 0
+    requests = []
+    in_flight = 0
+    max_in_flight = 0
+    lock = threading.Lock()
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        cls = type(self)
+        with cls.lock:
+            cls.requests.append(self.headers.get('Range'))
+            number = len(cls.requests)
+            cls.in_flight += 1
+            cls.max_in_flight = max(cls.max_in_flight, cls.in_flight)
+        try:
+            time.sleep(cls.delay)
+            self._answer(number)
+        finally:
+            with cls.lock:
+                cls.in_flight -= 1
+
+    def _answer(self, number):
+        cls = type(self)
+        data = cls.data
+        match = re.match(r'bytes=(\d+)-(\d+)', self.headers.get('Range') or '')
+        if_range = self.headers.get('If-Range')
+        if match and cls.ranges and (if_range is None or if_range == cls.etag):
+            start, end = int(match.group(1)), min(int(match.group(2)), len(data) - 1)
+            body = data[start:end + 1]
+            self.send_response(206)
+            self.send_header('Content-Range', f'bytes {start}-{end}/{len(data)}')
+        else:
+            body = data
+            self.send_response(200)
+        if cls.ranges:
+            self.send_header('Accept-Ranges', 'bytes')
+        self.send_header('ETag', cls.etag)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        if cls.fail_after is not None and number > cls.fail_after:
+            self.wfile.write(body[:len(body) // 2])
+            self.wfile.flush()
+            self.close_connection = True
+            self.connection.shutdown(1)
+            return
+        self.wfile.write(body)
+
+
+@pytest.fixture
+def server(serve, client, monkeypatch):
+    handler = type('Handler', (RangeHandler,), {'data': os.urandom(10 * CHUNK + 123), 'requests': []})
+    monkeypatch.setattr(oa_api_helper, 'DOWNLOAD_BANDWIDTH', None)
+    handler.url = serve(handler) + '/PMC1.tar.gz'
+    return handler
+
+
+def _ranges(handler):
+    """Start offsets of the chunk requests, without the one byte probe."""
+    return sorted(int(r.split('=')[1].split('-')[0]) for r in handler.requests if r and r != 'bytes=0-0')
+
+
+def test_download_in_ranges(server, tmp_path):
+    target = str(tmp_path / 'pkg.tar.gz')
+    oa_api_helper.download_file(server.url, target, expected_size=len(server.data),
+                                checksum=hashlib.md5(server.data).hexdigest(), chunk_bytes=CHUNK, workers=4)
+
+    with open(target, 'rb') as f:
+        assert f.read() == server.data
+    assert _ranges(server) == [n * CHUNK for n in range(11)]
+    assert os.listdir(tmp_path) == ['pkg.tar.gz']
+
+
+def test_resume_from_part_file_and_state(server, tmp_path):
+    target = str(tmp_path / 'pkg.tar.gz')
+    server.fail_after = 4  # the probe and three chunks succeed
+    with pytest.raises(requests.RequestException):
+        oa_api_helper.download_file(server.url, target, chunk_bytes=CHUNK, workers=1)
+    with open(f'{target}.part.json') as f:
+        done = json.load(f)['done']
+    assert done == [0, 1, 2]
+    assert os.path.getsize(f'{target}.part') == len(server.data)
+
+    server.fail_after = None
+    server.requests = []
+    oa_api_helper.download_file(server.url, target, chunk_bytes=CHUNK, workers=4)
+
+    with open(target, 'rb') as f:
+        assert f.read() == server.data
+    # only the missing chunks are fetched again
+    assert _ranges(server) == [n * CHUNK for n in range(3, 11)]
+    assert not os.path.exists(f'{target}.part') and not os.path.exists(f'{target}.part.json')
+
+
+def test_file_changed_since_partial_download_restarts(server, tmp_path):
+    target = str(tmp_path / 'pkg.tar.gz')
+    server.fail_after = 4
+    with pytest.raises(requests.RequestException):
+        oa_api_helper.download_file(server.url, target, chunk_bytes=CHUNK, workers=1)
+
+    server.fail_after = None
+    server.requests = []
+    server.data = os.urandom(len(server.data))
+    server.etag = '"v2"'
+    oa_api_helper.download_file(server.url, target, chunk_bytes=CHUNK, workers=4)
+
+    with open(target, 'rb') as f:
+        assert f.read() == server.data
+    assert _ranges(server) == [n * CHUNK for n in range(11)]
+
+
+def test_file_changed_during_download_is_dropped(server, tmp_path, monkeypatch):
+    target = str(tmp_path / 'pkg.tar.gz')
+    download_ranges = oa_api_helper._download_ranges
+
+    def change_after_probe(*args, **kwargs):
+        # the chunk requests carry If-Range "v1" and get the whole new file instead of a range
+        server.etag = '"v2"'
+        return download_ranges(*args, **kwargs)
+
+    monkeypatch.setattr(oa_api_helper, '_download_ranges', change_after_probe)
+    with pytest.raises(ValueError, match='changed'):
+        oa_api_helper.download_file(server.url, target, chunk_bytes=CHUNK, workers=2)
+    assert os.listdir(tmp_path) == []
+
+
+def test_checksum_mismatch_removes_partial_file(server, tmp_path):
+    target = str(tmp_path / 'pkg.tar.gz')
+    with pytest.raises(ValueError, match='md5'):
+        oa_api_helper.download_file(server.url, target, checksum='0' * 32, chunk_bytes=CHUNK)
+    assert os.listdir(tmp_path) == []
+
+
+def test_size_mismatch_is_rejected(server, tmp_path):
+    with pytest.raises(ValueError, match='bytes'):
+        oa_api_helper.download_file(server.url, str(tmp_path / 'pkg.tar.gz'), expected_size=1, chunk_bytes=CHUNK)
+    assert os.listdir(tmp_path) == []
+
+
+def test_server_without_ranges_gets_a_single_get(server, tmp_path):
+    server.ranges = False
+    target = str(tmp_path / 'pkg.tar.gz')
+
+    oa_api_helper.download_file(server.url, target, expected_size=len(server.data), chunk_bytes=CHUNK)
+
+    with open(target, 'rb') as f:
+        assert f.read() == server.data
+    assert len(server.requests) == 1
+    assert os.listdir(tmp_path) == ['pkg.tar.gz']
+
+
+def test_bandwidth_cap(server, tmp_path, monkeypatch):
+    rate = 1024 * 1024
+    monkeypatch.setattr(oa_api_helper, 'DOWNLOAD_BANDWIDTH', oa_api_helper.TokenBucket(rate=rate, capacity=CHUNK))
+
+    start = time.monotonic()
+    oa_api_helper.download_file(server.url, str(tmp_path / 'pkg.tar.gz'), chunk_bytes=CHUNK, workers=4)
+
+    # the bucket starts full, every other byte waits for the rate
+    assert time.monotonic() - start >= (len(server.data) - CHUNK) / rate * 0.9
+
+
+def test_concurrency_cap(server, tmp_path, monkeypatch):
+    monkeypatch.setattr(oa_api_helper, 'DOWNLOAD_SLOTS', threading.BoundedSemaphore(2))
+    server.delay = 0.02
+
+    oa_api_helper.download_file(server.url, str(tmp_path / 'pkg.tar.gz'), chunk_bytes=CHUNK, workers=8)
+
+    assert server.max_in_flight == 2
+
+
+def _package(members):
+    buffer = io.BytesIO()
+    with tarfile.open(fileobj=buffer, mode='w:gz') as archive:
+        for name, content in members:
+            info = tarfile.TarInfo(name)
+            info.size = len(content)
+            archive.addfile(info, io.BytesIO(content))
+    return buffer.getvalue()
+
+
+def test_concurrent_extractions_of_one_large_package(server, tmp_path, monkeypatch):
+    server.data = _package([('PMC1/a.nxml', b'<article/>'), ('PMC1/fig1.jpg', os.urandom(4 * CHUNK)),
+                            ('PMC1/supplement.pdf', b'pdf')])
+    monkeypatch.setattr(oa_api_helper, 'RANGED_DOWNLOAD_BYTES', CHUNK)
+    monkeypatch.setattr(oa_api_helper, 'DOWNLOAD_CHUNK_BYTES', CHUNK)
+    download_dir = str(tmp_path / 'downloads')
+    results, errors = {}, []
+
+    def extract(number):
+        try:
+            extracted = oa_api_helper.download_and_extract(server.url, str(tmp_path / f'build{number}'),
+                                                           download_dir=download_dir)
+            results[number] = sorted(os.path.relpath(path, tmp_path / f'build{number}') for path in extracted)
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=extract, args=(number,)) for number in range(3)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert errors == []
+    assert results == {number: ['PMC1/a.nxml', 'PMC1/fig1.jpg'] for number in range(3)}
+    assert [name for name in os.listdir(download_dir) if not name.endswith('.lock')] == []
+    # the size is probed with one byte ranges, the package is never requested whole
+    assert None not in server.requests
+
+
+def test_streamed_package_takes_a_slot_and_bandwidth(server, tmp_path, monkeypatch):
+    server.data = _package([('PMC1/a.nxml', b'<article/>'), ('PMC1/fig1.jpg', os.urandom(4 * CHUNK))])
+    slots = threading.BoundedSemaphore(1)
+    rate = 1024 * 1024
+    monkeypatch.setattr(oa_api_helper, 'DOWNLOAD_SLOTS', slots)
+    monkeypatch.setattr(oa_api_helper, 'DOWNLOAD_BANDWIDTH', oa_api_helper.TokenBucket(rate=rate, capacity=CHUNK))
+    results = []
+
+    slots.acquire()
+    thread = threading.Thread(target=lambda: results.append(
+        oa_api_helper.download_and_extract(server.url, str(tmp_path / 'build'), download_dir=None)))
+    thread.start()
+    time.sleep(0.2)
+    assert server.requests == []  # waiting for the slot
+    start = time.monotonic()
+    slots.release()
+    thread.join()
+
+    assert len(results[0]) == 2
+    assert time.monotonic() - start >= (len(server.data) - CHUNK) / rate * 0.9
+
+
+def test_package_from_server_without_ranges_is_extracted_from_one_get(server, tmp_path):
+    server.data = _package([('PMC1/a.nxml', b'<article/>')])
+    server.ranges = False
+
+    extracted = oa_api_helper.download_and_extract(server.url, str(tmp_path / 'build'), download_dir=str(tmp_path))
+
+    assert [os.path.basename(path) for path in extracted] == ['a.nxml']
+    assert len(server.requests) == 1
@@ -0,0 +1,34 @@
+import os
+
+import pytest
+
+import make_epub
+
+
+def test_volumes_are_split_by_article_count(tmp_path, html_pages, css_file):
+    html_pages(tmp_path / 'html', ['PMC1', 'PMC2', 'PMC3'])
+
+    files = make_epub.make_volumes(['PMC1', 'PMC2', 'PMC3'], str(tmp_path / 'html'),
+                                   str(tmp_path / 'ebook.kepub.epub'), css_file, kepub=True, max_articles=2)
+
+    assert [os.path.basename(f) for f in files] == ['ebook.vol01.kepub.epub', 'ebook.vol02.kepub.epub']
+
+
+def test_failed_build_leaves_no_partial_epub(tmp_path, html_pages, css_file):
+    html_pages(tmp_path / 'html', ['PMC1'])
+
+    with pytest.raises(FileNotFoundError):
+        # PMC2 has no html page
+        make_epub.main(['PMC1', 'PMC2'], str(tmp_path / 'html'), str(tmp_path / 'ebook.epub'), css_file)
+
+    assert sorted(os.listdir(tmp_path)) == ['html']
+
+
+def test_failed_volume_removes_the_other_volumes(tmp_path, html_pages, css_file):
+    html_pages(tmp_path / 'html', ['PMC1', 'PMC2', 'PMC3'])
+
+    with pytest.raises(FileNotFoundError):
+        make_epub.make_volumes(['PMC1', 'PMC2', 'PMC3', 'PMC4'], str(tmp_path / 'html'),
+                               str(tmp_path / 'ebook.epub'), css_file, max_articles=2)
+
+    assert sorted(os.listdir(tmp_path)) == ['html']